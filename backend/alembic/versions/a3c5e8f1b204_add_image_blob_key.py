@@ -0,0 +1,31 @@
+"""Add image blob key
+
+Revision ID: a3c5e8f1b204
+Revises: f2a9c7e41d58
+Create Date: 2026-10-17 23:40:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a3c5e8f1b204'
+down_revision: Union[str, Sequence[str], None] = 'f2a9c7e41d58'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('images', sa.Column('blob_key', sa.String(length=255), nullable=True))
+    op.create_index(op.f('ix_images_blob_key'), 'images', ['blob_key'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_images_blob_key'), table_name='images')
+    # Not in batch mode: recreating the table would drop the search index triggers
+    op.drop_column('images', 'blob_key')
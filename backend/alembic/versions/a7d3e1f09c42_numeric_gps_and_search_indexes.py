@@ -0,0 +1,89 @@
+"""Store GPS coordinates as numbers and index location and capture date
+
+Revision ID: a7d3e1f09c42
+Revises: e4b8c2d5a913
+Create Date: 2026-10-17 20:30:00.000000
+
+"""
+from typing import Optional, Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a7d3e1f09c42'
+down_revision: Union[str, Sequence[str], None] = 'e4b8c2d5a913'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+BATCH_SIZE = 5000
+
+
+def _coordinate(value: Optional[str], limit: float) -> Optional[float]:
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return None
+    return number if -limit <= number <= limit else None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    images = sa.table(
+        'images',
+        sa.column('id', sa.Integer),
+        sa.column('gps_latitude', sa.String),
+        sa.column('gps_longitude', sa.String),
+    )
+    connection = op.get_bind()
+
+    # Normalise the stored strings first, so the type change below is a plain
+    # cast: unparsable or out-of-range coordinates become NULL
+    last_id = 0
+    while True:
+        rows = connection.execute(
+            sa.select(images.c.id, images.c.gps_latitude, images.c.gps_longitude)
+            .where(images.c.id > last_id)
+            .where(sa.or_(images.c.gps_latitude.isnot(None), images.c.gps_longitude.isnot(None)))
+            .order_by(images.c.id)
+            .limit(BATCH_SIZE)
+        ).all()
+        if not rows:
+            break
+        updates = []
+        for image_id, latitude, longitude in rows:
+            latitude, longitude = _coordinate(latitude, 90), _coordinate(longitude, 180)
+            if latitude is None or longitude is None:
+                latitude = longitude = None
+            updates.append({
+                'image_id': image_id,
+                'latitude': repr(latitude) if latitude is not None else None,
+                'longitude': repr(longitude) if longitude is not None else None,
+            })
+        connection.execute(
+            images.update()
+            .where(images.c.id == sa.bindparam('image_id'))
+            .values(gps_latitude=sa.bindparam('latitude'), gps_longitude=sa.bindparam('longitude')),
+            updates
+        )
+        last_id = rows[-1].id
+
+    with op.batch_alter_table('images') as batch_op:
+        batch_op.alter_column('gps_latitude', existing_type=sa.String(), type_=sa.Float(),
+                              existing_nullable=True, postgresql_using='gps_latitude::double precision')
+        batch_op.alter_column('gps_longitude', existing_type=sa.String(), type_=sa.Float(),
+                              existing_nullable=True, postgresql_using='gps_longitude::double precision')
+    op.create_index('ix_images_gps', 'images', ['gps_latitude', 'gps_longitude', 'id', 'date_taken'], unique=False)
+    op.create_index('ix_images_date_taken_id', 'images', ['date_taken', 'id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_images_date_taken_id', table_name='images')
+    op.drop_index('ix_images_gps', table_name='images')
+    with op.batch_alter_table('images') as batch_op:
+        batch_op.alter_column('gps_latitude', existing_type=sa.Float(), type_=sa.String(),
+                              existing_nullable=True, postgresql_using='gps_latitude::varchar')
+        batch_op.alter_column('gps_longitude', existing_type=sa.Float(), type_=sa.String(),
+                              existing_nullable=True, postgresql_using='gps_longitude::varchar')
@@ -0,0 +1,31 @@
+"""Add image content hash
+
+Revision ID: b51d0c8e2f47
+Revises: 7c2f4e9a1b3d
+Create Date: 2026-10-17 18:30:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b51d0c8e2f47'
+down_revision: Union[str, Sequence[str], None] = '7c2f4e9a1b3d'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('images', sa.Column('content_hash', sa.String(length=64), nullable=True))
+    op.create_index(op.f('ix_images_content_hash'), 'images', ['content_hash'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_images_content_hash'), table_name='images')
+    with op.batch_alter_table('images') as batch_op:
+        batch_op.drop_column('content_hash')
@@ -0,0 +1,60 @@
+"""Add upload sessions and resumable uploads
+
+Revision ID: b8d41f6e2c75
+Revises: a3c5e8f1b204
+Create Date: 2026-10-18 09:30:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b8d41f6e2c75'
+down_revision: Union[str, Sequence[str], None] = 'a3c5e8f1b204'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('upload_sessions',
+    sa.Column('id', sa.String(length=32), nullable=False),
+    sa.Column('group_id', sa.Integer(), nullable=True),
+    sa.Column('status', sa.String(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.Column('expires_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['group_id'], ['image_groups.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_upload_sessions_group_id'), 'upload_sessions', ['group_id'], unique=False)
+    op.create_index(op.f('ix_upload_sessions_expires_at'), 'upload_sessions', ['expires_at'], unique=False)
+    op.create_table('resumable_uploads',
+    sa.Column('id', sa.String(length=32), nullable=False),
+    sa.Column('session_id', sa.String(length=32), nullable=True),
+    sa.Column('original_filename', sa.String(), nullable=True),
+    sa.Column('stored_filename', sa.String(), nullable=True),
+    sa.Column('upload_length', sa.BigInteger(), nullable=True),
+    sa.Column('upload_offset', sa.BigInteger(), nullable=True),
+    sa.Column('status', sa.String(), nullable=True),
+    sa.Column('image_id', sa.Integer(), nullable=True),
+    sa.Column('result', sa.JSON(), nullable=True),
+    sa.Column('error', sa.String(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['image_id'], ['images.id'], ),
+    sa.ForeignKeyConstraint(['session_id'], ['upload_sessions.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_resumable_uploads_session_id'), 'resumable_uploads', ['session_id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_resumable_uploads_session_id'), table_name='resumable_uploads')
+    op.drop_table('resumable_uploads')
+    op.drop_index(op.f('ix_upload_sessions_expires_at'), table_name='upload_sessions')
+    op.drop_index(op.f('ix_upload_sessions_group_id'), table_name='upload_sessions')
+    op.drop_table('upload_sessions')
@@ -0,0 +1,146 @@
+"""Add full-text search index over content analysis
+
+Revision ID: c4e19b7d2a60
+Revises: a7d3e1f09c42
+Create Date: 2026-10-17 21:40:00.000000
+
+The index is kept up to date by triggers on ``images``, so it follows every
+write of ``content_analysis``: finished analysis jobs, cached results stored
+at upload time and backfills alike. Results with an ``error`` key are not
+indexed.
+
+Postgres keeps a weighted ``tsvector`` per image in ``image_search_index``
+with a GIN index. SQLite uses the FTS5 virtual table ``image_search_fts``
+with the image ID as rowid. Neither is part of the ORM models; see
+``services/search.py``.
+
+Note for later SQLite migrations: a batch operation that recreates the
+``images`` table drops its triggers, which then have to be created again.
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c4e19b7d2a60'
+down_revision: Union[str, Sequence[str], None] = 'a7d3e1f09c42'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Must match SEARCH_TEXT_CONFIG in services/search.py
+TEXT_CONFIG = 'english'
+
+POSTGRES_DOCUMENT = " || ".join(
+    f"setweight(to_tsvector('{TEXT_CONFIG}', coalesce({{row}}.content_analysis->>'{field}', '')), '{weight}')"
+    for field, weight in (
+        ('description', 'A'),
+        ('key_elements', 'B'),
+        ('activities', 'B'),
+        ('location_type', 'C'),
+        ('time_and_weather', 'D'),
+    )
+)
+
+SQLITE_FIELDS = ('description', 'key_elements', 'activities', 'location_type', 'time_and_weather')
+SQLITE_VALUES = ", ".join(f"json_extract({{row}}.content_analysis, '$.{field}')" for field in SQLITE_FIELDS)
+SQLITE_INDEXABLE = (
+    "CASE WHEN json_valid({row}.content_analysis) THEN json_type({row}.content_analysis) END = 'object' "
+    "AND json_type({row}.content_analysis, '$.error') IS NULL"
+)
+
+
+def upgrade_postgresql() -> None:
+    op.create_table('image_search_index',
+    sa.Column('image_id', sa.Integer(), nullable=False),
+    sa.Column('document', postgresql.TSVECTOR(), nullable=False),
+    sa.ForeignKeyConstraint(['image_id'], ['images.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('image_id')
+    )
+    op.create_index('ix_image_search_index_document', 'image_search_index', ['document'],
+                    unique=False, postgresql_using='gin')
+    op.execute(f"""
+        CREATE FUNCTION image_search_index_update() RETURNS trigger AS $$
+        BEGIN
+            DELETE FROM image_search_index WHERE image_id = NEW.id;
+            IF json_typeof(NEW.content_analysis) = 'object' AND NEW.content_analysis->>'error' IS NULL THEN
+                INSERT INTO image_search_index (image_id, document)
+                VALUES (NEW.id, {POSTGRES_DOCUMENT.format(row='NEW')});
+            END IF;
+            RETURN NEW;
+        END
+        $$ LANGUAGE plpgsql
+    """)
+    op.execute("""
+        CREATE TRIGGER images_search_index
+        AFTER INSERT OR UPDATE OF content_analysis ON images
+        FOR EACH ROW EXECUTE FUNCTION image_search_index_update()
+    """)
+    op.execute(f"""
+        INSERT INTO image_search_index (image_id, document)
+        SELECT images.id, {POSTGRES_DOCUMENT.format(row='images')}
+        FROM images
+        WHERE json_typeof(images.content_analysis) = 'object' AND images.content_analysis->>'error' IS NULL
+    """)
+
+
+def upgrade_sqlite() -> None:
+    op.execute(
+        f"CREATE VIRTUAL TABLE image_search_fts USING fts5({', '.join(SQLITE_FIELDS)}, tokenize='porter unicode61')"
+    )
+    # Field weights for the default ``rank``, in column order
+    op.execute("INSERT INTO image_search_fts(image_search_fts, rank) VALUES ('rank', 'bm25(10.0, 5.0, 5.0, 2.0, 1.0)')")
+    columns = ", ".join(SQLITE_FIELDS)
+    op.execute(f"""
+        CREATE TRIGGER images_search_fts_insert AFTER INSERT ON images
+        WHEN {SQLITE_INDEXABLE.format(row='NEW')}
+        BEGIN
+            INSERT INTO image_search_fts (rowid, {columns}) VALUES (NEW.id, {SQLITE_VALUES.format(row='NEW')});
+        END
+    """)
+    op.execute(f"""
+        CREATE TRIGGER images_search_fts_update AFTER UPDATE OF content_analysis ON images
+        BEGIN
+            DELETE FROM image_search_fts WHERE rowid = OLD.id;
+            INSERT INTO image_search_fts (rowid, {columns})
+            SELECT NEW.id, {SQLITE_VALUES.format(row='NEW')} WHERE {SQLITE_INDEXABLE.format(row='NEW')};
+        END
+    """)
+    op.execute("""
+        CREATE TRIGGER images_search_fts_delete AFTER DELETE ON images
+        BEGIN
+            DELETE FROM image_search_fts WHERE rowid = OLD.id;
+        END
+    """)
+    op.execute(f"""
+        INSERT INTO image_search_fts (rowid, {columns})
+        SELECT images.id, {SQLITE_VALUES.format(row='images')} FROM images
+        WHERE {SQLITE_INDEXABLE.format(row='images')}
+    """)
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    dialect = op.get_bind().dialect.name
+    if dialect == 'postgresql':
+        upgrade_postgresql()
+    elif dialect == 'sqlite':
+        upgrade_sqlite()
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    dialect = op.get_bind().dialect.name
+    if dialect == 'postgresql':
+        op.execute("DROP TRIGGER IF EXISTS images_search_index ON images")
+        op.execute("DROP FUNCTION IF EXISTS image_search_index_update()")
+        op.drop_index('ix_image_search_index_document', table_name='image_search_index')
+        op.drop_table('image_search_index')
+    elif dialect == 'sqlite':
+        op.execute("DROP TRIGGER IF EXISTS images_search_fts_delete")
+        op.execute("DROP TRIGGER IF EXISTS images_search_fts_update")
+        op.execute("DROP TRIGGER IF EXISTS images_search_fts_insert")
+        op.execute("DROP TABLE IF EXISTS image_search_fts")
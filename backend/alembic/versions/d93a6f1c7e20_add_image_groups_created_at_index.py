@@ -0,0 +1,28 @@
+"""Add image groups created_at index
+
+Revision ID: d93a6f1c7e20
+Revises: b51d0c8e2f47
+Create Date: 2026-10-17 19:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd93a6f1c7e20'
+down_revision: Union[str, Sequence[str], None] = 'b51d0c8e2f47'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index('ix_image_groups_created_at_id', 'image_groups', ['created_at', 'id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_image_groups_created_at_id', table_name='image_groups')
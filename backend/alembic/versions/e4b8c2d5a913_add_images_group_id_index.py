@@ -0,0 +1,28 @@
+"""Add images group_id index
+
+Revision ID: e4b8c2d5a913
+Revises: d93a6f1c7e20
+Create Date: 2026-10-17 19:20:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e4b8c2d5a913'
+down_revision: Union[str, Sequence[str], None] = 'd93a6f1c7e20'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index('ix_images_group_id_id', 'images', ['group_id', 'id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_images_group_id_id', table_name='images')
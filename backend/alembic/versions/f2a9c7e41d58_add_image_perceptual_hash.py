@@ -0,0 +1,29 @@
+"""Add image perceptual hash
+
+Revision ID: f2a9c7e41d58
+Revises: c4e19b7d2a60
+Create Date: 2026-10-17 22:10:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f2a9c7e41d58'
+down_revision: Union[str, Sequence[str], None] = 'c4e19b7d2a60'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('images', sa.Column('perceptual_hash', sa.BigInteger(), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    # Not in batch mode: recreating the table would drop the search index triggers
+    op.drop_column('images', 'perceptual_hash')
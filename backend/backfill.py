@@ -0,0 +1,298 @@
+"""Re-run metadata extraction and content analysis over stored images.
+
+Walks the ``images`` table in ID order, in chunks of ``--chunk-size``, and
+reads every selected image from the blob store (``STORAGE_BACKEND``) or, for
+images not migrated to it yet, from the uploads directory. By default only images
+whose analysis failed are selected: content analysis stored with an ``error``
+key or a ``failed`` status, metadata without an image size or perceptual
+hash. ``--all`` selects every image instead, e.g. after a fix to the EXIF
+parser.
+
+Metadata is extracted in a process pool; content analysis requests run with
+at most ``--concurrency`` in flight and at most ``--rate`` started per second,
+on top of the limits of the backend selected with ``ANALYSIS_BACKEND``.
+Each chunk is written back in one transaction, after which the ID of its last
+image is saved to the ``--state`` file, so an interrupted run continues where
+it stopped; a run that finishes removes the file. Only one chunk is held in
+memory at a time.
+
+``--orphans`` also counts files, group directories and blobs that no image
+refers to; ``--delete-orphans`` deletes such blobs from the store as well, once
+they are an hour old.
+
+Usage: python backfill.py [--metadata] [--content] [--all] [--group-id ID]
+       [--chunk-size N] [--workers N] [--concurrency N] [--rate N]
+       [--state FILE] [--restart] [--dry-run] [--orphans] [--delete-orphans]
+       [--uploads-dir DIR]
+"""
+from concurrent.futures import Executor, ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, Optional
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import time
+
+from sqlalchemy import select
+
+from database import AsyncSessionLocal
+from models import Image
+from services.analysis_backends import AnalysisDeferred
+from services.image_analyzer import ImageAnalyzer, AnalysisError
+from services.logs import configure_logging
+from services.metadata import read_image_metadata
+from services.resilience import TokenBucket
+from services.storage import BlobStore, create_store, image_file
+import crud
+
+logger = logging.getLogger("backfill")
+
+METADATA_FIELDS = ("width", "height", "format", "camera_make", "camera_model", "date_taken",
+                   "gps_latitude", "gps_longitude", "perceptual_hash")
+
+
+def load_state(path: Optional[Path], options: Dict[str, Any], restart: bool) -> int:
+    """ID of the last image handled by a previous run with the same options."""
+    if path is None or restart or not path.exists():
+        return 0
+    state = json.loads(path.read_text())
+    if state.get("options") != options:
+        sys.exit(f"{path} was written by a run with different options; use --restart to start over")
+    return int(state["last_id"])
+
+
+def save_state(path: Optional[Path], options: Dict[str, Any], last_id: int) -> None:
+    if path is None:
+        return
+    # Write and rename, so an interruption never leaves a truncated file
+    temporary = path.with_name(path.name + ".tmp")
+    temporary.write_text(json.dumps({"options": options, "last_id": last_id}))
+    os.replace(temporary, path)
+
+
+class Backfill:
+    def __init__(
+        self,
+        args: argparse.Namespace,
+        analyzer: Optional[ImageAnalyzer],
+        executor: Executor,
+        storage: BlobStore
+    ):
+        self.args = args
+        self.storage = storage
+        self.analyzer = analyzer
+        self.executor = executor
+        self.semaphore = asyncio.Semaphore(args.concurrency)
+        self.rate_limiter = TokenBucket(args.rate, capacity=1)
+        self.counts = {
+            "images": 0,
+            "missing_files": 0,
+            "metadata_updated": 0,
+            "metadata_unchanged": 0,
+            "metadata_failed": 0,
+            "content_updated": 0,
+            "content_failed": 0,
+            "content_deferred": 0,
+        }
+
+    async def run(self, after_id: int, state_path: Optional[Path], options: Dict[str, Any]) -> int:
+        """Process chunks until none are left; returns the ID of the last image seen."""
+        started = time.perf_counter()
+        while True:
+            async with AsyncSessionLocal() as db:
+                chunk = await crud.get_backfill_chunk(
+                    db,
+                    after_id,
+                    self.args.chunk_size,
+                    metadata=self.args.metadata,
+                    content=self.args.content,
+                    only_failed=not self.args.all,
+                    group_id=self.args.group_id
+                )
+            if not chunk:
+                return after_id
+
+            updates = await asyncio.gather(*(
+                self.process(image, needs_metadata, needs_content)
+                for image, needs_metadata, needs_content in chunk
+            ))
+            updates = [update for update in updates if update]
+            if updates and not self.args.dry_run:
+                async with AsyncSessionLocal() as db:
+                    await crud.update_images_bulk(db, updates)
+
+            after_id = chunk[-1][0].id
+            if not self.args.dry_run:
+                save_state(state_path, options, after_id)
+            self.counts["images"] += len(chunk)
+            rate = self.counts["images"] / max(time.perf_counter() - started, 1e-9)
+            logger.info("Processed %d images up to ID %d (%.1f/s), %d changed in this chunk",
+                        self.counts["images"], after_id, rate, len(updates))
+
+    async def process(self, image: Image, needs_metadata: bool, needs_content: bool) -> Optional[Dict[str, Any]]:
+        """Re-analyze one image; returns the column values to update, if any."""
+        try:
+            async with image_file(self.storage, self.args.uploads_dir, image) as path:
+                if path is None or not path.is_file():
+                    self.counts["missing_files"] += 1
+                    return None
+
+                values: Dict[str, Any] = {}
+                if needs_metadata:
+                    values.update(await self.extract_metadata(image, path))
+                if needs_content:
+                    values.update(await self.analyze_content(path))
+        except FileNotFoundError:
+            self.counts["missing_files"] += 1
+            return None
+        return {"id": image.id, **values} if values else None
+
+    async def extract_metadata(self, image: Image, path: Path) -> Dict[str, Any]:
+        loop = asyncio.get_running_loop()
+        metadata = await loop.run_in_executor(self.executor, read_image_metadata, path)
+        if "error" in metadata or "width" not in metadata:
+            self.counts["metadata_failed"] += 1
+            return {}
+        columns = crud.metadata_columns(metadata)
+        changed = {name: columns[name] for name in METADATA_FIELDS if getattr(image, name) != columns[name]}
+        self.counts["metadata_updated" if changed else "metadata_unchanged"] += 1
+        return changed
+
+    async def analyze_content(self, path: Path) -> Dict[str, Any]:
+        if self.args.dry_run:
+            self.counts["content_updated"] += 1
+            return {}
+        async with self.semaphore:
+            while True:
+                await asyncio.sleep(self.rate_limiter.reserve())
+                try:
+                    content_analysis = await self.analyzer.request_content_analysis(path)
+                except AnalysisDeferred as e:
+                    # The backend is down; wait for it rather than skipping the image
+                    self.counts["content_deferred"] += 1
+                    await asyncio.sleep(max(1.0, e.retry_after or 0.0))
+                    continue
+                except AnalysisError as e:
+                    logger.warning("Content analysis failed for %s: %s", path, e)
+                    content_analysis = None
+                break
+        # Keep the stored result rather than replacing one error with another
+        if not content_analysis or "error" in content_analysis:
+            self.counts["content_failed"] += 1
+            return {}
+        self.counts["content_updated"] += 1
+        return {"content_analysis": content_analysis, "analysis_status": "completed"}
+
+
+# Younger blobs may belong to an upload whose image row is not committed yet
+ORPHAN_BLOB_MIN_AGE = 3600
+
+
+async def find_orphans(uploads_dir: Path, storage: BlobStore, delete_blobs: bool = False) -> Dict[str, int]:
+    """Count files, group directories and blobs that no row refers to.
+
+    With ``delete_blobs`` orphan blobs older than ``ORPHAN_BLOB_MIN_AGE``
+    seconds are deleted from the store, e.g. those of an upload whose
+    process died before its image row was written.
+    """
+    counts = {"orphan_files": 0, "orphan_directories": 0, "orphan_blobs": 0, "deleted_blobs": 0}
+    async with AsyncSessionLocal() as db:
+        keys = await crud.get_blob_keys(db)
+        cutoff = time.time() - ORPHAN_BLOB_MIN_AGE
+        blobs = await asyncio.to_thread(lambda: list(storage.list_blobs()))
+        for key, modified in blobs:
+            if key in keys:
+                continue
+            counts["orphan_blobs"] += 1
+            if delete_blobs and modified < cutoff:
+                await storage.delete(key)
+                counts["deleted_blobs"] += 1
+        groups = await crud.get_all_image_groups(db)
+        for group in groups:
+            group_dir = uploads_dir / group.directory_name
+            if not group_dir.is_dir():
+                continue
+            stored = set(await db.scalars(select(Image.stored_filename).where(Image.group_id == group.id)))
+            with os.scandir(group_dir) as entries:
+                counts["orphan_files"] += sum(1 for entry in entries if entry.is_file() and entry.name not in stored)
+    # Group directory names never start with an underscore, the blob store and derivatives do
+    directories = {group.directory_name for group in groups}
+    if uploads_dir.is_dir():
+        with os.scandir(uploads_dir) as entries:
+            counts["orphan_directories"] = sum(
+                1 for entry in entries
+                if entry.is_dir() and entry.name not in directories and not entry.name.startswith("_")
+            )
+    return counts
+
+
+async def backfill(args: argparse.Namespace) -> Dict[str, Any]:
+    options = {
+        "metadata": args.metadata,
+        "content": args.content,
+        "all": args.all,
+        "group_id": args.group_id,
+    }
+    after_id = load_state(args.state, options, args.restart)
+    if after_id:
+        logger.info("Resuming after image ID %d", after_id)
+
+    analyzer = None
+    if args.content and not args.dry_run:
+        analyzer = ImageAnalyzer()
+        unavailable = analyzer.backend.unavailable_reason()
+        if unavailable:
+            sys.exit(f"Content analysis is not available: {unavailable}")
+
+    storage = create_store()
+    started = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        job = Backfill(args, analyzer, executor, storage)
+        try:
+            last_id = await job.run(after_id, args.state, options)
+        finally:
+            if analyzer:
+                await analyzer.aclose()
+    if args.state and not args.dry_run and args.state.exists():
+        args.state.unlink()
+    summary: Dict[str, Any] = {"dry_run": args.dry_run, "last_id": last_id, **job.counts}
+    if args.orphans or args.delete_orphans:
+        summary.update(await find_orphans(args.uploads_dir, storage, args.delete_orphans and not args.dry_run))
+    summary["seconds"] = round(time.perf_counter() - started, 3)
+    return summary
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Re-run metadata extraction and content analysis on stored images")
+    parser.add_argument("--metadata", action="store_true", help="Re-extract size, camera, date and GPS metadata")
+    parser.add_argument("--content", action="store_true", help="Re-run content analysis")
+    parser.add_argument("--all", action="store_true", help="Select every image, not just failed ones")
+    parser.add_argument("--group-id", type=int, help="Only images of this group")
+    parser.add_argument("--chunk-size", type=int, default=500)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="Processes extracting metadata")
+    parser.add_argument("--concurrency", type=int, default=4, help="Content analysis requests in flight")
+    parser.add_argument("--rate", type=float, default=0, help="Content analysis requests started per second; 0 for no limit")
+    parser.add_argument("--state", type=Path, help="File recording progress, for resuming an interrupted run")
+    parser.add_argument("--restart", action="store_true", help="Ignore the progress recorded in --state")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="Report what would change without calling the model or writing anything")
+    parser.add_argument("--orphans", action="store_true", help="Also count files no image refers to")
+    parser.add_argument("--delete-orphans", action="store_true",
+                        help="Also delete blobs no image refers to, once they are an hour old")
+    parser.add_argument("--uploads-dir", type=Path, default=Path("uploads"))
+    args = parser.parse_args()
+    configure_logging()
+    if not (args.metadata or args.content):
+        parser.error("choose --metadata, --content or both")
+    if args.chunk_size < 1 or args.workers < 1 or args.concurrency < 1 or args.rate < 0:
+        parser.error("--chunk-size, --workers and --concurrency must be positive and --rate not negative")
+
+    print(json.dumps(asyncio.run(backfill(args)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1 @@
+"""Benchmarks for the photo logbook backend."""
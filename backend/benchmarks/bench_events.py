@@ -0,0 +1,196 @@
+"""Benchmark automatic event detection on a large synthetic library.
+
+Generates ``--rows`` photos (500,000 by default) as a sequence of trips and
+outings: bursts of activity around a place, separated by quiet hours or days,
+with GPS positions on most photos. Then times, on ``services.events``:
+
+- ``load``: building the sorted arrays from rows, as the first refresh does;
+- ``segment`` and ``events``: splitting the library into events and
+  summarising them, with the default thresholds;
+- ``incremental``: merging ``--new-rows`` photos from an old, out-of-order
+  import and segmenting again.
+
+With ``--from-database`` the rows are also written to a database (SQLite in
+the temp directory unless ``--database-url`` is given) and the first refresh
+through the application's query is timed, which includes reading them.
+
+Usage: python benchmarks/bench_events.py [--rows N] [--new-rows N] [--repeat N]
+       [--from-database] [--database-url URL] [--output FILE]
+"""
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.bench_image_search import CITIES
+
+START = datetime(2015, 1, 1)
+INSERT_BATCH = 10000
+
+
+def synthetic_library(rows: int, seed: int = 0, start_id: int = 1, start: datetime = START) -> List[Tuple]:
+    """``(id, group_id, date_taken, latitude, longitude)`` rows of a plausible photo library."""
+    rng = random.Random(seed)
+    library = []
+    taken = start
+    event = 0
+    while len(library) < rows:
+        event += 1
+        lat, lon = rng.choice(CITIES)
+        lat, lon = lat + rng.uniform(-1, 1), lon + rng.uniform(-1, 1)
+        for _ in range(min(rows - len(library), int(rng.paretovariate(1.2) * 20))):
+            taken += timedelta(seconds=rng.expovariate(1 / 300))
+            located = rng.random() < 0.7
+            library.append((
+                start_id + len(library),
+                event // 3 + 1,
+                taken,
+                rng.gauss(lat, 0.02) if located else None,
+                rng.gauss(lon, 0.02) if located else None,
+            ))
+        taken += timedelta(hours=rng.uniform(10, 24 * 14))
+    return library
+
+
+def timed(function, repeat: int) -> Tuple[Any, Dict[str, float]]:
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = function()
+        timings.append(time.perf_counter() - started)
+    return result, {"mean_ms": statistics.fmean(timings) * 1000, "min_ms": min(timings) * 1000}
+
+
+def populate(engine, library: List[Tuple]) -> None:
+    from sqlalchemy import func, insert, select
+    from models import Base, ImageGroup, Image
+
+    Base.metadata.create_all(engine)
+    with engine.begin() as connection:
+        if connection.scalar(select(func.count()).select_from(Image)) >= len(library):
+            return
+        groups = sorted({row[1] for row in library})
+        connection.execute(insert(ImageGroup), [
+            dict(id=group_id, title=f"Upload {group_id}", directory_name=f"bench_upload_{group_id}", created_at=START)
+            for group_id in groups
+        ])
+        for offset in range(0, len(library), INSERT_BATCH):
+            connection.execute(insert(Image), [
+                dict(
+                    id=image_id,
+                    group_id=group_id,
+                    original_filename=f"IMG_{image_id:07d}.jpg",
+                    stored_filename=f"IMG_{image_id:07d}.jpg",
+                    content_type="image/jpeg",
+                    file_size=1_000_000,
+                    uploaded_at=START,
+                    date_taken=taken,
+                    gps_latitude=latitude,
+                    gps_longitude=longitude,
+                    analysis_status="completed",
+                )
+                for image_id, group_id, taken, latitude, longitude in library[offset:offset + INSERT_BATCH]
+            ])
+
+
+async def time_database_refresh(session_factory) -> float:
+    from services.events import EventIndex
+
+    index = EventIndex()
+    started = time.perf_counter()
+    async with session_factory() as db:
+        await index.refresh(db)
+    return time.perf_counter() - started
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark event detection from capture time and GPS")
+    parser.add_argument("--rows", type=int, default=500_000)
+    parser.add_argument("--new-rows", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--from-database", action="store_true", help="Also time loading the rows from a database")
+    parser.add_argument("--database-url", help="Sync database URL; a SQLite file in the temp directory by default")
+    parser.add_argument("--output", type=Path)
+    args = parser.parse_args()
+
+    if args.from_database:
+        workdir = Path(tempfile.gettempdir()) / "photo_logbook_events_bench"
+        workdir.mkdir(exist_ok=True)
+        os.environ["DATABASE_URL"] = args.database_url or f"sqlite:///{workdir / f'events_{args.rows}.db'}"
+        os.environ.pop("ASYNC_DATABASE_URL", None)
+
+    from services.events import EVENT_MAX_DISTANCE_KM, EVENT_MAX_GAP_HOURS, EVENT_MIN_IMAGES, EventIndex
+
+    library = synthetic_library(args.rows, args.seed)
+    # An old memory card imported late: photos from the middle of the library's time span
+    middle = library[len(library) // 2][2]
+    imported = synthetic_library(args.new_rows, args.seed + 1, start_id=args.rows + 1, start=middle)
+
+    def load() -> EventIndex:
+        index = EventIndex()
+        index.add(library)
+        return index
+
+    index, load_timing = timed(load, args.repeat)
+    starts, segment_timing = timed(lambda: index.segment(EVENT_MAX_GAP_HOURS, EVENT_MAX_DISTANCE_KM), args.repeat)
+
+    def summarise():
+        # Bypass the cache so every run computes the events
+        index._cached = None
+        return index.events(EVENT_MAX_GAP_HOURS, EVENT_MAX_DISTANCE_KM, EVENT_MIN_IMAGES)
+
+    events, events_timing = timed(summarise, args.repeat)
+
+    def incremental():
+        grown = load()
+        started = time.perf_counter()
+        grown.add(imported)
+        grown.events(EVENT_MAX_GAP_HOURS, EVENT_MAX_DISTANCE_KM, EVENT_MIN_IMAGES)
+        return time.perf_counter() - started
+
+    incremental_timings = [incremental() for _ in range(args.repeat)]
+
+    results: Dict[str, Any] = {
+        "rows": len(library),
+        "located_share": sum(row[3] is not None for row in library) / len(library),
+        "max_gap_hours": EVENT_MAX_GAP_HOURS,
+        "max_distance_km": EVENT_MAX_DISTANCE_KM,
+        "min_images": EVENT_MIN_IMAGES,
+        "segments": len(starts),
+        "events": len(events),
+        "load": load_timing,
+        "segment": segment_timing,
+        "events_summary": events_timing,
+        "incremental": {
+            "new_rows": len(imported),
+            "mean_ms": statistics.fmean(incremental_timings) * 1000,
+            "min_ms": min(incremental_timings) * 1000,
+        },
+    }
+
+    if args.from_database:
+        import database
+
+        populate(database.engine, library)
+        results["database"] = database.engine.url.get_backend_name()
+        results["database_refresh_ms"] = asyncio.run(time_database_refresh(database.AsyncSessionLocal)) * 1000
+
+    report = json.dumps(results, indent=2)
+    if args.output:
+        args.output.write_text(report)
+    print(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,222 @@
+"""Benchmark ``GET /groups`` and ``GET /groups/{id}`` latency by library size.
+
+The database is grown step by step to each size in ``--rows`` (images;
+10,000 and 100,000 by default), in groups of ``--images-per-group`` images
+with content analysis and metadata filled in, and at every size these are
+timed:
+
+- the first page of the group listing and pages further down by cursor;
+- the first page of a random group, with all fields and with the
+  ``fields=id,thumbnails,metadata`` projection of grid views;
+- the following page of a random group, by cursor.
+
+Requests are served in-process through ``httpx.ASGITransport``. By
+default a new SQLite file is filled on every run; with ``--database-url``
+only what is missing is added, and sizes smaller than the library already
+there are skipped.
+
+Usage: python benchmarks/bench_groups.py [--database-url URL] [--rows N,N]
+       [--images-per-group N] [--repeat N] [--output FILE]
+"""
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.corpus import CAMERAS
+from benchmarks.timing import summarize
+
+START = datetime(2020, 1, 1)
+INSERT_BATCH = 10000
+ELEMENTS = ["tree", "car", "bridge", "dog", "mountain", "river", "building", "bicycle", "beach", "crowd"]
+
+
+def synthetic_image(rng: random.Random, group_id: int, n: int) -> Dict[str, Any]:
+    make, model = rng.choice(CAMERAS)
+    return dict(
+        group_id=group_id,
+        original_filename=f"IMG_{n:07d}.jpg",
+        stored_filename=f"IMG_{n:07d}.jpg",
+        content_type="image/jpeg",
+        file_size=rng.randint(500_000, 8_000_000),
+        content_hash=f"{n:064x}",
+        uploaded_at=START,
+        width=4032,
+        height=3024,
+        format="JPEG",
+        camera_make=make,
+        camera_model=model,
+        date_taken=START + timedelta(minutes=n),
+        gps_latitude=rng.uniform(-60, 60) if rng.random() < 0.6 else None,
+        gps_longitude=rng.uniform(-170, 170) if rng.random() < 0.6 else None,
+        content_analysis={
+            "description": f"A photo of {' and '.join(rng.sample(ELEMENTS, 2))} on an ordinary day.",
+            "location_type": rng.choice(["urban", "rural", "coastal", "indoor"]),
+            "time_and_weather": rng.choice(["sunny afternoon", "overcast morning", "night"]),
+            "key_elements": rng.sample(ELEMENTS, 4),
+            "activities": rng.sample(["walking", "cycling", "swimming", "eating"], 2),
+        },
+        analysis_status="completed",
+    )
+
+
+def populate(engine, rows: int, images_per_group: int, seed: int = 0) -> int:
+    """Add whole groups of synthetic images until the table holds at least ``rows``."""
+    from sqlalchemy import func, insert, select, text
+    from models import Base, ImageGroup, Image
+
+    Base.metadata.create_all(engine)
+    with engine.connect() as connection:
+        existing = connection.scalar(select(func.count()).select_from(Image))
+        first_group = connection.scalar(select(func.count()).select_from(ImageGroup))
+    if existing >= rows:
+        return existing
+
+    rng = random.Random(seed + existing)
+    started = time.perf_counter()
+    groups_per_batch = max(1, INSERT_BATCH // images_per_group)
+    with engine.begin() as connection:
+        group = first_group
+        while existing < rows:
+            batch = range(group, group + min(groups_per_batch, -(-(rows - existing) // images_per_group)))
+            connection.execute(insert(ImageGroup), [
+                dict(title=f"Album {g}", directory_name=f"bench_album_{g}", created_at=START + timedelta(hours=g))
+                for g in batch
+            ])
+            group_ids = connection.scalars(
+                select(ImageGroup.id)
+                .where(ImageGroup.directory_name.in_([f"bench_album_{g}" for g in batch]))
+                .order_by(ImageGroup.id)
+            ).all()
+            connection.execute(insert(Image), [
+                synthetic_image(rng, group_id, existing + offset * images_per_group + n)
+                for offset, group_id in enumerate(group_ids)
+                for n in range(images_per_group)
+            ])
+            existing += len(group_ids) * images_per_group
+            group = batch.stop
+        connection.execute(text("ANALYZE"))
+    print(f"Grew the library to {existing} images in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+    return existing
+
+
+async def time_requests(
+    client,
+    make_request: Callable[[random.Random], tuple],
+    repeat: int,
+    rng: random.Random
+) -> Dict[str, Any]:
+    url, params = make_request(rng)
+    (await client.get(url, params=params)).raise_for_status()  # warm up
+    timings: List[float] = []
+    for _ in range(repeat):
+        url, params = make_request(rng)
+        started = time.perf_counter()
+        response = await client.get(url, params=params)
+        timings.append(time.perf_counter() - started)
+        response.raise_for_status()
+    return summarize(timings)
+
+
+async def run_scenarios(app, engine, repeat: int, seed: int) -> Dict[str, Any]:
+    import httpx
+    from sqlalchemy import select
+    from models import ImageGroup
+
+    with engine.connect() as connection:
+        group_ids = connection.scalars(select(ImageGroup.id)).all()
+    rng = random.Random(seed)
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+        # Cursors of the listing pages and of each sampled group's second page
+        list_cursors: List[str] = []
+        cursor: Optional[str] = None
+        while len(list_cursors) < 20:
+            page = (await client.get("/groups", params={"limit": 50, **({"cursor": cursor} if cursor else {})})).json()
+            cursor = page.get("next_cursor")
+            if not cursor:
+                break
+            list_cursors.append(cursor)
+        sampled = rng.sample(group_ids, min(len(group_ids), 20))
+        group_cursors = []
+        for group_id in sampled:
+            page = (await client.get(f"/groups/{group_id}", params={"limit": 100, "fields": "id"})).json()
+            if page.get("next_cursor"):
+                group_cursors.append((group_id, page["next_cursor"]))
+
+        scenarios: Dict[str, Callable[[random.Random], tuple]] = {
+            "groups_first_page": lambda r: ("/groups", {"limit": 50}),
+            "group_detail": lambda r: (f"/groups/{r.choice(group_ids)}", {"limit": 100}),
+            "group_detail_grid": lambda r: (
+                f"/groups/{r.choice(group_ids)}", {"limit": 100, "fields": "id,thumbnails,metadata"}
+            ),
+        }
+        if list_cursors:
+            scenarios["groups_later_page"] = lambda r: ("/groups", {"limit": 50, "cursor": r.choice(list_cursors)})
+        if group_cursors:
+            def next_page(r: random.Random) -> tuple:
+                group_id, next_cursor = r.choice(group_cursors)
+                return f"/groups/{group_id}", {"limit": 100, "cursor": next_cursor}
+            scenarios["group_detail_next_page"] = next_page
+
+        return {name: await time_requests(client, make, repeat, rng) for name, make in scenarios.items()}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark the group listing and group detail endpoints")
+    parser.add_argument("--database-url", help="Sync database URL; a SQLite file in the temp directory by default")
+    parser.add_argument("--rows", default="10000,100000", help="Comma-separated library sizes, in images")
+    parser.add_argument("--images-per-group", type=int, default=200)
+    parser.add_argument("--repeat", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", type=Path)
+    args = parser.parse_args()
+    sizes = sorted(int(size) for size in args.rows.split(","))
+
+    workdir = Path(tempfile.mkdtemp(prefix="photo_logbook_bench_"))
+    os.environ["DATABASE_URL"] = args.database_url or f"sqlite:///{workdir / 'bench.db'}"
+    os.environ.pop("ASYNC_DATABASE_URL", None)
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    # main.py creates its uploads directory relative to the working directory
+    os.chdir(workdir)
+
+    import database
+    import main as application
+
+    async def run_sizes() -> Dict[str, Any]:
+        # One event loop for every size, as the async engine's connections belong to it
+        measured = {}
+        for size in sizes:
+            rows = populate(database.engine, size, args.images_per_group, args.seed)
+            if rows >= size + args.images_per_group:
+                print(f"Skipping {size} images: the database already holds {rows}", file=sys.stderr)
+                continue
+            measured[str(size)] = {
+                "rows": rows,
+                "scenarios": await run_scenarios(application.app, database.engine, args.repeat, args.seed),
+            }
+        return measured
+
+    results: Dict[str, Any] = {
+        "database": database.engine.url.get_backend_name(),
+        "images_per_group": args.images_per_group,
+        "sizes": asyncio.run(run_sizes()),
+    }
+
+    report = json.dumps(results, indent=2)
+    if args.output:
+        args.output.write_text(report)
+    print(report)
+
+
+if __name__ == "__main__":
+    main()
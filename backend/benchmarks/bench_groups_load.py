@@ -0,0 +1,200 @@
+"""Load benchmark of concurrent ``GET /groups`` requests.
+
+Compares the endpoint on the async engine with the previous implementation, an
+``async def`` endpoint that ran the same query on a blocking sync session and
+so held up the event loop for every database round trip. Requests are served
+in-process through ``httpx.ASGITransport``, so the numbers measure the
+application and the database, not a network stack. The client shares the
+event loop with the server, so while a sync query blocks the loop the client
+cannot time anything either: compare throughput, not the sync latencies.
+
+SQLite is used by default. Pass ``--database-url`` to run against Postgres;
+that is where the async engine pays off, since every round trip then waits on
+the network while other requests keep running. On SQLite, ``--db-latency-ms``
+adds that wait to every statement, in the thread that executes it: the event
+loop for the sync session, the driver's worker thread for aiosqlite.
+
+Usage: python benchmarks/bench_groups_load.py [--database-url URL] [--groups N]
+       [--images-per-group N] [--requests N] [--concurrency N]
+       [--db-latency-ms MS] [--output FILE]
+"""
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Dict, List
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def populate(engine, groups: int, images_per_group: int) -> None:
+    """Create ``groups`` groups with ``images_per_group`` images each, unless already there."""
+    from sqlalchemy import func, insert, select
+    from models import Base, ImageGroup, Image
+
+    Base.metadata.create_all(engine)
+    with engine.begin() as connection:
+        if connection.scalar(select(func.count()).select_from(ImageGroup)) >= groups:
+            return
+        started = datetime(2024, 1, 1)
+        connection.execute(insert(ImageGroup), [
+            dict(title=f"Group {i}", directory_name=f"bench_group_{i}", created_at=started + timedelta(minutes=i))
+            for i in range(groups)
+        ])
+        group_ids = connection.scalars(select(ImageGroup.id)).all()
+        for offset in range(0, len(group_ids), 500):
+            connection.execute(insert(Image), [
+                dict(
+                    group_id=group_id,
+                    original_filename=f"{n}.jpg",
+                    stored_filename=f"{n}.jpg",
+                    content_type="image/jpeg",
+                    file_size=1_000_000 + n,
+                    analysis_status="completed",
+                    uploaded_at=started
+                )
+                for group_id in group_ids[offset:offset + 500]
+                for n in range(images_per_group)
+            ])
+
+
+def add_statement_latency(database, latency: float) -> None:
+    """Sleep ``latency`` seconds per SQLite statement, like a round trip to a remote server."""
+    from sqlalchemy import event
+
+    def delay(statement: str) -> None:
+        time.sleep(latency)
+
+    @event.listens_for(database.engine, "connect")
+    def sync_connect(dbapi_connection, connection_record) -> None:
+        dbapi_connection.set_trace_callback(delay)
+
+    @event.listens_for(database.async_engine.sync_engine, "connect")
+    def async_connect(dbapi_connection, connection_record) -> None:
+        # The callback must be installed from aiosqlite's own thread
+        dbapi_connection.run_async(lambda connection: connection.set_trace_callback(delay))
+
+
+def baseline_app():
+    """``GET /groups`` as it was before the async engine: a sync session in an async endpoint."""
+    from fastapi import FastAPI, Query
+    from database import SessionLocal
+    import crud
+
+    app = FastAPI()
+
+    @app.get("/groups")
+    async def list_groups(limit: int = Query(50, ge=1, le=200)):
+        # The session is closed here rather than by a dependency: with more
+        # requests than pooled connections, cleanup scheduled behind the
+        # blocked event loop would never return a connection and the run stalls
+        with SessionLocal() as db:
+            groups = db.execute(crud.image_groups_page_query(limit)).all()
+        return {
+            "groups": [
+                {
+                    "id": group.id,
+                    "title": group.title,
+                    "file_count": group.file_count,
+                    "total_bytes": int(group.total_bytes),
+                    "created_at": group.created_at.isoformat(),
+                }
+                for group in groups
+            ]
+        }
+
+    return app
+
+
+async def run_load(app, requests: int, concurrency: int, limit: int) -> Dict[str, Any]:
+    import httpx
+
+    latencies: List[float] = []
+    errors = 0
+    remaining = iter(range(requests))
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+        # Warm up connections and caches
+        await asyncio.gather(*(client.get("/groups", params={"limit": limit}) for _ in range(concurrency)))
+
+        async def user() -> None:
+            nonlocal errors
+            for _ in remaining:
+                started = time.perf_counter()
+                response = await client.get("/groups", params={"limit": limit})
+                latencies.append(time.perf_counter() - started)
+                errors += response.status_code != 200
+
+        started = time.perf_counter()
+        await asyncio.gather(*(user() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "requests_per_second": len(latencies) / elapsed,
+        "mean_ms": statistics.fmean(latencies) * 1000,
+        "p50_ms": latencies[len(latencies) // 2] * 1000,
+        "p95_ms": latencies[int(len(latencies) * 0.95) - 1] * 1000,
+        "p99_ms": latencies[int(len(latencies) * 0.99) - 1] * 1000,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark concurrent GET /groups")
+    parser.add_argument("--database-url", help="Sync database URL; a temporary SQLite file by default")
+    parser.add_argument("--groups", type=int, default=2000)
+    parser.add_argument("--images-per-group", type=int, default=20)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--limit", type=int, default=50)
+    parser.add_argument("--db-latency-ms", type=float, default=0.0)
+    parser.add_argument("--output", type=Path)
+    args = parser.parse_args()
+
+    workdir = Path(tempfile.mkdtemp(prefix="photo_logbook_bench_"))
+    os.environ["DATABASE_URL"] = args.database_url or f"sqlite:///{workdir / 'bench.db'}"
+    os.environ.pop("ASYNC_DATABASE_URL", None)
+    # main.py creates its uploads directory relative to the working directory
+    os.chdir(workdir)
+
+    import database
+    import main as application
+
+    populate(database.engine, args.groups, args.images_per_group)
+    if args.db_latency_ms:
+        if database.engine.url.get_backend_name() != "sqlite":
+            parser.error("--db-latency-ms only applies to SQLite")
+        database.engine.dispose()
+        add_statement_latency(database, args.db_latency_ms / 1000)
+
+    results: Dict[str, Any] = {
+        "database": database.engine.url.get_backend_name(),
+        "groups": args.groups,
+        "images_per_group": args.images_per_group,
+        "concurrency": args.concurrency,
+        "limit": args.limit,
+        "db_latency_ms": args.db_latency_ms,
+        "pool": database.pool_options(database.ASYNC_DATABASE_URL),
+    }
+    results["sync_session"] = asyncio.run(run_load(baseline_app(), args.requests, args.concurrency, args.limit))
+    results["async_session"] = asyncio.run(run_load(application.app, args.requests, args.concurrency, args.limit))
+    results["throughput_ratio"] = (
+        results["async_session"]["requests_per_second"] / results["sync_session"]["requests_per_second"]
+    )
+
+    report = json.dumps(results, indent=2)
+    if args.output:
+        args.output.write_text(report)
+    print(report)
+
+
+if __name__ == "__main__":
+    main()
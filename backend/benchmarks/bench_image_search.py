@@ -0,0 +1,205 @@
+"""Benchmark ``GET /images/search`` on a large synthetic library.
+
+Fills a database with ``--rows`` images (a million by default): most are
+clustered around a set of cities, some are spread over the globe, some have
+no GPS position or capture date. Then bounding boxes of several sizes, date
+ranges and combinations of both are requested through the application and the
+latency of each request is recorded. Requests are served in-process through
+``httpx.ASGITransport``.
+
+The generated database is kept, so later runs with the same ``--database-url``
+skip the slow part. The target is a p95 under 100 ms for every scenario.
+
+Usage: python benchmarks/bench_image_search.py [--database-url URL] [--rows N]
+       [--repeat N] [--limit N] [--output FILE]
+"""
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Callable, Dict, List
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+CITIES = [
+    (48.86, 2.35), (51.51, -0.13), (40.71, -74.01), (35.68, 139.69), (-33.87, 151.21),
+    (37.77, -122.42), (41.90, 12.50), (52.52, 13.40), (-22.91, -43.17), (1.35, 103.82),
+    (55.76, 37.62), (19.43, -99.13), (-34.60, -58.38), (30.04, 31.24), (64.15, -21.94),
+    (-1.29, 36.82), (25.20, 55.27), (13.76, 100.50), (45.50, -73.57), (-41.29, 174.78),
+]
+START = datetime(2015, 1, 1)
+SPAN_SECONDS = 10 * 365 * 24 * 3600
+IMAGES_PER_GROUP = 500
+INSERT_BATCH = 10000
+
+
+def synthetic_image(rng: random.Random, group_id: int, n: int) -> Dict[str, Any]:
+    roll = rng.random()
+    if roll < 0.75:
+        lat, lon = rng.choice(CITIES)
+        lat, lon = rng.gauss(lat, 0.3), rng.gauss(lon, 0.3)
+    elif roll < 0.9:
+        lat, lon = rng.uniform(-60, 70), rng.uniform(-180, 180)
+    else:
+        lat = lon = None
+    return dict(
+        group_id=group_id,
+        original_filename=f"IMG_{n:07d}.jpg",
+        stored_filename=f"IMG_{n:07d}.jpg",
+        content_type="image/jpeg",
+        file_size=rng.randint(500_000, 8_000_000),
+        uploaded_at=START,
+        width=4032,
+        height=3024,
+        format="JPEG",
+        gps_latitude=max(-90.0, min(90.0, lat)) if lat is not None else None,
+        gps_longitude=(lon + 180) % 360 - 180 if lon is not None else None,
+        date_taken=START + timedelta(seconds=rng.randrange(SPAN_SECONDS)) if rng.random() < 0.95 else None,
+        analysis_status="completed",
+    )
+
+
+def populate(engine, rows: int, seed: int = 0) -> int:
+    """Insert synthetic images until the table holds ``rows``; returns the row count."""
+    from sqlalchemy import func, insert, select, text
+    from models import Base, ImageGroup, Image
+
+    Base.metadata.create_all(engine)
+    with engine.connect() as connection:
+        existing = connection.scalar(select(func.count()).select_from(Image))
+    if existing >= rows:
+        return existing
+
+    rng = random.Random(seed + existing)
+    started = time.perf_counter()
+    with engine.begin() as connection:
+        for offset in range(existing, rows, INSERT_BATCH):
+            count = min(INSERT_BATCH, rows - offset)
+            first_group = offset // IMAGES_PER_GROUP
+            last_group = (offset + count - 1) // IMAGES_PER_GROUP
+            connection.execute(insert(ImageGroup), [
+                dict(title=f"Trip {g}", directory_name=f"bench_trip_{g}", created_at=START)
+                for g in range(first_group, last_group + 1)
+                if g * IMAGES_PER_GROUP >= offset
+            ])
+            group_ids = dict(connection.execute(
+                select(ImageGroup.directory_name, ImageGroup.id)
+                .where(ImageGroup.directory_name.in_(
+                    [f"bench_trip_{g}" for g in range(first_group, last_group + 1)]
+                ))
+            ).all())
+            connection.execute(insert(Image), [
+                synthetic_image(rng, group_ids[f"bench_trip_{n // IMAGES_PER_GROUP}"], n)
+                for n in range(offset, offset + count)
+            ])
+        # Planner statistics, as autovacuum would collect them on Postgres
+        connection.execute(text("ANALYZE"))
+    print(f"Inserted {rows - existing} images in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+    return rows
+
+
+def box_around(rng: random.Random, size: float) -> str:
+    lat, lon = rng.choice(CITIES)
+    lat, lon = lat + rng.uniform(-0.2, 0.2), lon + rng.uniform(-0.2, 0.2)
+    half = size / 2
+    min_lat, max_lat = max(-90, lat - half), min(90, lat + half)
+    min_lon, max_lon = ((lon - half + 180) % 360) - 180, ((lon + half + 180) % 360) - 180
+    return f"{min_lon:.4f},{min_lat:.4f},{max_lon:.4f},{max_lat:.4f}"
+
+
+def date_range(rng: random.Random, days: int) -> Dict[str, str]:
+    start = START + timedelta(days=rng.randrange(10 * 365 - days))
+    return {"from": start.date().isoformat(), "to": (start + timedelta(days=days - 1)).date().isoformat()}
+
+
+SCENARIOS: Dict[str, Callable[[random.Random], Dict[str, str]]] = {
+    "city_bbox": lambda rng: {"bbox": box_around(rng, 0.1)},
+    "region_bbox": lambda rng: {"bbox": box_around(rng, 5)},
+    "continent_bbox": lambda rng: {"bbox": box_around(rng, 60)},
+    "world_bbox": lambda rng: {"bbox": "-180,-90,180,90"},
+    "antimeridian_bbox": lambda rng: {"bbox": "170,-50,-170,-30"},
+    "one_week": lambda rng: date_range(rng, 7),
+    "one_year": lambda rng: date_range(rng, 365),
+    "city_bbox_one_year": lambda rng: {"bbox": box_around(rng, 0.1), **date_range(rng, 365)},
+    "region_bbox_one_week": lambda rng: {"bbox": box_around(rng, 5), **date_range(rng, 7)},
+    "continent_bbox_one_month": lambda rng: {"bbox": box_around(rng, 60), **date_range(rng, 30)},
+}
+
+
+async def run_scenarios(app, repeat: int, limit: int, fields: str, seed: int) -> Dict[str, Any]:
+    import httpx
+
+    rng = random.Random(seed)
+    results: Dict[str, Any] = {}
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+        for name, make_params in SCENARIOS.items():
+            await client.get("/images/search", params={**make_params(rng), "limit": limit, "fields": fields})
+            timings: List[float] = []
+            returned = 0
+            for _ in range(repeat):
+                params = {**make_params(rng), "limit": limit, "fields": fields}
+                started = time.perf_counter()
+                response = await client.get("/images/search", params=params)
+                timings.append(time.perf_counter() - started)
+                response.raise_for_status()
+                returned += len(response.json()["images"])
+            timings.sort()
+            results[name] = {
+                "requests": repeat,
+                "mean_images": returned / repeat,
+                "p50_ms": timings[len(timings) // 2] * 1000,
+                "p95_ms": timings[max(0, int(len(timings) * 0.95) - 1)] * 1000,
+                "max_ms": timings[-1] * 1000,
+                "mean_ms": statistics.fmean(timings) * 1000,
+            }
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark bounding-box and date-range image search")
+    parser.add_argument("--database-url", help="Sync database URL; a SQLite file in the temp directory by default")
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--limit", type=int, default=100)
+    parser.add_argument("--fields", default="id,thumbnails,metadata")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", type=Path)
+    args = parser.parse_args()
+
+    workdir = Path(tempfile.gettempdir()) / "photo_logbook_search_bench"
+    workdir.mkdir(exist_ok=True)
+    os.environ["DATABASE_URL"] = args.database_url or f"sqlite:///{workdir / f'search_{args.rows}.db'}"
+    os.environ.pop("ASYNC_DATABASE_URL", None)
+    # main.py creates its uploads directory relative to the working directory
+    os.chdir(workdir)
+
+    import database
+    import main as application
+
+    rows = populate(database.engine, args.rows, args.seed)
+    scenarios = asyncio.run(run_scenarios(application.app, args.repeat, args.limit, args.fields, args.seed))
+    results: Dict[str, Any] = {
+        "database": database.engine.url.get_backend_name(),
+        "rows": rows,
+        "limit": args.limit,
+        "fields": args.fields,
+        "scenarios": scenarios,
+        "worst_p95_ms": max(result["p95_ms"] for result in scenarios.values()),
+    }
+    results["under_100ms"] = results["worst_p95_ms"] < 100
+
+    report = json.dumps(results, indent=2)
+    if args.output:
+        args.output.write_text(report)
+    print(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+"""Benchmark image metadata extraction.
+
+Compares the single-pass extractor in ``services.metadata`` with the previous
+implementation, which opened every file with Pillow and then a second time
+with the ``exif`` package. The legacy run is skipped when ``exif`` is not
+installed.
+
+Usage: python benchmarks/bench_metadata.py [--corpus DIR] [--count N] [--output FILE]
+"""
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, List
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image
+from PIL.ExifTags import TAGS, GPSTAGS
+
+from benchmarks.corpus import generate_corpus
+from services.metadata import read_image_metadata
+
+
+def legacy_extract_metadata(image_path: Path) -> Dict[str, Any]:
+    """The two-pass extractor as it was before the single-pass engine."""
+    from exif import Image as ExifImage
+
+    metadata = {
+        'filename': image_path.name,
+        'file_size': os.path.getsize(image_path),
+        'file_type': image_path.suffix.lower(),
+    }
+
+    try:
+        with Image.open(image_path) as img:
+            metadata.update({
+                'width': img.width,
+                'height': img.height,
+                'format': img.format,
+                'mode': img.mode,
+            })
+            try:
+                exif_data = {}
+                raw_exif = img.getexif() if hasattr(img, 'getexif') else None
+                if raw_exif:
+                    for tag_id, value in raw_exif.items():
+                        tag = TAGS.get(tag_id, tag_id)
+                        if isinstance(value, bytes):
+                            try:
+                                value = value.decode()
+                            except Exception:
+                                value = str(value)
+                        exif_data[tag] = value
+                    if 'DateTimeOriginal' in exif_data:
+                        try:
+                            metadata['date_taken'] = datetime.strptime(
+                                exif_data['DateTimeOriginal'], '%Y:%m:%d %H:%M:%S'
+                            ).isoformat()
+                        except Exception:
+                            pass
+                    if 'Make' in exif_data:
+                        metadata['camera_make'] = exif_data['Make']
+                    if 'Model' in exif_data:
+                        metadata['camera_model'] = exif_data['Model']
+                    gps_info = {}
+                    for key, value in exif_data.items():
+                        if TAGS.get(key, key) == 'GPSInfo':
+                            for t, v in value.items():
+                                gps_info[GPSTAGS.get(t, t)] = v
+            except Exception as e:
+                metadata['exif_error'] = str(e)
+
+        with open(image_path, 'rb') as img_file:
+            exif_image = ExifImage(img_file)
+            if exif_image.has_exif:
+                if hasattr(exif_image, 'datetime_original'):
+                    metadata['date_taken'] = datetime.strptime(
+                        exif_image.datetime_original,
+                        '%Y:%m:%d %H:%M:%S'
+                    ).isoformat()
+                if hasattr(exif_image, 'gps_latitude') and hasattr(exif_image, 'gps_longitude'):
+                    metadata['gps'] = {
+                        'latitude': float(exif_image.gps_latitude),
+                        'longitude': float(exif_image.gps_longitude)
+                    }
+    except Exception as e:
+        metadata['error'] = str(e)
+
+    return metadata
+
+
+def read_from_buffer(image_path: Path) -> Dict[str, Any]:
+    """Single-pass extraction from bytes already in memory, as during an upload."""
+    return read_image_metadata(image_path, image_path.read_bytes())
+
+
+def time_serial(function: Callable[[Path], Dict[str, Any]], paths: List[Path], repeat: int) -> Dict[str, Any]:
+    timings = []
+    errors = 0
+    for _ in range(repeat):
+        for path in paths:
+            started = time.perf_counter()
+            result = function(path)
+            timings.append(time.perf_counter() - started)
+            errors += 'error' in result
+    timings.sort()
+    return {
+        "images": len(timings),
+        "mean_ms": statistics.fmean(timings) * 1000,
+        "p50_ms": timings[len(timings) // 2] * 1000,
+        "p95_ms": timings[int(len(timings) * 0.95) - 1] * 1000,
+        "errors": errors,
+    }
+
+
+def time_pool(executor_class, workers: int, paths: List[Path], repeat: int) -> Dict[str, Any]:
+    with executor_class(max_workers=workers) as executor:
+        list(executor.map(read_image_metadata, paths[:workers]))  # warm up workers
+        started = time.perf_counter()
+        for _ in range(repeat):
+            list(executor.map(read_image_metadata, paths))
+        elapsed = time.perf_counter() - started
+    return {"workers": workers, "images_per_second": len(paths) * repeat / elapsed}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark image metadata extraction")
+    parser.add_argument("--corpus", type=Path, default=Path(tempfile.gettempdir()) / "photo_logbook_corpus")
+    parser.add_argument("--count", type=int, default=40)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--workers", type=int, default=min(8, os.cpu_count() or 1))
+    parser.add_argument("--output", type=Path)
+    args = parser.parse_args()
+
+    paths = generate_corpus(args.corpus, args.count)
+    results: Dict[str, Any] = {
+        "corpus": str(args.corpus),
+        "images": len(paths),
+        "bytes": sum(path.stat().st_size for path in paths),
+        "single_pass": time_serial(read_image_metadata, paths, args.repeat),
+        "single_pass_buffer": time_serial(read_from_buffer, paths, args.repeat),
+        "thread_pool": time_pool(ThreadPoolExecutor, args.workers, paths, args.repeat),
+        "process_pool": time_pool(ProcessPoolExecutor, args.workers, paths, args.repeat),
+    }
+    try:
+        import exif  # noqa: F401
+        results["legacy"] = time_serial(legacy_extract_metadata, paths, args.repeat)
+        results["speedup_vs_legacy"] = results["legacy"]["mean_ms"] / results["single_pass"]["mean_ms"]
+    except ImportError:
+        results["legacy"] = "skipped: the exif package is not installed"
+
+    report = json.dumps(results, indent=2)
+    if args.output:
+        args.output.write_text(report)
+    print(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,205 @@
+"""Benchmark ``POST /upload`` throughput and latency.
+
+Uploads images from the generated corpus (see ``corpus.py``) with
+``--concurrency`` clients, ``--files-per-request`` files per request, and
+records the latency of every request. Content analysis uses the offline
+``local`` backend, with ``--analysis-delay`` seconds of simulated model
+latency, so no API key is needed and the numbers do not depend on a remote
+service. The analysis queue runs during the uploads, as it does in the
+server; once they finish, the time until every queued job is done is
+reported as well.
+
+Every file gets a unique trailer appended, so the analysis cache and upload
+deduplication see new content each time; pass ``--repeat-content`` to upload
+the corpus unchanged and measure the cache-hit path instead. Requests are
+served in-process through ``httpx.ASGITransport``.
+
+With ``--resumable`` each batch goes through an upload session instead:
+every file is sent in PATCH requests of ``--chunk-bytes`` and the session is
+finalized, so latencies are per batch of ``--files-per-request`` files.
+
+Usage: python benchmarks/bench_upload.py [--database-url URL] [--corpus DIR]
+       [--count N] [--requests N] [--files-per-request N] [--concurrency N]
+       [--analysis-delay S] [--repeat-content] [--resumable] [--chunk-bytes N]
+       [--output FILE]
+"""
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+import argparse
+import asyncio
+import base64
+import itertools
+import json
+import mimetypes
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.corpus import generate_corpus
+from benchmarks.timing import summarize
+
+
+def pending_jobs(engine) -> int:
+    from sqlalchemy import func, select
+    from models import AnalysisJob
+
+    with engine.connect() as connection:
+        return connection.scalar(
+            select(func.count()).select_from(AnalysisJob).where(AnalysisJob.status.in_(("pending", "running")))
+        )
+
+
+async def wait_for_analysis(engine, timeout: float) -> float:
+    """Seconds until no analysis job is pending or running, polling the table."""
+    started = time.perf_counter()
+    while time.perf_counter() - started < timeout:
+        if not await asyncio.to_thread(pending_jobs, engine):
+            break
+        await asyncio.sleep(0.05)
+    return time.perf_counter() - started
+
+
+async def resumable_upload(client, number: int, upload: List[Tuple[str, Tuple[str, bytes, str]]], chunk_bytes: int) -> bool:
+    """Upload one batch through an upload session; returns whether every file was stored."""
+    response = await client.post("/upload-sessions", data={"group_title": f"Bench {number}"})
+    if response.status_code != 201:
+        return False
+    session = response.json()
+    stored = True
+    for _, (name, data, _) in upload:
+        created = await client.post(session["upload_url"], headers={
+            "Tus-Resumable": "1.0.0",
+            "Upload-Length": str(len(data)),
+            "Upload-Metadata": "filename " + base64.b64encode(name.encode()).decode(),
+        })
+        for offset in range(0, len(data), chunk_bytes):
+            response = await client.patch(created.headers["location"], content=data[offset:offset + chunk_bytes], headers={
+                "Tus-Resumable": "1.0.0",
+                "Upload-Offset": str(offset),
+                "Content-Type": "application/offset+octet-stream",
+            })
+            stored = stored and response.status_code in (200, 204)
+    finalized = await client.post(f"/upload-sessions/{session['session_id']}/finalize")
+    return stored and finalized.status_code == 200 and not finalized.json()["errors"]
+
+
+async def run_uploads(application, engine, args: argparse.Namespace, files: List[Tuple[str, bytes, str]]) -> Dict[str, Any]:
+    import httpx
+
+    latencies: List[float] = []
+    errors = 0
+    uploaded_bytes = 0
+    remaining = iter(range(args.requests))
+    corpus = itertools.cycle(files)
+    serial = itertools.count()
+
+    def request_files() -> List[Tuple[str, Tuple[str, bytes, str]]]:
+        selected = []
+        for _ in range(args.files_per_request):
+            name, data, content_type = next(corpus)
+            if not args.repeat_content:
+                # Bytes after the end of the image change the hash, not the picture
+                data = data + f"bench-{next(serial)}".encode()
+            selected.append(("files", (name, data, content_type)))
+        return selected
+
+    transport = httpx.ASGITransport(app=application.app)
+    async with application.lifespan(application.app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            async def user() -> None:
+                nonlocal errors, uploaded_bytes
+                for number in remaining:
+                    upload = request_files()
+                    started = time.perf_counter()
+                    if args.resumable:
+                        stored = await resumable_upload(client, number, upload, args.chunk_bytes)
+                    else:
+                        response = await client.post("/upload", data={"group_title": f"Bench {number}"}, files=upload)
+                        stored = response.status_code == 200 and not response.json()["errors"]
+                    latencies.append(time.perf_counter() - started)
+                    if not stored:
+                        errors += 1
+                    uploaded_bytes += sum(len(item[1][1]) for item in upload)
+
+            started = time.perf_counter()
+            await asyncio.gather(*(user() for _ in range(args.concurrency)))
+            elapsed = time.perf_counter() - started
+            drain = await wait_for_analysis(engine, args.drain_timeout)
+
+    images = len(latencies) * args.files_per_request
+    return {
+        **summarize(latencies),
+        "errors": errors,
+        "seconds": elapsed,
+        "requests_per_second": len(latencies) / elapsed,
+        "images_per_second": images / elapsed,
+        "megabytes_per_second": uploaded_bytes / elapsed / 1e6,
+        "analysis_drain_seconds": drain,
+        "analysis_pending_after_drain": pending_jobs(engine),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark POST /upload")
+    parser.add_argument("--database-url", help="Sync database URL; a temporary SQLite file by default")
+    parser.add_argument("--corpus", type=Path, default=Path(tempfile.gettempdir()) / "photo_logbook_corpus")
+    parser.add_argument("--count", type=int, default=40, help="Distinct images in the corpus")
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--files-per-request", type=int, default=5)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--analysis-delay", type=float, default=0.0,
+                        help="Simulated latency of each content analysis request, in seconds")
+    parser.add_argument("--repeat-content", action="store_true",
+                        help="Upload identical bytes each time, so the analysis cache answers")
+    parser.add_argument("--resumable", action="store_true", help="Upload through upload sessions in chunks")
+    parser.add_argument("--chunk-bytes", type=int, default=8 * 1024 * 1024, help="Bytes per PATCH request with --resumable")
+    parser.add_argument("--drain-timeout", type=float, default=300.0)
+    parser.add_argument("--output", type=Path)
+    args = parser.parse_args()
+
+    paths = generate_corpus(args.corpus, args.count)
+    files = [
+        (path.name, path.read_bytes(), mimetypes.guess_type(path.name)[0] or "application/octet-stream")
+        for path in paths
+    ]
+
+    workdir = Path(tempfile.mkdtemp(prefix="photo_logbook_bench_"))
+    os.environ["DATABASE_URL"] = args.database_url or f"sqlite:///{workdir / 'bench.db'}"
+    os.environ.pop("ASYNC_DATABASE_URL", None)
+    os.environ["ANALYSIS_BACKEND"] = "local"
+    os.environ["LOCAL_ANALYSIS_DELAY"] = str(args.analysis_delay)
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    # main.py creates its uploads directory relative to the working directory
+    os.chdir(workdir)
+
+    import database
+    import main as application
+    from models import Base
+
+    Base.metadata.create_all(database.engine)
+    results: Dict[str, Any] = {
+        "database": database.engine.url.get_backend_name(),
+        "corpus_images": len(files),
+        "corpus_bytes": sum(len(data) for _, data, _ in files),
+        "files_per_request": args.files_per_request,
+        "concurrency": args.concurrency,
+        "analysis_delay": args.analysis_delay,
+        "repeat_content": args.repeat_content,
+        "resumable": args.resumable,
+        "upload": asyncio.run(run_uploads(application, database.engine, args, files)),
+    }
+    # The stored uploads are only needed while the analysis queue reads them
+    shutil.rmtree(workdir / "uploads", ignore_errors=True)
+
+    report = json.dumps(results, indent=2)
+    if args.output:
+        args.output.write_text(report)
+    print(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""Generate a corpus of sample images for benchmarks.
+
+The corpus mixes sizes, formats and EXIF content (camera, capture date and
+GPS coordinates, or none at all) so that metadata extraction and uploads are
+measured on something closer to a real photo library than a single file.
+"""
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import List
+import argparse
+import random
+
+from PIL import Image
+from PIL.ExifTags import IFD
+from PIL.TiffImagePlugin import IFDRational
+
+SIZES = [(640, 480), (1600, 1200), (3024, 4032), (4000, 3000)]
+FORMATS = [("JPEG", ".jpg"), ("JPEG", ".jpg"), ("PNG", ".png"), ("WEBP", ".webp")]
+CAMERAS = [("Apple", "iPhone 13"), ("Canon", "EOS R6"), ("FUJIFILM", "X-T4"), ("Google", "Pixel 8")]
+
+
+def _dms(value: float) -> tuple:
+    value = abs(value)
+    degrees = int(value)
+    minutes = int((value - degrees) * 60)
+    seconds = round((value - degrees - minutes / 60) * 3600, 2)
+    return (IFDRational(degrees, 1), IFDRational(minutes, 1), IFDRational(int(seconds * 100), 100))
+
+
+def make_exif(rng: random.Random, taken: datetime, with_gps: bool) -> Image.Exif:
+    exif = Image.Exif()
+    make, model = rng.choice(CAMERAS)
+    exif[0x010F] = make
+    exif[0x0110] = model
+    exif.get_ifd(IFD.Exif)[0x9003] = taken.strftime("%Y:%m:%d %H:%M:%S")
+    if with_gps:
+        latitude = rng.uniform(-60, 60)
+        longitude = rng.uniform(-170, 170)
+        gps = exif.get_ifd(IFD.GPSInfo)
+        gps[1] = "N" if latitude >= 0 else "S"
+        gps[2] = _dms(latitude)
+        gps[3] = "E" if longitude >= 0 else "W"
+        gps[4] = _dms(longitude)
+    return exif
+
+
+def generate_image(rng: random.Random, size: tuple) -> Image.Image:
+    """A noisy gradient, so encoders produce realistic file sizes."""
+    base = Image.linear_gradient("L").resize(size)
+    noise = Image.effect_noise(size, rng.uniform(20, 80))
+    color = tuple(rng.randint(0, 255) for _ in range(3))
+    return Image.merge("RGB", (base, noise, Image.new("L", size, color[2])))
+
+
+def generate_corpus(directory: Path, count: int, seed: int = 0) -> List[Path]:
+    """Write ``count`` images to ``directory`` and return their paths.
+
+    Existing files with the same names are reused, so repeated runs are cheap.
+    """
+    rng = random.Random(seed)
+    directory.mkdir(parents=True, exist_ok=True)
+    start = datetime(2023, 1, 1)
+    paths = []
+    for index in range(count):
+        size = rng.choice(SIZES)
+        pil_format, extension = rng.choice(FORMATS)
+        kind = rng.random()
+        path = directory / f"sample_{index:05d}{extension}"
+        paths.append(path)
+        if path.exists():
+            continue
+
+        image = generate_image(rng, size)
+        save_args = {}
+        if pil_format in ("JPEG", "WEBP"):
+            save_args["quality"] = 85
+        if kind < 0.8:
+            taken = start + timedelta(minutes=rng.randint(0, 60 * 24 * 365))
+            save_args["exif"] = make_exif(rng, taken, with_gps=kind < 0.5)
+        image.save(path, format=pil_format, **save_args)
+    return paths
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("directory", type=Path)
+    parser.add_argument("--count", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    paths = generate_corpus(args.directory, args.count, args.seed)
+    print(f"{len(paths)} images in {args.directory}")
@@ -0,0 +1,153 @@
+"""Run the benchmark suite and compare the results with an earlier run.
+
+Runs the upload, group endpoint, metadata extraction and event detection
+benchmarks, each in its own process (the application reads its configuration
+at import), and writes their reports to one JSON file together with the
+commit, Python version and platform they were measured on.
+
+With ``--compare BASELINE`` every latency (``*_ms``, except maxima) and
+throughput (``*_per_second``) in the new results is checked against the same
+figure in the baseline; changes for the worse by more than ``--threshold`` are listed
+and make the command exit with status 1, so it can gate a CI job. Compare
+runs made on the same machine and database only.
+
+Usage: python benchmarks/run_suite.py [--database-url URL] [--quick]
+       [--only NAME,NAME] [--output FILE] [--compare BASELINE] [--threshold F]
+"""
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Tuple
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+
+BENCHMARKS_DIR = Path(__file__).resolve().parent
+BACKEND_DIR = BENCHMARKS_DIR.parent
+
+# Arguments of each benchmark, for a full and a --quick run
+SUITE: Dict[str, Tuple[str, List[str], List[str]]] = {
+    "upload": (
+        "bench_upload.py",
+        ["--count", "40", "--requests", "200", "--files-per-request", "5", "--concurrency", "4"],
+        ["--count", "12", "--requests", "20", "--files-per-request", "3", "--concurrency", "4"],
+    ),
+    "groups": (
+        "bench_groups.py",
+        ["--rows", "10000,100000", "--repeat", "100"],
+        ["--rows", "10000", "--repeat", "20"],
+    ),
+    "metadata": (
+        "bench_metadata.py",
+        ["--count", "40", "--repeat", "3"],
+        ["--count", "12", "--repeat", "1"],
+    ),
+    "events": (
+        "bench_events.py",
+        ["--rows", "500000", "--repeat", "5"],
+        ["--rows", "50000", "--repeat", "2"],
+    ),
+}
+# Benchmarks that take a database
+DATABASE_BENCHMARKS = {"upload", "groups"}
+
+
+def git_commit() -> Dict[str, Any]:
+    def git(*args: str) -> str:
+        return subprocess.run(
+            ["git", *args], cwd=BACKEND_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+
+    try:
+        return {"commit": git("rev-parse", "HEAD"), "dirty": bool(git("status", "--porcelain"))}
+    except (OSError, subprocess.CalledProcessError):
+        return {"commit": None, "dirty": None}
+
+
+def run_benchmark(name: str, args: argparse.Namespace) -> Dict[str, Any]:
+    script, full, quick = SUITE[name]
+    command = [sys.executable, str(BENCHMARKS_DIR / script), *(quick if args.quick else full)]
+    if args.database_url and name in DATABASE_BENCHMARKS:
+        command += ["--database-url", args.database_url]
+    with tempfile.NamedTemporaryFile(suffix=".json") as output:
+        print(f"Running {name}: {' '.join(command[1:])}", file=sys.stderr)
+        # The benchmarks' own progress goes to stderr, which is passed through
+        subprocess.run(command + ["--output", output.name], cwd=BACKEND_DIR, stdout=subprocess.DEVNULL, check=True)
+        return json.loads(Path(output.name).read_text())
+
+
+def figures(results: Any, path: str = "") -> Iterator[Tuple[str, float]]:
+    """Latencies and throughputs in a report, keyed by their path."""
+    if isinstance(results, dict):
+        for key, value in results.items():
+            yield from figures(value, f"{path}.{key}" if path else key)
+    elif isinstance(results, (int, float)) and not isinstance(results, bool):
+        # A maximum is a single sample, too noisy to compare
+        if (path.endswith("_ms") and not path.endswith("max_ms")) or path.endswith("_per_second"):
+            yield path, float(results)
+
+
+def compare(baseline: Dict[str, Any], current: Dict[str, Any], threshold: float) -> List[Dict[str, Any]]:
+    """Figures that got worse by more than ``threshold`` (a fraction) since the baseline."""
+    before = dict(figures(baseline["benchmarks"]))
+    regressions = []
+    for path, value in figures(current["benchmarks"]):
+        previous = before.get(path)
+        if not previous:
+            continue
+        change = (value - previous) / previous
+        # Latencies regress upwards, throughputs downwards
+        worse = change > threshold if path.endswith("_ms") else change < -threshold
+        if worse:
+            regressions.append({"figure": path, "baseline": previous, "current": value, "change": round(change, 3)})
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Run the benchmark suite")
+    parser.add_argument("--database-url", help="Sync database URL for the upload and group benchmarks")
+    parser.add_argument("--quick", action="store_true", help="Smaller runs, e.g. for a smoke test")
+    parser.add_argument("--only", help=f"Comma-separated benchmarks to run, from {', '.join(SUITE)}")
+    parser.add_argument("--output", type=Path)
+    parser.add_argument("--compare", type=Path, help="Results of an earlier run to check for regressions")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Allowed change for the worse, as a fraction")
+    args = parser.parse_args()
+
+    names = args.only.split(",") if args.only else list(SUITE)
+    unknown = set(names) - set(SUITE)
+    if unknown:
+        parser.error(f"unknown benchmarks: {', '.join(sorted(unknown))}")
+
+    results: Dict[str, Any] = {
+        "measured_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        **git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "quick": args.quick,
+        "benchmarks": {name: run_benchmark(name, args) for name in names},
+    }
+    regressions = None
+    if args.compare:
+        baseline = json.loads(args.compare.read_text())
+        regressions = compare(baseline, results, args.threshold)
+        results["comparison"] = {
+            "baseline": str(args.compare),
+            "baseline_commit": baseline.get("commit"),
+            "threshold": args.threshold,
+            "regressions": regressions,
+        }
+
+    report = json.dumps(results, indent=2)
+    if args.output:
+        args.output.write_text(report)
+    print(report)
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
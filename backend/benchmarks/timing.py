@@ -0,0 +1,23 @@
+"""Latency summaries shared by the benchmarks."""
+from typing import Any, Dict, List
+import statistics
+
+
+def percentile(sorted_timings: List[float], fraction: float) -> float:
+    """Nearest-rank percentile of an ascending list of timings."""
+    return sorted_timings[max(0, min(len(sorted_timings), round(len(sorted_timings) * fraction)) - 1)]
+
+
+def summarize(timings: List[float]) -> Dict[str, Any]:
+    """Count, mean and p50/p95/p99/max of timings in seconds, reported in milliseconds."""
+    if not timings:
+        return {"requests": 0}
+    timings = sorted(timings)
+    return {
+        "requests": len(timings),
+        "mean_ms": statistics.fmean(timings) * 1000,
+        "p50_ms": percentile(timings, 0.50) * 1000,
+        "p95_ms": percentile(timings, 0.95) * 1000,
+        "p99_ms": percentile(timings, 0.99) * 1000,
+        "max_ms": timings[-1] * 1000,
+    }
@@ -1,72 +1,808 @@
-from sqlalchemy.orm import Session
-from models import ImageGroup, Image
-from datetime import datetime
-from typing import List, Optional
+from sqlalchemy import delete, false, func, or_, and_, insert, select, true, tuple_, update
+from sqlalchemy.engine import Row
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import defer, joinedload, selectinload
+from sqlalchemy.sql import Select
+from models import ImageGroup, Image, AnalysisJob, UploadSession, ResumableUpload
+from datetime import datetime, timedelta
+from typing import Any, List, Optional, Tuple
 import json
 
-def create_image_group(db: Session, title: str, directory_name: str) -> ImageGroup:
-    """Create a new image group."""
+async def create_image_group(db: AsyncSession, title: str, directory_name: str, commit: bool = True) -> ImageGroup:
+    """Create a new image group.
+
+    With ``commit=False`` the group is only flushed, so its ID is known but it
+    is committed together with whatever the caller writes next.
+    """
     db_group = ImageGroup(
         title=title,
         directory_name=directory_name,
         created_at=datetime.utcnow()
     )
     db.add(db_group)
-    db.commit()
-    db.refresh(db_group)
+    if not commit:
+        await db.flush()
+        return db_group
+    await db.commit()
+    await db.refresh(db_group)
     return db_group
 
-def get_image_group(db: Session, group_id: int) -> Optional[ImageGroup]:
+async def get_image_group(db: AsyncSession, group_id: int) -> Optional[ImageGroup]:
     """Get an image group by ID."""
-    return db.query(ImageGroup).filter(ImageGroup.id == group_id).first()
+    return await db.get(ImageGroup, group_id)
 
-def get_image_group_by_directory(db: Session, directory_name: str) -> Optional[ImageGroup]:
+async def get_image_group_by_directory(db: AsyncSession, directory_name: str) -> Optional[ImageGroup]:
     """Get an image group by directory name."""
-    return db.query(ImageGroup).filter(ImageGroup.directory_name == directory_name).first()
+    return await db.scalar(select(ImageGroup).where(ImageGroup.directory_name == directory_name))
 
-def get_all_image_groups(db: Session) -> List[ImageGroup]:
+async def get_all_image_groups(db: AsyncSession) -> List[ImageGroup]:
     """Get all image groups."""
-    return db.query(ImageGroup).order_by(ImageGroup.created_at.desc()).all()
+    return list(await db.scalars(select(ImageGroup).order_by(ImageGroup.created_at.desc())))
+
+def image_groups_page_query(limit: int, after: Optional[Tuple[datetime, int]] = None) -> Select:
+    """Statement behind ``get_image_groups_page``; usable with sync and async sessions."""
+    page = select(ImageGroup.id, ImageGroup.title, ImageGroup.created_at)
+    if after is not None:
+        created_at, group_id = after
+        page = page.where(or_(
+            ImageGroup.created_at < created_at,
+            and_(ImageGroup.created_at == created_at, ImageGroup.id < group_id)
+        ))
+    page = page.order_by(ImageGroup.created_at.desc(), ImageGroup.id.desc()).limit(limit).subquery()
+
+    return (
+        select(
+            page.c.id,
+            page.c.title,
+            page.c.created_at,
+            func.count(Image.id).label("file_count"),
+            func.coalesce(func.sum(Image.file_size), 0).label("total_bytes")
+        )
+        .outerjoin(Image, Image.group_id == page.c.id)
+        .group_by(page.c.id, page.c.title, page.c.created_at)
+        .order_by(page.c.created_at.desc(), page.c.id.desc())
+    )
 
-def create_image(
-    db: Session,
+async def get_image_groups_page(
+    db: AsyncSession,
+    limit: int,
+    after: Optional[Tuple[datetime, int]] = None
+) -> List[Any]:
+    """Get one page of groups, newest first, with image count and total bytes.
+
+    ``after`` is the ``(created_at, id)`` of the last group of the previous
+    page. The page is selected with the ``(created_at, id)`` index and the
+    counts are aggregated for that page only, all in a single query.
+    """
+    return list(await db.execute(image_groups_page_query(limit, after)))
+
+def image_values(
     group_id: int,
     original_filename: str,
     stored_filename: str,
     content_type: str,
     file_size: int,
     metadata: dict,
-    content_analysis: dict
-) -> Image:
-    """Create a new image record."""
-    db_image = Image(
+    content_analysis: Optional[dict],
+    analysis_status: str = "completed",
+    content_hash: Optional[str] = None,
+    blob_key: Optional[str] = None
+) -> dict:
+    """Column values of a new image record."""
+    return dict(
         group_id=group_id,
         original_filename=original_filename,
         stored_filename=stored_filename,
         content_type=content_type,
         file_size=file_size,
+        content_hash=content_hash,
+        blob_key=blob_key,
         uploaded_at=datetime.utcnow(),
-        # Image metadata
+        **metadata_columns(metadata),
+        # AI Analysis
+        content_analysis=content_analysis,
+        analysis_status=analysis_status
+    )
+
+def metadata_columns(metadata: dict) -> dict:
+    """Image columns filled from the dict returned by ``ImageAnalyzer.extract_metadata``."""
+    return dict(
         width=metadata.get('width'),
         height=metadata.get('height'),
         format=metadata.get('format'),
         camera_make=metadata.get('camera_make'),
         camera_model=metadata.get('camera_model'),
         date_taken=datetime.fromisoformat(metadata['date_taken']) if metadata.get('date_taken') else None,
-        gps_latitude=str(metadata['gps']['latitude']) if metadata.get('gps') else None,
-        gps_longitude=str(metadata['gps']['longitude']) if metadata.get('gps') else None,
-        # AI Analysis
-        content_analysis=content_analysis
+        gps_latitude=metadata['gps']['latitude'] if metadata.get('gps') else None,
+        gps_longitude=metadata['gps']['longitude'] if metadata.get('gps') else None,
+        perceptual_hash=metadata.get('perceptual_hash'),
     )
+
+async def create_image(
+    db: AsyncSession,
+    group_id: int,
+    original_filename: str,
+    stored_filename: str,
+    content_type: str,
+    file_size: int,
+    metadata: dict,
+    content_analysis: Optional[dict],
+    analysis_status: str = "completed",
+    content_hash: Optional[str] = None,
+    blob_key: Optional[str] = None
+) -> Image:
+    """Create a new image record."""
+    db_image = Image(**image_values(
+        group_id,
+        original_filename,
+        stored_filename,
+        content_type,
+        file_size,
+        metadata,
+        content_analysis,
+        analysis_status,
+        content_hash,
+        blob_key
+    ))
     db.add(db_image)
-    db.commit()
-    db.refresh(db_image)
+    await db.commit()
+    await db.refresh(db_image)
     return db_image
 
-def get_image(db: Session, image_id: int) -> Optional[Image]:
-    """Get an image by ID."""
-    return db.query(Image).filter(Image.id == image_id).first()
+async def create_images_bulk(
+    db: AsyncSession,
+    group_id: int,
+    images: List[dict],
+    max_attempts: int = 5
+) -> List[dict]:
+    """Insert the image records of one upload, and their analysis jobs, in one transaction.
+
+    Each item of ``images`` holds the keyword arguments of ``image_values``
+    except ``group_id``. Images without ``content_analysis`` get a pending
+    analysis job. Returns one outcome per item, in order: ``{"id": ...,
+    "job_id": ...}`` or ``{"error": ...}``.
+
+    Rows are written with one multi-row INSERT ... RETURNING per table. If
+    that fails, the batch is rolled back to a savepoint and retried row by
+    row, so only the offending rows are reported as errors. Whatever else is
+    pending in the session (e.g. an uncommitted group) is committed as well.
+    """
+    outcomes: List[dict] = [{} for _ in images]
+    rows = []
+    for index, image in enumerate(images):
+        try:
+            rows.append((index, image_values(group_id=group_id, **image)))
+        except Exception as e:
+            outcomes[index] = {"error": str(e)}
+
+    try:
+        async with db.begin_nested():
+            await _insert_image_rows(db, rows, outcomes, max_attempts)
+    except Exception:
+        for row in rows:
+            try:
+                async with db.begin_nested():
+                    await _insert_image_rows(db, [row], outcomes, max_attempts)
+            except Exception as e:
+                # Report the driver's message rather than the statement and parameters
+                outcomes[row[0]] = {"error": str(getattr(e, "orig", None) or e)}
+
+    await db.commit()
+    return outcomes
+
+async def _insert_image_rows(db: AsyncSession, rows: List[Tuple[int, dict]], outcomes: List[dict], max_attempts: int) -> None:
+    if not rows:
+        return
+    # RETURNING order is not guaranteed for multi-row inserts, so inserted rows
+    # are matched back by their stored filename, which is unique per group
+    returned = (await db.execute(
+        insert(Image).returning(Image.id, Image.stored_filename),
+        [values for _, values in rows]
+    )).all()
+    image_ids = {stored_filename: image_id for image_id, stored_filename in returned}
+
+    now = datetime.utcnow()
+    pending = [
+        image_ids[values["stored_filename"]]
+        for _, values in rows
+        if values["analysis_status"] == "pending"
+    ]
+    job_ids = {}
+    if pending:
+        returned = (await db.execute(
+            insert(AnalysisJob).returning(AnalysisJob.id, AnalysisJob.image_id),
+            [
+                dict(
+                    image_id=image_id,
+                    status="pending",
+                    attempts=0,
+                    max_attempts=max_attempts,
+                    run_after=now,
+                    created_at=now,
+                    updated_at=now
+                )
+                for image_id in pending
+            ]
+        )).all()
+        job_ids = {image_id: job_id for job_id, image_id in returned}
+
+    for index, values in rows:
+        image_id = image_ids[values["stored_filename"]]
+        outcomes[index] = {"id": image_id, "job_id": job_ids.get(image_id)}
+
+async def get_group_images_page(
+    db: AsyncSession,
+    group_id: int,
+    limit: int,
+    after_id: Optional[int] = None,
+    include_content_analysis: bool = True
+) -> List[Image]:
+    """Get one page of a group's images in upload order.
+
+    Uses the ``(group_id, id)`` index; the potentially large
+    ``content_analysis`` column is only loaded when asked for.
+    """
+    query = select(Image).where(Image.group_id == group_id)
+    if after_id is not None:
+        query = query.where(Image.id > after_id)
+    if not include_content_analysis:
+        query = query.options(defer(Image.content_analysis, raiseload=True))
+    return list(await db.scalars(query.order_by(Image.id).limit(limit)))
+
+def image_search_query(
+    bbox: Optional[Tuple[float, float, float, float]] = None,
+    taken_from: Optional[datetime] = None,
+    taken_before: Optional[datetime] = None,
+    limit: int = 100,
+    after: Optional[tuple] = None,
+    include_content_analysis: bool = True
+) -> Select:
+    """Statement behind ``search_images``; usable with sync and async sessions."""
+    query = select(Image).options(selectinload(Image.group))
+
+    if taken_from is not None:
+        query = query.where(Image.date_taken >= taken_from)
+    if taken_before is not None:
+        query = query.where(Image.date_taken < taken_before)
+
+    if bbox is not None:
+        min_lon, min_lat, max_lon, max_lat = bbox
+        query = query.where(Image.gps_latitude.between(min_lat, max_lat))
+        if min_lon <= max_lon:
+            query = query.where(Image.gps_longitude.between(min_lon, max_lon))
+        else:
+            # The box crosses the antimeridian
+            query = query.where(or_(Image.gps_longitude >= min_lon, Image.gps_longitude <= max_lon))
+        sort_key = (Image.gps_latitude, Image.gps_longitude, Image.id)
+    else:
+        sort_key = (Image.date_taken, Image.id)
+
+    if after is not None:
+        query = query.where(tuple_(*sort_key) > tuple_(*after))
+    if not include_content_analysis:
+        query = query.options(defer(Image.content_analysis, raiseload=True))
+    return query.order_by(*sort_key).limit(limit)
+
+async def search_images(
+    db: AsyncSession,
+    bbox: Optional[Tuple[float, float, float, float]] = None,
+    taken_from: Optional[datetime] = None,
+    taken_before: Optional[datetime] = None,
+    limit: int = 100,
+    after: Optional[tuple] = None,
+    include_content_analysis: bool = True
+) -> List[Image]:
+    """Find images by location and/or capture time, with their groups loaded.
+
+    ``bbox`` is ``(min_lon, min_lat, max_lon, max_lat)`` in degrees; a box
+    with ``min_lon > max_lon`` crosses the antimeridian. ``taken_from`` is
+    inclusive and ``taken_before`` exclusive.
+
+    Results follow the index that drives the search, so a page is read from
+    the index in order and the scan stops once it is full: with a ``bbox``
+    they are sorted by ``(gps_latitude, gps_longitude, id)``, otherwise by
+    ``(date_taken, id)``. ``after`` is that sort key of the last image of the
+    previous page.
+    """
+    return list(await db.scalars(image_search_query(
+        bbox, taken_from, taken_before, limit, after, include_content_analysis
+    )))
+
+async def get_images_by_ids(
+    db: AsyncSession,
+    image_ids: List[int],
+    include_content_analysis: bool = True
+) -> List[Image]:
+    """Get images in the order of ``image_ids``, with their groups loaded; missing IDs are skipped."""
+    if not image_ids:
+        return []
+    query = select(Image).options(selectinload(Image.group)).where(Image.id.in_(image_ids))
+    if not include_content_analysis:
+        query = query.options(defer(Image.content_analysis, raiseload=True))
+    images = {image.id: image for image in await db.scalars(query)}
+    return [images[image_id] for image_id in image_ids if image_id in images]
+
+async def get_group_export_files(
+    db: AsyncSession,
+    group_id: int,
+    limit: int,
+    after_id: Optional[int] = None
+) -> List[Row]:
+    """``(id, stored_filename, uploaded_at, blob_key)`` of one page of a group's images, in ID order."""
+    query = select(Image.id, Image.stored_filename, Image.uploaded_at, Image.blob_key).where(Image.group_id == group_id)
+    if after_id is not None:
+        query = query.where(Image.id > after_id)
+    return list(await db.execute(query.order_by(Image.id).limit(limit)))
+
+async def get_perceptual_hashes(db: AsyncSession, after_id: int, limit: int) -> List[Tuple[int, int, int]]:
+    """``(id, group_id, perceptual_hash)`` of the hashed images after ``after_id``, in ID order."""
+    rows = await db.execute(
+        select(Image.id, Image.group_id, Image.perceptual_hash)
+        .where(Image.id > after_id, Image.perceptual_hash.is_not(None))
+        .order_by(Image.id)
+        .limit(limit)
+    )
+    return [tuple(row) for row in rows]
+
+async def get_event_points(
+    db: AsyncSession,
+    after_id: int,
+    limit: int
+) -> List[Tuple[int, int, datetime, Optional[float], Optional[float]]]:
+    """``(id, group_id, date_taken, gps_latitude, gps_longitude)`` of the dated images after ``after_id``."""
+    rows = await db.execute(
+        select(Image.id, Image.group_id, Image.date_taken, Image.gps_latitude, Image.gps_longitude)
+        .where(Image.id > after_id, Image.date_taken.is_not(None), Image.group_id.is_not(None))
+        .order_by(Image.id)
+        .limit(limit)
+    )
+    return [tuple(row) for row in rows]
+
+def content_analysis_failed():
+    """SQL condition for images whose content analysis failed or stored an error blob."""
+    return or_(
+        Image.analysis_status == "failed",
+        Image.content_analysis["error"].as_string().isnot(None)
+    )
+
+def metadata_missing():
+    """SQL condition for images whose metadata could not be read or predates the perceptual hash."""
+    return or_(Image.width.is_(None), Image.perceptual_hash.is_(None))
+
+async def get_backfill_chunk(
+    db: AsyncSession,
+    after_id: int,
+    limit: int,
+    metadata: bool,
+    content: bool,
+    only_failed: bool = True,
+    group_id: Optional[int] = None
+) -> List[Tuple[Image, bool, bool]]:
+    """Next images to re-analyze, in ID order, with their groups loaded.
 
-def get_images_by_group(db: Session, group_id: int) -> List[Image]:
+    Returns ``(image, needs_metadata, needs_content)`` for up to ``limit``
+    images with an ID above ``after_id``. With ``only_failed`` an image is
+    selected when a requested kind of analysis failed for it; otherwise every
+    image needs every requested kind. ``content_analysis`` is not loaded.
+    """
+    needs_metadata = (metadata_missing() if only_failed else true()) if metadata else false()
+    needs_content = (content_analysis_failed() if only_failed else true()) if content else false()
+    query = (
+        select(Image, needs_metadata.label("needs_metadata"), needs_content.label("needs_content"))
+        .options(selectinload(Image.group), defer(Image.content_analysis, raiseload=True))
+        .where(Image.id > after_id, or_(needs_metadata, needs_content))
+    )
+    if group_id is not None:
+        query = query.where(Image.group_id == group_id)
+    rows = await db.execute(query.order_by(Image.id).limit(limit))
+    return [(image, bool(wants_metadata), bool(wants_content)) for image, wants_metadata, wants_content in rows]
+
+async def update_images_bulk(db: AsyncSession, updates: List[dict]) -> None:
+    """Apply column updates to many images in one transaction.
+
+    Every item holds the image ``id`` and the columns to set. Images whose
+    content analysis succeeded also get their unfinished analysis jobs closed.
+    """
+    if not updates:
+        return
+    # Bulk UPDATE by primary key batches items that set the same columns
+    await db.execute(update(Image), updates)
+    analyzed = [item["id"] for item in updates if item.get("analysis_status") == "completed"]
+    if analyzed:
+        now = datetime.utcnow()
+        await db.execute(
+            update(AnalysisJob)
+            .where(AnalysisJob.image_id.in_(analyzed), AnalysisJob.status.in_(("pending", "failed")))
+            .values(status="completed", last_error=None, finished_at=now, updated_at=now)
+            .execution_options(synchronize_session=False)
+        )
+    await db.commit()
+
+async def get_images_without_blob(
+    db: AsyncSession,
+    after_id: int,
+    limit: int,
+    group_id: Optional[int] = None
+) -> List[Image]:
+    """Next images still read from their group directory, in ID order, with their groups loaded."""
+    query = (
+        select(Image)
+        .options(joinedload(Image.group), defer(Image.content_analysis, raiseload=True))
+        .where(Image.blob_key.is_(None), Image.id > after_id)
+    )
+    if group_id is not None:
+        query = query.where(Image.group_id == group_id)
+    return list(await db.scalars(query.order_by(Image.id).limit(limit)))
+
+async def get_blob_keys(db: AsyncSession) -> set:
+    """Every blob key an image refers to."""
+    return set(await db.scalars(select(Image.blob_key).where(Image.blob_key.is_not(None)).distinct()))
+
+async def get_referenced_blob_keys(db: AsyncSession, keys: List[str]) -> set:
+    """Those of ``keys`` that an image refers to."""
+    if not keys:
+        return set()
+    return set(await db.scalars(select(Image.blob_key).where(Image.blob_key.in_(keys)).distinct()))
+
+async def get_image(db: AsyncSession, image_id: int) -> Optional[Image]:
+    """Get an image by ID, with its group loaded."""
+    return await db.scalar(select(Image).options(joinedload(Image.group)).where(Image.id == image_id))
+
+async def get_images_by_group(db: AsyncSession, group_id: int) -> List[Image]:
     """Get all images in a group."""
-    return db.query(Image).filter(Image.group_id == group_id).order_by(Image.uploaded_at.desc()).all() 
\ No newline at end of file
+    return list(await db.scalars(
+        select(Image).where(Image.group_id == group_id).order_by(Image.uploaded_at.desc())
+    ))
+
+async def get_analyzed_image_by_hash(db: AsyncSession, content_hash: str) -> Optional[Image]:
+    """Get the most recent successfully analyzed image with the given content hash."""
+    candidates = await db.scalars(
+        select(Image)
+        .where(Image.content_hash == content_hash, Image.analysis_status == "completed")
+        .order_by(Image.id.desc())
+        .limit(5)
+    )
+    for image in candidates:
+        if image.content_analysis and "error" not in image.content_analysis:
+            return image
+    return None
+
+async def create_analysis_job(db: AsyncSession, image_id: int, max_attempts: int = 5) -> AnalysisJob:
+    """Queue content analysis for an image."""
+    now = datetime.utcnow()
+    db_job = AnalysisJob(
+        image_id=image_id,
+        status="pending",
+        attempts=0,
+        max_attempts=max_attempts,
+        run_after=now,
+        created_at=now,
+        updated_at=now
+    )
+    db.add(db_job)
+    await db.commit()
+    await db.refresh(db_job)
+    return db_job
+
+async def get_analysis_job(db: AsyncSession, job_id: int) -> Optional[AnalysisJob]:
+    """Get an analysis job by ID."""
+    return await db.get(AnalysisJob, job_id)
+
+async def claim_analysis_jobs(db: AsyncSession, limit: int = 1) -> List[AnalysisJob]:
+    """Mark up to ``limit`` of the oldest due pending jobs as running and return them.
+
+    Each claim is a conditional UPDATE, so several workers (or processes)
+    polling the same table never run the same job twice. The jobs are returned
+    with their image and the image's group loaded.
+    """
+    now = datetime.utcnow()
+    candidates = (await db.execute(
+        select(AnalysisJob.id)
+        .where(AnalysisJob.status == "pending", AnalysisJob.run_after <= now)
+        .order_by(AnalysisJob.run_after, AnalysisJob.id)
+        .limit(limit + 4)
+    )).all()
+    claimed_ids = []
+    for (job_id,) in candidates:
+        if len(claimed_ids) == limit:
+            break
+        claimed = await db.execute(
+            update(AnalysisJob)
+            .where(AnalysisJob.id == job_id, AnalysisJob.status == "pending")
+            .values(
+                status="running",
+                attempts=AnalysisJob.attempts + 1,
+                started_at=now,
+                updated_at=now
+            )
+            .execution_options(synchronize_session=False)
+        )
+        if claimed.rowcount:
+            claimed_ids.append(job_id)
+    if not claimed_ids:
+        await db.rollback()
+        return []
+
+    jobs = list(await db.scalars(
+        select(AnalysisJob)
+        .options(joinedload(AnalysisJob.image).joinedload(Image.group))
+        .where(AnalysisJob.id.in_(claimed_ids))
+        .order_by(AnalysisJob.id)
+    ))
+    for job in jobs:
+        if job.image:
+            job.image.analysis_status = "running"
+    await db.commit()
+    return jobs
+
+async def claim_next_analysis_job(db: AsyncSession) -> Optional[AnalysisJob]:
+    """Claim the oldest due pending job, see ``claim_analysis_jobs``."""
+    jobs = await claim_analysis_jobs(db, 1)
+    return jobs[0] if jobs else None
+
+async def complete_analysis_job(db: AsyncSession, job: AnalysisJob, content_analysis: dict) -> AnalysisJob:
+    """Store the analysis result and mark the job as completed."""
+    now = datetime.utcnow()
+    job.status = "completed"
+    job.last_error = None
+    job.finished_at = now
+    job.updated_at = now
+    if job.image:
+        job.image.content_analysis = content_analysis
+        job.image.analysis_status = "completed"
+    await db.commit()
+    return job
+
+async def fail_analysis_job(
+    db: AsyncSession,
+    job: AnalysisJob,
+    error: str,
+    retry_delay: Optional[float] = None,
+    content_analysis: Optional[dict] = None
+) -> AnalysisJob:
+    """Record a failed attempt.
+
+    With a ``retry_delay`` and attempts left the job goes back to pending and
+    becomes due after the delay; otherwise it is marked as failed for good and
+    ``content_analysis`` (if given) is stored on the image.
+    """
+    now = datetime.utcnow()
+    job.last_error = error
+    job.updated_at = now
+    if retry_delay is not None and job.attempts < job.max_attempts:
+        job.status = "pending"
+        job.run_after = now + timedelta(seconds=retry_delay)
+        if job.image:
+            job.image.analysis_status = "pending"
+    else:
+        job.status = "failed"
+        job.finished_at = now
+        if job.image:
+            job.image.analysis_status = "failed"
+            if content_analysis is not None:
+                job.image.content_analysis = content_analysis
+    await db.commit()
+    return job
+
+async def defer_analysis_job(db: AsyncSession, job: AnalysisJob, delay: float, reason: str) -> AnalysisJob:
+    """Return a claimed job to pending without counting the attempt."""
+    now = datetime.utcnow()
+    job.status = "pending"
+    job.attempts = max(0, job.attempts - 1)
+    job.run_after = now + timedelta(seconds=delay)
+    job.started_at = None
+    job.last_error = reason
+    job.updated_at = now
+    if job.image:
+        job.image.analysis_status = "pending"
+    await db.commit()
+    return job
+
+async def requeue_stale_analysis_jobs(db: AsyncSession, stale_after: timedelta) -> int:
+    """Return jobs stuck in running (e.g. after a crash) to the pending state."""
+    now = datetime.utcnow()
+    stale_jobs = list(await db.scalars(
+        select(AnalysisJob)
+        .options(joinedload(AnalysisJob.image))
+        .where(AnalysisJob.status == "running", AnalysisJob.started_at < now - stale_after)
+    ))
+    for job in stale_jobs:
+        job.status = "pending"
+        job.run_after = now
+        job.updated_at = now
+        if job.image:
+            job.image.analysis_status = "pending"
+    await db.commit()
+    return len(stale_jobs)
+
+async def create_upload_session(
+    db: AsyncSession,
+    session_id: str,
+    title: str,
+    directory_name: str,
+    expires_at: datetime
+) -> UploadSession:
+    """Create an upload session and the group its files go to, in one transaction."""
+    db_group = await create_image_group(db, title, directory_name, commit=False)
+    db_session = UploadSession(
+        id=session_id,
+        group_id=db_group.id,
+        status="open",
+        created_at=datetime.utcnow(),
+        expires_at=expires_at
+    )
+    db.add(db_session)
+    await db.commit()
+    await db.refresh(db_session, ["group"])
+    return db_session
+
+async def get_upload_session(db: AsyncSession, session_id: str) -> Optional[UploadSession]:
+    """Get an upload session by ID, with its group loaded."""
+    return await db.scalar(
+        select(UploadSession).options(joinedload(UploadSession.group)).where(UploadSession.id == session_id)
+    )
+
+async def get_session_uploads(db: AsyncSession, session_id: str) -> List[ResumableUpload]:
+    """The files of an upload session, in the order they were created."""
+    return list(await db.scalars(
+        select(ResumableUpload)
+        .where(ResumableUpload.session_id == session_id)
+        .order_by(ResumableUpload.created_at, ResumableUpload.id)
+    ))
+
+async def get_session_stored_filenames(db: AsyncSession, session_id: str, prefix: str) -> set:
+    """Stored filenames starting with ``prefix`` already taken in an upload session."""
+    return set(await db.scalars(
+        select(ResumableUpload.stored_filename).where(
+            ResumableUpload.session_id == session_id,
+            ResumableUpload.stored_filename.startswith(prefix, autoescape=True)
+        )
+    ))
+
+async def create_resumable_upload(
+    db: AsyncSession,
+    upload_id: str,
+    session: UploadSession,
+    original_filename: str,
+    stored_filename: str,
+    upload_length: int,
+    expires_at: datetime
+) -> ResumableUpload:
+    """Register a file of an upload session, before any of its bytes arrive."""
+    now = datetime.utcnow()
+    db_upload = ResumableUpload(
+        id=upload_id,
+        session_id=session.id,
+        original_filename=original_filename,
+        stored_filename=stored_filename,
+        upload_length=upload_length,
+        upload_offset=0,
+        status="uploading",
+        created_at=now,
+        updated_at=now
+    )
+    db.add(db_upload)
+    session.expires_at = expires_at
+    await db.commit()
+    return db_upload
+
+async def get_resumable_upload(db: AsyncSession, session_id: str, upload_id: str) -> Optional[ResumableUpload]:
+    """Get a file of an upload session, with the session and its group loaded."""
+    return await db.scalar(
+        select(ResumableUpload)
+        .options(joinedload(ResumableUpload.session).joinedload(UploadSession.group))
+        .where(ResumableUpload.id == upload_id, ResumableUpload.session_id == session_id)
+    )
+
+async def get_resumable_upload_ids(db: AsyncSession, upload_ids: List[str]) -> set:
+    """Which of the given IDs belong to existing files of upload sessions."""
+    if not upload_ids:
+        return set()
+    return set(await db.scalars(select(ResumableUpload.id).where(ResumableUpload.id.in_(upload_ids))))
+
+async def delete_resumable_upload(db: AsyncSession, upload: ResumableUpload) -> None:
+    """Forget a file of an upload session."""
+    await db.delete(upload)
+    await db.commit()
+
+async def advance_resumable_upload(
+    db: AsyncSession,
+    upload: ResumableUpload,
+    expected_offset: int,
+    new_offset: int,
+    expires_at: datetime
+) -> bool:
+    """Record received bytes, unless another request moved the offset first.
+
+    The UPDATE is conditional on the offset the request started from, so of
+    two requests writing the same range only one is counted. A file whose
+    last byte arrived moves to ``processing``. Also moves the offset back
+    when received data was lost. Returns whether it was recorded; ``upload``
+    is refreshed either way.
+    """
+    now = datetime.utcnow()
+    advanced = await db.execute(
+        update(ResumableUpload)
+        .where(
+            ResumableUpload.id == upload.id,
+            ResumableUpload.upload_offset == expected_offset,
+            ResumableUpload.status == "uploading"
+        )
+        .values(
+            upload_offset=new_offset,
+            status="processing" if new_offset == upload.upload_length else "uploading",
+            updated_at=now
+        )
+        .execution_options(synchronize_session=False)
+    )
+    await db.execute(
+        update(UploadSession)
+        .where(UploadSession.id == upload.session_id)
+        .values(expires_at=expires_at)
+        .execution_options(synchronize_session=False)
+    )
+    await db.commit()
+    await db.refresh(upload, ["upload_offset", "status", "updated_at"])
+    return bool(advanced.rowcount)
+
+async def finish_resumable_upload(
+    db: AsyncSession,
+    upload: ResumableUpload,
+    image_id: Optional[int] = None,
+    result: Optional[dict] = None,
+    error: Optional[str] = None
+) -> ResumableUpload:
+    """Mark a received file as stored (with its image) or failed (with the reason)."""
+    upload.status = "failed" if error else "completed"
+    upload.image_id = image_id
+    upload.result = result
+    upload.error = error
+    upload.updated_at = datetime.utcnow()
+    await db.commit()
+    return upload
+
+async def finalize_upload_session(db: AsyncSession, session: UploadSession) -> List[ResumableUpload]:
+    """Close a session to new files and data; returns its files.
+
+    Files still incomplete are marked as failed, their partial data is of no
+    further use.
+    """
+    session.status = "finalized"
+    uploads = await get_session_uploads(db, session.id)
+    now = datetime.utcnow()
+    for upload in uploads:
+        if upload.status == "uploading":
+            upload.status = "failed"
+            upload.error = f"{upload.original_filename} was not completely uploaded"
+            upload.updated_at = now
+    await db.commit()
+    return uploads
+
+async def get_expired_upload_sessions(db: AsyncSession, now: datetime) -> List[UploadSession]:
+    """Sessions whose last request was longer ago than their expiry, with their files loaded."""
+    return list(await db.scalars(
+        select(UploadSession)
+        .options(selectinload(UploadSession.uploads))
+        .where(UploadSession.expires_at < now)
+    ))
+
+async def delete_upload_sessions(db: AsyncSession, sessions: List[UploadSession]) -> int:
+    """Delete sessions and their files' rows; returns how many groups were deleted.
+
+    Stored images are kept: they belong to the group, not the session. The
+    group of a session abandoned before finalizing is deleted if it is empty.
+    """
+    session_ids = [session.id for session in sessions]
+    group_ids = {session.group_id for session in sessions if session.status == "open"}
+    await db.execute(delete(ResumableUpload).where(ResumableUpload.session_id.in_(session_ids)))
+    await db.execute(delete(UploadSession).where(UploadSession.id.in_(session_ids)))
+    empty = list(await db.scalars(
+        select(ImageGroup.id).where(
+            ImageGroup.id.in_(group_ids),
+            ~select(Image.id).where(Image.group_id == ImageGroup.id).exists()
+        )
+    ))
+    if empty:
+        await db.execute(delete(ImageGroup).where(ImageGroup.id.in_(empty)))
+    await db.commit()
+    return len(empty)
@@ -1,10 +1,17 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from dotenv import load_dotenv
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import AsyncIterator, Iterator, Optional
 import os
 import getpass
 
+from services.metrics import DB_COMMIT_SECONDS
+
 load_dotenv()
 
 # Get current system username
@@ -13,11 +20,48 @@ current_user = getpass.getuser()
 # Get database URL from environment variable, or use a default for development
 DATABASE_URL = os.getenv("DATABASE_URL", f"postgresql://{current_user}@localhost/photo_logbook")
 
-# Create SQLAlchemy engine
-engine = create_engine(DATABASE_URL)
+# A plain postgresql:// URL means psycopg2, which is what requirements.txt installs
+if make_url(DATABASE_URL).drivername == "postgresql":
+    DATABASE_URL = make_url(DATABASE_URL).set(drivername="postgresql+psycopg2").render_as_string(hide_password=False)
+
+def to_async_url(url: str) -> str:
+    """Async driver URL for a sync database URL: asyncpg for Postgres, aiosqlite for SQLite."""
+    parsed = make_url(url)
+    backend = parsed.get_backend_name()
+    if backend == "postgresql":
+        return parsed.set(drivername="postgresql+asyncpg").render_as_string(hide_password=False)
+    if backend == "sqlite":
+        return parsed.set(drivername="sqlite+aiosqlite").render_as_string(hide_password=False)
+    return url
+
+# The application uses the async engine; the sync engine is kept for Alembic and scripts
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL") or to_async_url(DATABASE_URL)
+
+# Connection pool settings (ignored for SQLite, which does not pool over the network)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+
+def pool_options(url: str) -> dict:
+    if make_url(url).get_backend_name() == "sqlite":
+        return {}
+    return {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+    }
 
-# Create SessionLocal class
+# Create SQLAlchemy engines
+engine = create_engine(DATABASE_URL, **pool_options(DATABASE_URL))
+async_engine = create_async_engine(ASYNC_DATABASE_URL, **pool_options(ASYNC_DATABASE_URL))
+
+# Create SessionLocal classes
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
 
 # Create Base class
 Base = declarative_base()
@@ -28,4 +72,48 @@ def get_db():
     try:
         yield db
     finally:
-        db.close() 
\ No newline at end of file
+        db.close()
+
+# Dependency to get an async database session
+async def get_async_db() -> AsyncIterator[AsyncSession]:
+    async with AsyncSessionLocal() as db:
+        yield db
+
+class RoundTripCounter:
+    """Number of statements and commits/rollbacks sent to the database."""
+
+    def __init__(self):
+        self.count = 0
+
+_round_trip_counter: ContextVar[Optional[RoundTripCounter]] = ContextVar("db_round_trip_counter", default=None)
+
+@contextmanager
+def count_round_trips() -> Iterator[RoundTripCounter]:
+    """Count database round trips made in the current context, e.g. one request."""
+    counter = RoundTripCounter()
+    token = _round_trip_counter.set(counter)
+    try:
+        yield counter
+    finally:
+        _round_trip_counter.reset(token)
+
+def _record_round_trip(*args) -> None:
+    counter = _round_trip_counter.get()
+    if counter is not None:
+        counter.count += 1
+
+def _time_commits(dialect) -> None:
+    """Observe the duration of every COMMIT on the commit-time histogram."""
+    do_commit = dialect.do_commit
+
+    def timed_do_commit(dbapi_connection) -> None:
+        with DB_COMMIT_SECONDS.time():
+            do_commit(dbapi_connection)
+
+    dialect.do_commit = timed_do_commit
+
+for _engine in (engine, async_engine.sync_engine):
+    _time_commits(_engine.dialect)
+    event.listen(_engine, "before_cursor_execute", _record_round_trip)
+    event.listen(_engine, "commit", _record_round_trip)
+    event.listen(_engine, "rollback", _record_round_trip)
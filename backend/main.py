@@ -1,24 +1,71 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException, Form, Depends
+from fastapi import FastAPI, File, UploadFile, HTTPException, Form, Depends, Header, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, FileResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
-from typing import List
+from typing import List, Optional
+from contextlib import asynccontextmanager
+import asyncio
+import base64
+import json
+import logging
 import os
-import shutil
-from datetime import datetime
+import time
+from datetime import datetime, timedelta
 from pathlib import Path
 import re
+import textwrap
+import zlib
+import numpy as np
 from services.image_analyzer import ImageAnalyzer
-from database import get_db, SessionLocal
+from services.job_queue import AnalysisJobQueue, ANALYSIS_MAX_ATTEMPTS
+from services.analysis_cache import AnalysisCache
+from services.uploads import (
+    MAX_UPLOAD_FILE_BYTES, MAX_UPLOAD_REQUEST_BYTES, SavedUpload, UploadBudget, UploadRejected, number_filename,
+    save_upload_stream, unique_filename
+)
+from services import derivatives
+from services.search import SearchUnavailable, search_image_ids
+from services.near_duplicates import (
+    NEAR_DUPLICATE_DISTANCE, NEAR_DUPLICATE_REUSE, NearDuplicateIndex, is_burst
+)
+from services.perceptual_hash import MAX_SEARCH_DISTANCE, hamming_distance
+from services.events import EVENT_MAX_DISTANCE_KM, EVENT_MAX_GAP_HOURS, EVENT_MIN_IMAGES, EventIndex
+from services.zip_export import EXPORT_CHUNK_SIZE, RangeNotSatisfiable, ZipArchive, parse_range
+from services.storage import (
+    IMMUTABLE_CACHE_CONTROL, LocalBlobStore, blob_derivative_source, blob_key, create_store, derivative_source,
+    image_file, image_url, is_blob_key, media_type
+)
+from services.resumable_uploads import (
+    OFFSET_CONTENT_TYPE, TUS_EXTENSIONS, TUS_VERSION, ResumableUploads, http_date, new_id, parse_upload_metadata,
+    receive_chunks, session_expiry, staged_upload
+)
+from services.logs import configure_logging
+from services.metrics import (
+    HTTP_REQUEST_SECONDS, UPLOAD_FILE_BYTES, UPLOAD_SAVE_SECONDS, record_error, register_analysis_backend
+)
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+from database import AsyncSessionLocal, get_async_db, count_round_trips
 import crud
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+from models import ResumableUpload, UploadSession
 from dotenv import load_dotenv
 
 # Load environment variables
 load_dotenv()
-print("OpenAI API Key status:", "is set" if os.getenv("OPENAI_API_KEY") else "is not set")
+configure_logging()
+logger = logging.getLogger(__name__)
+logger.info("OpenAI API key %s", "is set" if os.getenv("OPENAI_API_KEY") else "is not set")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await analysis_queue.start()
+    await resumable_uploads.start()
+    yield
+    await resumable_uploads.stop()
+    await analysis_queue.stop()
+    await image_analyzer.aclose()
 
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 # Allow CORS for frontend
 app.add_middleware(
@@ -27,17 +74,105 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Read by the resumable upload client
+    expose_headers=["Location", "Upload-Offset", "Upload-Length", "Upload-Expires", "Tus-Resumable"],
 )
 
 # Configure uploads directory
 UPLOADS_DIR = Path("uploads")
 UPLOADS_DIR.mkdir(parents=True, exist_ok=True)
 
-# Mount the uploads directory
-app.mount("/uploads", StaticFiles(directory="uploads"), name="uploads")
+class GroupDirectories(StaticFiles):
+    """Serves group directories only, not the internal ones next to them.
+
+    Group directory names never start with an underscore; derivatives and a
+    blob store or download cache configured inside ``uploads`` do, and are
+    only served through their own endpoints.
+    """
 
-# Initialize image analyzer
+    async def get_response(self, path: str, scope):
+        if path.split(os.sep, 1)[0].startswith("_"):
+            raise HTTPException(status_code=404, detail="Not Found")
+        return await super().get_response(path, scope)
+
+# Files of images from before the blob store, until migrate_storage.py has moved them
+app.mount("/uploads", GroupDirectories(directory="uploads"), name="uploads")
+
+# Where uploaded files are stored, see services/storage.py
+storage = create_store()
+# Partial files of resumable uploads are staged next to those of POST /upload
+resumable_uploads = ResumableUploads(storage.staging_dir)
+
+# Maximum number of files from a single request processed at once
+UPLOAD_CONCURRENCY = max(1, int(os.getenv("UPLOAD_CONCURRENCY", "4")))
+
+# Report the number of database round trips of each request in a response header
+DB_ROUND_TRIP_HEADER = os.getenv("DB_ROUND_TRIP_HEADER", "false").lower() in ("1", "true", "yes")
+
+# Initialize image analyzer, its result caches and the background queue that runs it
 image_analyzer = ImageAnalyzer()
+analysis_cache = AnalysisCache()
+near_duplicate_index = NearDuplicateIndex()
+event_index = EventIndex()
+analysis_queue = AnalysisJobQueue(
+    image_analyzer,
+    UPLOADS_DIR,
+    storage,
+    analysis_cache,
+    near_duplicates=near_duplicate_index if NEAR_DUPLICATE_REUSE else None
+)
+register_analysis_backend(image_analyzer.backend)
+
+def encode_cursor(*values) -> str:
+    """Opaque pagination cursor holding the sort key of the last item returned."""
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> list:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (ValueError, UnicodeDecodeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if not isinstance(values, list):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return values
+
+@app.middleware("http")
+async def limit_upload_size(request: Request, call_next):
+    """Refuse oversized uploads before their body is read and spooled to disk."""
+    if request.method == "POST" and request.url.path == "/upload":
+        content_length = request.headers.get("content-length")
+        if content_length and content_length.isdigit() and int(content_length) > MAX_UPLOAD_REQUEST_BYTES:
+            return JSONResponse(status_code=413, content={"detail": "Upload exceeds the maximum request size"})
+    return await call_next(request)
+
+@app.middleware("http")
+async def report_db_round_trips(request: Request, call_next):
+    """Add an X-DB-Round-Trips header when DB_ROUND_TRIP_HEADER is enabled."""
+    if not DB_ROUND_TRIP_HEADER:
+        return await call_next(request)
+    with count_round_trips() as counter:
+        response = await call_next(request)
+    response.headers["X-DB-Round-Trips"] = str(counter.count)
+    return response
+
+@app.middleware("http")
+async def observe_request_latency(request: Request, call_next):
+    """Record the handling time of every request, labelled by its route template."""
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        # The template rather than the path, so IDs don't create a series each
+        route = request.scope.get("route")
+        HTTP_REQUEST_SECONDS.labels(
+            method=request.method,
+            route=getattr(route, "path", "unmatched"),
+            status=str(status)
+        ).observe(time.perf_counter() - started)
 
 def sanitize_group_title(title: str) -> str:
     """Convert group title to a safe directory name."""
@@ -46,151 +181,1154 @@ def sanitize_group_title(title: str) -> str:
     safe_title = re.sub(r'[-\s]+', '_', safe_title).strip('-_')
     return safe_title
 
-def save_upload_file(upload_file: UploadFile, group_dir: Path) -> str:
-    """Save an uploaded file and return its saved filename."""
-    if not upload_file.filename:
-        raise HTTPException(status_code=400, detail="Filename is required")
-        
-    # Generate a unique filename using timestamp
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    original_name = Path(upload_file.filename).stem
-    extension = Path(upload_file.filename).suffix
-    new_filename = f"{original_name}_{timestamp}{extension}"
-    
-    file_path = group_dir / new_filename
-    
+def assign_unique_filenames(results: List[dict]) -> None:
+    """Number repeated stored filenames within one upload, which must be unique per group."""
+    taken = set()
+    for result in results:
+        name = number_filename(result["saved_filename"], taken)
+        taken.add(name)
+        result["saved_filename"] = name
+        result["metadata"]["filename"] = name
+
+async def store_upload(saved: SavedUpload, original_filename: str, db: AsyncSession, db_lock: asyncio.Lock) -> dict:
+    """Read a staged upload's metadata, reuse earlier analysis and move it into the blob store.
+
+    Returns what ``image_record`` and ``saved_file_entry`` need. The staged
+    file is gone afterwards, whether this succeeds or raises.
+    """
+    key = blob_key(saved.content_hash, saved.content_type)
     try:
-        with file_path.open("wb") as buffer:
-            shutil.copyfileobj(upload_file.file, buffer)
+        async with db_lock:
+            cached = await analysis_cache.get(db, saved.content_hash)
+
+        # Everything that reads the file does so from the staged copy, before it is stored
+        file_type = Path(saved.filename).suffix.lower()
+        if cached:
+            # Identical bytes were analyzed before, reuse the result
+            metadata = {
+                'filename': saved.filename,
+                'file_size': saved.size,
+                'file_type': file_type,
+                **cached["metadata"]
+            }
+        else:
+            # Content analysis is queued; only local metadata is read here
+            metadata = await image_analyzer.extract_metadata_async(saved.path, saved.data)
+            metadata.update(filename=saved.filename, file_type=file_type)
+
+        content_analysis = cached["content_analysis"] if cached else None
+        reused_from = None
+        if not cached and NEAR_DUPLICATE_REUSE and metadata.get("perceptual_hash") is not None:
+            # A re-edited copy or burst shot of an analyzed image needs no model call
+            async with db_lock:
+                similar = await near_duplicate_index.find_analyzed(db, metadata["perceptual_hash"])
+            if similar:
+                content_analysis = similar.content_analysis
+                reused_from = similar.id
+
+        if derivatives.DERIVATIVES_ON_UPLOAD:
+            directory, filename = blob_derivative_source(key)
+            try:
+                await asyncio.to_thread(
+                    derivatives.generate_all_derivatives,
+                    UPLOADS_DIR,
+                    saved.path,
+                    directory,
+                    filename,
+                    immutable=True
+                )
+            except Exception as e:
+                # Not fatal: derivatives are rendered on first request instead
+                record_error("derivatives", e)
+                logger.warning("Failed to generate derivatives for %s: %s", saved.filename, e)
+
+        # Identical files share one blob
+        created = await storage.put(saved.path, key, saved.content_type)
     finally:
-        upload_file.file.close()
-    
-    return new_filename
+        saved.path.unlink(missing_ok=True)
+
+    return {
+        "original_filename": original_filename,
+        "content_type": saved.content_type,
+        "saved_filename": saved.filename,
+        "file_size": saved.size,
+        "content_hash": saved.content_hash,
+        "blob_key": key,
+        # Whether this upload put the blob there, see release_blobs
+        "blob_created": created,
+        "metadata": metadata,
+        "content_analysis": content_analysis,
+        "analysis_reused_from": reused_from,
+    }
+
+async def release_blobs(db: AsyncSession, results: List[dict]) -> None:
+    """Delete the blobs of stored uploads whose image rows could not be written.
+
+    Only blobs the upload created itself and no image refers to are removed;
+    an identical file stored before keeps its blob. Failures are logged, the
+    orphan is then left to ``backfill.py --delete-orphans``.
+    """
+    keys = list({result["blob_key"] for result in results if result["blob_created"]})
+    try:
+        referenced = await crud.get_referenced_blob_keys(db, keys)
+        for key in keys:
+            if key not in referenced:
+                await storage.delete(key)
+    except Exception as e:
+        record_error("upload", e)
+        logger.exception("Failed to delete the blobs of %d unsaved uploads", len(keys))
+
+def image_record(result: dict) -> dict:
+    """Arguments of ``crud.create_images_bulk`` for a stored upload."""
+    return dict(
+        original_filename=result["original_filename"] or "unknown",
+        stored_filename=result["saved_filename"],
+        content_type=result["content_type"],
+        file_size=result["file_size"],
+        metadata=result["metadata"],
+        content_analysis=result["content_analysis"],
+        analysis_status="completed" if result["content_analysis"] else "pending",
+        content_hash=result["content_hash"],
+        blob_key=result["blob_key"]
+    )
+
+def saved_file_entry(result: dict, outcome: dict, directory_name: str, group: str) -> dict:
+    """How a stored upload is reported to the client."""
+    return {
+        "id": outcome["id"],
+        "original_name": result["original_filename"],
+        "saved_name": result["saved_filename"],
+        "content_type": result["content_type"],
+        "url": storage.url(result["blob_key"]),
+        "directory_name": directory_name,
+        "group": group,
+        "analysis": {
+            "metadata": result["metadata"],
+            "content_analysis": result["content_analysis"]
+        },
+        "analysis_status": "pending" if outcome["job_id"] else "completed",
+        "analysis_reused_from": result["analysis_reused_from"],
+        "job_id": outcome["job_id"]
+    }
 
 @app.post("/upload")
 async def upload_images(
     files: List[UploadFile] = File(...),
     group_title: str = Form(...),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
-    if not group_title:
-        raise HTTPException(status_code=400, detail="Group title is required")
-
+    # Files go to the blob store; the name identifies the group in exports
+    directory_name = group_directory_name(group_title)
     safe_title = sanitize_group_title(group_title)
-    if not safe_title:
-        raise HTTPException(status_code=400, detail="Invalid group title")
 
-    # Create group directory with timestamp to ensure uniqueness
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    directory_name = f"{safe_title}_{timestamp}"
-    group_dir = UPLOADS_DIR / directory_name
-    group_dir.mkdir(parents=True, exist_ok=True)
+    semaphore = asyncio.Semaphore(UPLOAD_CONCURRENCY)
+    # The files share one session, which must not run two statements at once
+    db_lock = asyncio.Lock()
+    budget = UploadBudget()
 
-    # Create group in database
-    db_group = crud.create_image_group(db, group_title, directory_name)
+    async def process_file(file: UploadFile) -> dict:
+        """Save a single file and read its metadata; failures are reported, not raised."""
+        async with semaphore:
+            try:
+                # The real type is checked from the file's magic bytes while it is written
+                with UPLOAD_SAVE_SECONDS.time():
+                    saved = await save_upload_stream(file, storage.staging_dir, budget)
+            except UploadRejected as e:
+                record_error("upload", e)
+                return {"error": str(e)}
+            except Exception as e:
+                record_error("upload", e)
+                logger.exception("Failed to save %s", file.filename)
+                return {"error": f"Failed to save {file.filename or 'Unknown file'}: {str(e)}"}
+            UPLOAD_FILE_BYTES.observe(saved.size)
+
+            try:
+                return await store_upload(saved, file.filename, db, db_lock)
+            except Exception as e:
+                record_error("upload", e)
+                logger.exception("Failed to process %s", saved.filename)
+                return {"error": f"Failed to save {file.filename or 'Unknown file'}: {str(e)}"}
+
+    # Files are saved concurrently; results keep request order
+    results = await asyncio.gather(*(process_file(file) for file in files))
+    assign_unique_filenames([result for result in results if "error" not in result])
+
+    # Create the group and all image records and analysis jobs in one transaction
+    db_group = await crud.create_image_group(db, group_title, directory_name, commit=False)
+    group_id = db_group.id
+    stored = [result for result in results if "error" not in result]
+    try:
+        outcomes = await crud.create_images_bulk(
+            db,
+            group_id,
+            [image_record(result) for result in stored],
+            max_attempts=ANALYSIS_MAX_ATTEMPTS
+        )
+    except Exception:
+        await db.rollback()
+        await release_blobs(db, stored)
+        raise
+    await release_blobs(db, [result for result, outcome in zip(stored, outcomes) if "error" in outcome])
+    outcomes = iter(outcomes)
 
     saved_files = []
     errors = []
-    
-    for file in files:
-        # Validate file type (only allow images)
-        content_type = file.content_type or ""
-        if not content_type.startswith('image/'):
-            errors.append(f"{file.filename or 'Unknown file'} is not an image file")
+
+    for result in results:
+        if "error" in result:
+            errors.append(result["error"])
             continue
-            
-        try:
-            saved_filename = save_upload_file(file, group_dir)
-            file_path = group_dir / saved_filename
-            
-            # Analyze the image
-            analysis = await image_analyzer.analyze_image(file_path)
-            
-            # Create image record in database
-            db_image = crud.create_image(
-                db=db,
-                group_id=db_group.id.__int__(),
-                original_filename=file.filename or "unknown",
-                stored_filename=saved_filename,
-                content_type=content_type,
-                file_size=os.path.getsize(file_path),
-                metadata=analysis["metadata"],
-                content_analysis=analysis["content_analysis"]
-            )
-            
-            saved_files.append({
-                "id": db_image.id,
-                "original_name": file.filename,
-                "saved_name": saved_filename,
-                "content_type": content_type,
-                "url": f"/uploads/{directory_name}/{saved_filename}",
-                "directory_name": directory_name,
-                "group": safe_title,
-                "analysis": analysis
-            })
-        except Exception as e:
-            errors.append(f"Failed to save {file.filename or 'Unknown file'}: {str(e)}")
-    
+
+        outcome = next(outcomes)
+        if "error" in outcome:
+            errors.append(f"Failed to save {result['original_filename'] or 'Unknown file'}: {outcome['error']}")
+            continue
+
+        saved_files.append(saved_file_entry(result, outcome, directory_name, safe_title))
+
+    if any(saved_file["job_id"] for saved_file in saved_files):
+        analysis_queue.notify()
+
     return JSONResponse(content={
         "group_title": group_title,
-        "group_id": db_group.id,
+        "group_id": group_id,
         "directory_name": directory_name,
         "saved_files": saved_files,
         "errors": errors
     })
 
+def group_directory_name(group_title: str) -> str:
+    """Validate a new group's title and derive its unique name."""
+    if not group_title:
+        raise HTTPException(status_code=400, detail="Group title is required")
+
+    safe_title = sanitize_group_title(group_title)
+    if not safe_title:
+        raise HTTPException(status_code=400, detail="Invalid group title")
+
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    return f"{safe_title}_{timestamp}"
+
+def upload_location(upload: ResumableUpload) -> str:
+    return f"/upload-sessions/{upload.session_id}/files/{upload.id}"
+
+def upload_headers(upload: ResumableUpload, expires_at: datetime) -> dict:
+    """tus headers describing the state of a file of an upload session."""
+    return {
+        "Tus-Resumable": TUS_VERSION,
+        "Upload-Offset": str(upload.upload_offset),
+        "Upload-Length": str(upload.upload_length),
+        "Upload-Expires": http_date(expires_at),
+        "Cache-Control": "no-store",
+    }
+
+def upload_status(upload: ResumableUpload) -> dict:
+    return {
+        "upload_id": upload.id,
+        "url": upload_location(upload),
+        "original_name": upload.original_filename,
+        "saved_name": upload.stored_filename,
+        "upload_length": upload.upload_length,
+        "upload_offset": upload.upload_offset,
+        "status": upload.status,
+        "image_id": upload.image_id,
+        "error": upload.error,
+    }
+
+def session_status(session: UploadSession, uploads: List[ResumableUpload]) -> dict:
+    """A session's files, with the stored ones and the errors reported like POST /upload does."""
+    return {
+        "session_id": session.id,
+        "status": session.status,
+        "expires_at": session.expires_at.isoformat(),
+        "upload_url": f"/upload-sessions/{session.id}/files",
+        "group_title": session.group.title,
+        "group_id": session.group_id,
+        "directory_name": session.group.directory_name,
+        "files": [upload_status(upload) for upload in uploads],
+        "saved_files": [upload.result for upload in uploads if upload.status == "completed"],
+        "errors": [upload.error for upload in uploads if upload.status == "failed"],
+    }
+
+async def get_upload_session(db: AsyncSession, session_id: str, writable: bool = False) -> UploadSession:
+    session = await crud.get_upload_session(db, session_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Upload session not found")
+    if session.expires_at < datetime.utcnow():
+        raise HTTPException(status_code=410, detail="Upload session has expired")
+    if writable and session.status != "open":
+        raise HTTPException(status_code=409, detail="Upload session is finalized")
+    return session
+
+async def get_resumable_upload(db: AsyncSession, session_id: str, upload_id: str) -> ResumableUpload:
+    upload = await crud.get_resumable_upload(db, session_id, upload_id)
+    if upload is None:
+        raise HTTPException(status_code=404, detail="Upload not found", headers={"Tus-Resumable": TUS_VERSION})
+    if upload.session.expires_at < datetime.utcnow():
+        raise HTTPException(status_code=410, detail="Upload session has expired", headers={"Tus-Resumable": TUS_VERSION})
+    return upload
+
+async def complete_resumable_upload(db: AsyncSession, upload: ResumableUpload, expires_at: datetime) -> JSONResponse:
+    """Store a completely received file and create its image, as POST /upload does for each of its files."""
+    group = upload.session.group
+    headers = upload_headers(upload, expires_at)
+    path = resumable_uploads.partial_path(upload.id)
+    error = None
+    try:
+        saved = await asyncio.to_thread(staged_upload, path, upload.stored_filename)
+        UPLOAD_FILE_BYTES.observe(saved.size)
+        result = await store_upload(saved, upload.original_filename, db, asyncio.Lock())
+    except UploadRejected as e:
+        record_error("upload", e)
+        error = str(e)
+    except Exception as e:
+        record_error("upload", e)
+        logger.exception("Failed to process %s", upload.stored_filename)
+        error = f"Failed to save {upload.original_filename}: {str(e)}"
+
+    if error is None:
+        try:
+            outcome = (await crud.create_images_bulk(
+                db, group.id, [image_record(result)], max_attempts=ANALYSIS_MAX_ATTEMPTS
+            ))[0]
+        except Exception:
+            await db.rollback()
+            await release_blobs(db, [result])
+            raise
+        if "error" in outcome:
+            await release_blobs(db, [result])
+            error = f"Failed to save {upload.original_filename}: {outcome['error']}"
+
+    if error is not None:
+        await asyncio.to_thread(resumable_uploads.remove_partial, upload.id)
+        await crud.finish_resumable_upload(db, upload, error=error)
+        raise HTTPException(status_code=422, detail=error, headers=headers)
+
+    entry = saved_file_entry(result, outcome, group.directory_name, sanitize_group_title(group.title))
+    await crud.finish_resumable_upload(db, upload, image_id=outcome["id"], result=entry)
+    if outcome["job_id"]:
+        analysis_queue.notify()
+    return JSONResponse(content=entry, headers=headers)
+
+@app.post("/upload-sessions", status_code=201)
+async def create_upload_session(group_title: str = Form(...), db: AsyncSession = Depends(get_async_db)):
+    """Open a resumable upload into a new group; see services/resumable_uploads.py."""
+    directory_name = group_directory_name(group_title)
+    session = await crud.create_upload_session(db, new_id(), group_title, directory_name, session_expiry())
+    return JSONResponse(
+        status_code=201,
+        content=session_status(session, []),
+        headers={"Location": f"/upload-sessions/{session.id}"}
+    )
+
+@app.get("/upload-sessions/{session_id}")
+async def get_upload_session_status(session_id: str, db: AsyncSession = Depends(get_async_db)):
+    session = await get_upload_session(db, session_id)
+    return session_status(session, await crud.get_session_uploads(db, session.id))
+
+@app.post("/upload-sessions/{session_id}/finalize")
+async def finalize_upload_session(session_id: str, db: AsyncSession = Depends(get_async_db)):
+    """Close a session; files not completely received by now are reported as errors."""
+    session = await get_upload_session(db, session_id, writable=True)
+    uploads = await crud.finalize_upload_session(db, session)
+    for upload in uploads:
+        if upload.status == "failed" and upload.image_id is None:
+            await asyncio.to_thread(resumable_uploads.remove_partial, upload.id)
+    return session_status(session, uploads)
+
+@app.options("/upload-sessions/{session_id}/files")
+async def describe_resumable_uploads(session_id: str):
+    return Response(status_code=204, headers={
+        "Tus-Resumable": TUS_VERSION,
+        "Tus-Version": TUS_VERSION,
+        "Tus-Extension": TUS_EXTENSIONS,
+        "Tus-Max-Size": str(MAX_UPLOAD_FILE_BYTES),
+    })
+
+@app.post("/upload-sessions/{session_id}/files", status_code=201)
+async def create_resumable_upload(
+    session_id: str,
+    upload_length: Optional[str] = Header(None),
+    upload_metadata: str = Header(""),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Register a file of the session (tus creation); its bytes follow in PATCH requests."""
+    session = await get_upload_session(db, session_id, writable=True)
+    if upload_length is None or not upload_length.isdigit():
+        raise HTTPException(status_code=400, detail="Upload-Length is required")
+    length = int(upload_length)
+    if length > MAX_UPLOAD_FILE_BYTES:
+        raise HTTPException(status_code=413, detail=f"File exceeds the maximum file size of {MAX_UPLOAD_FILE_BYTES} bytes")
+    try:
+        metadata = parse_upload_metadata(upload_metadata)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    filename = metadata.get("filename") or metadata.get("name")
+    if not filename:
+        raise HTTPException(status_code=400, detail="Filename is required")
+    if length == 0:
+        raise HTTPException(status_code=422, detail=f"{filename} is not an image file")
+
+    # Stored names are unique within the group, which only this session adds to
+    async with resumable_uploads.lock(session.id):
+        stored_filename = unique_filename(filename)
+        taken = await crud.get_session_stored_filenames(db, session.id, Path(stored_filename).stem)
+        upload_id = new_id()
+        await asyncio.to_thread(resumable_uploads.create_partial, upload_id)
+        expires_at = session_expiry()
+        upload = await crud.create_resumable_upload(
+            db, upload_id, session, filename, number_filename(stored_filename, taken), length, expires_at
+        )
+    return JSONResponse(
+        status_code=201,
+        content=upload_status(upload),
+        headers={**upload_headers(upload, expires_at), "Location": upload_location(upload)}
+    )
+
+@app.head("/upload-sessions/{session_id}/files/{upload_id}")
+async def get_resumable_upload_offset(session_id: str, upload_id: str, db: AsyncSession = Depends(get_async_db)):
+    """Where to continue a file after an interrupted PATCH."""
+    upload = await get_resumable_upload(db, session_id, upload_id)
+    return Response(status_code=200, headers=upload_headers(upload, upload.session.expires_at))
+
+@app.patch("/upload-sessions/{session_id}/files/{upload_id}")
+async def append_resumable_upload(
+    session_id: str,
+    upload_id: str,
+    request: Request,
+    upload_offset: int = Header(...),
+    content_type: Optional[str] = Header(None),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Append the body to a file at ``Upload-Offset``; the last bytes store the file.
+
+    Answers 204 with the new offset, or once complete 200 with the saved
+    file as reported by POST /upload. An offset that is not the recorded one
+    gets 409; the client then asks for the offset with HEAD.
+    """
+    if content_type != OFFSET_CONTENT_TYPE:
+        raise HTTPException(status_code=415, detail=f"Content-Type must be {OFFSET_CONTENT_TYPE}")
+    upload = await get_resumable_upload(db, session_id, upload_id)
+    expires_at = upload.session.expires_at
+
+    lock = resumable_uploads.lock(upload.id)
+    if lock.locked():
+        # Usually the client's previous connection, which has not ended on this side yet
+        raise HTTPException(status_code=423, detail="Upload is receiving data from another request",
+                            headers=upload_headers(upload, expires_at))
+    async with lock:
+        if upload.status == "failed":
+            raise HTTPException(status_code=422, detail=upload.error, headers=upload_headers(upload, expires_at))
+        if upload_offset != upload.upload_offset:
+            raise HTTPException(status_code=409, detail="Upload-Offset does not match the received data",
+                                headers=upload_headers(upload, expires_at))
+        if upload.status == "completed":
+            # The response to the last PATCH was lost
+            return JSONResponse(content=upload.result, headers=upload_headers(upload, expires_at))
+
+        path = resumable_uploads.partial_path(upload.id)
+        if upload.status == "uploading":
+            try:
+                size = (await asyncio.to_thread(path.stat)).st_size
+            except FileNotFoundError:
+                raise HTTPException(status_code=410, detail="Upload data is gone")
+            expires_at = session_expiry()
+            if size < upload.upload_offset:
+                # Received data did not reach the disk, e.g. the machine went down; resend from what did
+                await crud.advance_resumable_upload(db, upload, upload.upload_offset, size, expires_at)
+                raise HTTPException(status_code=409, detail="Upload-Offset does not match the received data",
+                                    headers=upload_headers(upload, expires_at))
+
+            # Don't hold a transaction open while the body arrives
+            await db.commit()
+            try:
+                offset = await receive_chunks(
+                    request.stream(), path, upload_offset, upload.upload_length, upload.original_filename
+                )
+            except UploadRejected as e:
+                record_error("upload", e)
+                await asyncio.to_thread(resumable_uploads.remove_partial, upload.id)
+                await crud.finish_resumable_upload(db, upload, error=str(e))
+                raise HTTPException(status_code=422, detail=str(e), headers=upload_headers(upload, expires_at))
+            if not await crud.advance_resumable_upload(db, upload, upload_offset, offset, expires_at):
+                # E.g. the session was finalized meanwhile
+                raise HTTPException(status_code=409, detail="Upload changed while receiving data",
+                                    headers=upload_headers(upload, expires_at))
+
+        if upload.status == "processing":
+            # All bytes are here, received now or before an interruption while storing them
+            return await complete_resumable_upload(db, upload, expires_at)
+
+    return Response(status_code=204, headers=upload_headers(upload, expires_at))
+
+@app.delete("/upload-sessions/{session_id}/files/{upload_id}", status_code=204)
+async def delete_resumable_upload(session_id: str, upload_id: str, db: AsyncSession = Depends(get_async_db)):
+    """Abandon a file of the session (tus termination) and free its partial data."""
+    upload = await get_resumable_upload(db, session_id, upload_id)
+    if upload.status == "completed":
+        raise HTTPException(status_code=409, detail="Upload is already stored")
+    lock = resumable_uploads.lock(upload.id)
+    if lock.locked():
+        raise HTTPException(status_code=423, detail="Upload is receiving data from another request")
+    async with lock:
+        await crud.delete_resumable_upload(db, upload)
+        await asyncio.to_thread(resumable_uploads.remove_partial, upload.id)
+    return Response(status_code=204, headers={"Tus-Resumable": TUS_VERSION})
+
 @app.get("/groups")
-async def list_groups(db: Session = Depends(get_db)):
-    """List all image groups."""
-    groups = crud.get_all_image_groups(db)
+async def list_groups(
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_db)
+):
+    """List image groups, newest first, one page at a time."""
+    after = None
+    if cursor:
+        values = decode_cursor(cursor)
+        try:
+            created_at, group_id = values
+            after = (datetime.fromisoformat(created_at), int(group_id))
+        except (TypeError, ValueError):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    groups = await crud.get_image_groups_page(db, limit, after)
+    next_cursor = None
+    if len(groups) == limit:
+        last = groups[-1]
+        next_cursor = encode_cursor(last.created_at.isoformat(), last.id)
+
     return {
         "groups": [
             {
                 "id": group.id,
                 "title": group.title,
-                "file_count": len(group.images),
+                "file_count": group.file_count,
+                "total_bytes": int(group.total_bytes),
                 "created_at": group.created_at.isoformat(),
             }
             for group in groups
-        ]
+        ],
+        "next_cursor": next_cursor
     }
 
+IMAGE_FIELDS = (
+    "id", "filename", "original_filename", "url", "thumbnails", "size",
+    "uploaded_at", "analysis_status", "metadata", "content_analysis"
+)
+
+def parse_image_fields(fields: Optional[str]) -> set:
+    """Validate a comma-separated ``fields=`` projection; empty means all fields."""
+    if not fields:
+        return set(IMAGE_FIELDS)
+    requested = {field.strip() for field in fields.split(",") if field.strip()}
+    unknown = requested - set(IMAGE_FIELDS)
+    if unknown:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown fields: {', '.join(sorted(unknown))}. Available: {', '.join(IMAGE_FIELDS)}"
+        )
+    return requested
+
+def serialize_image(image, directory_name: str, fields: set) -> dict:
+    """API representation of an image, limited to the requested fields."""
+    data = {}
+    if "id" in fields:
+        data["id"] = image.id
+    if "filename" in fields:
+        data["filename"] = image.stored_filename
+    if "original_filename" in fields:
+        data["original_filename"] = image.original_filename
+    if "url" in fields:
+        data["url"] = image_url(storage, image, directory_name)
+    if "thumbnails" in fields:
+        data["thumbnails"] = derivatives.derivative_urls(image.id)
+    if "size" in fields:
+        data["size"] = image.file_size
+    if "uploaded_at" in fields:
+        data["uploaded_at"] = image.uploaded_at.isoformat()
+    if "analysis_status" in fields:
+        data["analysis_status"] = image.analysis_status
+    if "metadata" in fields or "content_analysis" in fields:
+        analysis = {}
+        if "metadata" in fields:
+            analysis["metadata"] = {
+                "width": image.width,
+                "height": image.height,
+                "format": image.format,
+                "camera_make": image.camera_make,
+                "camera_model": image.camera_model,
+                "date_taken": image.date_taken.isoformat() if image.date_taken else None,
+                "gps": {
+                    "latitude": image.gps_latitude,
+                    "longitude": image.gps_longitude
+                } if image.gps_latitude is not None and image.gps_longitude is not None else None
+            }
+        if "content_analysis" in fields:
+            analysis["content_analysis"] = image.content_analysis
+        data["analysis"] = analysis
+    return data
+
 @app.get("/groups/{group_id}")
-async def get_group(group_id: int, db: Session = Depends(get_db)):
-    """Get details of a specific group."""
-    group = crud.get_image_group(db, group_id)
+async def get_group(
+    group_id: int,
+    limit: int = Query(100, ge=1, le=500),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Get details of a specific group with one page of its images.
+
+    ``fields`` is a comma-separated projection of the image fields, e.g.
+    ``fields=id,thumbnails,metadata`` for grid views that do not need the
+    content analysis.
+    """
+    selected_fields = parse_image_fields(fields)
+    after_id = None
+    if cursor:
+        values = decode_cursor(cursor)
+        if len(values) != 1 or not isinstance(values[0], int):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        after_id = values[0]
+
+    group = await crud.get_image_group(db, group_id)
     if not group:
         raise HTTPException(status_code=404, detail="Group not found")
 
+    images = await crud.get_group_images_page(
+        db,
+        group_id,
+        limit,
+        after_id,
+        include_content_analysis="content_analysis" in selected_fields
+    )
+    next_cursor = encode_cursor(images[-1].id) if len(images) == limit else None
+
     return {
         "id": group.id,
         "title": group.title,
         "directory_name": group.directory_name,
         "created_at": group.created_at.isoformat(),
-        "files": [
-            {
-                "id": image.id,
-                "filename": image.stored_filename,
-                "original_filename": image.original_filename,
-                "url": f"/uploads/{group.directory_name}/{image.stored_filename}",
-                "size": image.file_size,
-                "uploaded_at": image.uploaded_at.isoformat(),
-                "analysis": {
-                    "metadata": {
-                        "width": image.width,
-                        "height": image.height,
-                        "format": image.format,
-                        "camera_make": image.camera_make,
-                        "camera_model": image.camera_model,
-                        "date_taken": image.date_taken.isoformat() if image.date_taken else None,
-                        "gps": {
-                            "latitude": float(image.gps_latitude) if image.gps_latitude else None,
-                            "longitude": float(image.gps_longitude) if image.gps_longitude else None
-                        } if image.gps_latitude and image.gps_longitude else None
-                    },
-                    "content_analysis": image.content_analysis
+        "files": [serialize_image(image, group.directory_name, selected_fields) for image in images],
+        "next_cursor": next_cursor
+    }
+
+# Image fields written to the metadata sidecar of an export
+EXPORT_FIELDS = {
+    "id", "filename", "original_filename", "size", "uploaded_at", "analysis_status", "metadata", "content_analysis"
+}
+EXPORT_PAGE_SIZE = 1000
+
+# Concurrent size requests to a remote blob store while an export is laid out
+EXPORT_SIZE_REQUESTS = 16
+
+def add_group_files(archive: ZipArchive, files: list) -> List[int]:
+    """Add an export's ``(image, path, size)`` triples; returns the IDs of images without a file.
+
+    Local files come with their path, blobs of a remote store with their size
+    and are read from the store while they are sent; neither means missing.
+    """
+    missing = []
+    for image, path, size in files:
+        if size is not None:
+            archive.add_remote(
+                image.stored_filename,
+                f"{storage.name}:{image.blob_key}",
+                size,
+                lambda start, stop, key=image.blob_key: storage.read(key, start, stop, EXPORT_CHUNK_SIZE),
+                image.uploaded_at
+            )
+            continue
+        if path is None:
+            missing.append(image.id)
+            continue
+        try:
+            archive.add_file(image.stored_filename, path, image.uploaded_at)
+        except FileNotFoundError:
+            missing.append(image.id)
+    return missing
+
+async def remote_blob_sizes(keys: List[str]) -> dict:
+    """Sizes of blobs in a remote store by key, without the missing ones."""
+    limit = asyncio.Semaphore(EXPORT_SIZE_REQUESTS)
+
+    async def size(key: str) -> Optional[int]:
+        async with limit:
+            try:
+                return await storage.size(key)
+            except FileNotFoundError:
+                return None
+
+    sizes = await asyncio.gather(*(size(key) for key in keys))
+    return {key: size for key, size in zip(keys, sizes) if size is not None}
+
+async def export_sidecar(group, missing: List[int], last_id: int):
+    """``metadata.json`` of an export up to image ``last_id``, generated a page of images at a time.
+
+    Run once to measure it and again while it is sent, so it never has to be
+    held in memory as a whole.
+    """
+    head = json.dumps({
+        "id": group.id,
+        "title": group.title,
+        "created_at": group.created_at.isoformat(),
+        "missing_files": missing,
+    }, indent=2)
+    # The object is left open for the files, which follow the other fields
+    yield (head[:-2] + ',\n  "files": [').encode()
+    separator = "\n"
+    after_id = None
+    while after_id is None or after_id < last_id:
+        async with AsyncSessionLocal() as db:
+            page = await crud.get_group_images_page(db, group.id, EXPORT_PAGE_SIZE, after_id)
+        entries = []
+        for image in page:
+            if image.id > last_id:
+                break
+            entry = json.dumps(serialize_image(image, group.directory_name, EXPORT_FIELDS), indent=2)
+            entries.append(separator + textwrap.indent(entry, "    "))
+            separator = ",\n"
+        if entries:
+            yield "".join(entries).encode()
+        if len(page) < EXPORT_PAGE_SIZE:
+            break
+        after_id = page[-1].id
+    yield b"\n  ]\n}"
+
+async def stream_export(archive: ZipArchive, start: int, stop: int):
+    try:
+        async for chunk in archive.stream(start, stop):
+            yield chunk
+    except Exception as e:
+        # Headers are sent already, the client sees a truncated download
+        record_error("export", e)
+        logger.exception("Export failed after starting to stream")
+        raise
+
+@app.get("/groups/{group_id}/export")
+async def export_group(
+    group_id: int,
+    metadata: bool = True,
+    range: Optional[str] = Header(None),
+    if_range: Optional[str] = Header(None),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Download a group as a zip archive, streamed while it is built.
+
+    Images are stored unchanged under their stored filenames. With
+    ``metadata`` (the default) a ``metadata.json`` member holds each image's
+    metadata and content analysis. The archive has a ``Content-Length`` and
+    an ``ETag`` and honours single byte ranges, so interrupted downloads can
+    resume. Images are read a page at a time and the sidecar is generated
+    again while it is sent, so memory use does not grow with the group; a
+    sidecar that changed in between, e.g. by an analysis finishing, ends the
+    download and the retry gets a new ``ETag``.
+    """
+    group = await crud.get_image_group(db, group_id)
+    if not group:
+        raise HTTPException(status_code=404, detail="Group not found")
+
+    archive = ZipArchive()
+    missing = []
+    last_id = None
+    while True:
+        page = await crud.get_group_export_files(db, group_id, EXPORT_PAGE_SIZE, last_id)
+        sizes = {}
+        if not isinstance(storage, LocalBlobStore):
+            # Read from the store while they are sent rather than downloaded first
+            sizes = await remote_blob_sizes(list(dict.fromkeys(image.blob_key for image in page if image.blob_key)))
+        files = []
+        for image in page:
+            if not image.blob_key:
+                files.append((image, UPLOADS_DIR / group.directory_name / image.stored_filename, None))
+            elif isinstance(storage, LocalBlobStore):
+                files.append((image, storage.path(image.blob_key), None))
+            else:
+                files.append((image, None, sizes.get(image.blob_key)))
+        missing.extend(await asyncio.to_thread(add_group_files, archive, files))
+        if page:
+            last_id = page[-1].id
+        if len(page) < EXPORT_PAGE_SIZE:
+            break
+    if missing:
+        logger.warning("Export of group %s skips %d missing files", group_id, len(missing))
+    if metadata:
+        size, crc = 0, 0
+        async for chunk in export_sidecar(group, missing, last_id or 0):
+            size += len(chunk)
+            crc = zlib.crc32(chunk, crc)
+        archive.add_generated(
+            "metadata.json", size, crc, lambda: export_sidecar(group, missing, last_id or 0), group.created_at
+        )
+    archive.close()
+
+    headers = {
+        "Accept-Ranges": "bytes",
+        "ETag": archive.etag,
+        "Content-Disposition": f'attachment; filename="{group.directory_name}.zip"',
+    }
+    byte_range = None
+    # A range of an archive that changed since would not fit the part already downloaded
+    if range and (not if_range or if_range == archive.etag):
+        try:
+            byte_range = parse_range(range, archive.size)
+        except RangeNotSatisfiable:
+            raise HTTPException(status_code=416, headers={"Content-Range": f"bytes */{archive.size}"})
+
+    start, stop = byte_range or (0, archive.size)
+    headers["Content-Length"] = str(stop - start)
+    if byte_range:
+        headers["Content-Range"] = f"bytes {start}-{stop - 1}/{archive.size}"
+    return StreamingResponse(
+        stream_export(archive, start, stop),
+        status_code=206 if byte_range else 200,
+        media_type="application/zip",
+        headers=headers
+    )
+
+@app.get("/duplicates")
+async def list_duplicates(
+    group_id: Optional[int] = None,
+    max_distance: int = Query(NEAR_DUPLICATE_DISTANCE, ge=0, le=MAX_SEARCH_DISTANCE),
+    limit: int = Query(50, ge=1, le=200),
+    fields: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Clusters of near-identical images, in one group or the whole library, largest first.
+
+    Images are near-identical when their perceptual hashes differ in at most
+    ``max_distance`` of 64 bits. Each image carries its ``distance`` from the
+    first one of its cluster; ``burst`` marks clusters shot in quick
+    succession with one camera.
+    """
+    selected_fields = parse_image_fields(fields)
+    if group_id is not None and not await crud.get_image_group(db, group_id):
+        raise HTTPException(status_code=404, detail="Group not found")
+
+    clusters = await near_duplicate_index.clusters(db, group_id, max_distance)
+    shown = clusters[:limit]
+    images = {
+        image.id: image
+        for image in await crud.get_images_by_ids(
+            db,
+            [image_id for cluster in shown for image_id in cluster],
+            include_content_analysis="content_analysis" in selected_fields
+        )
+    }
+
+    results = []
+    for cluster in shown:
+        members = [images[image_id] for image_id in cluster if image_id in images]
+        if len(members) < 2:
+            continue
+        first = members[0]
+        results.append({
+            "size": len(members),
+            "burst": is_burst(members),
+            "images": [
+                {
+                    **serialize_image(image, image.group.directory_name, selected_fields),
+                    "group_id": image.group_id,
+                    "distance": hamming_distance(first.perceptual_hash, image.perceptual_hash)
                 }
+                for image in members
+            ]
+        })
+    return {"clusters": results, "total_clusters": len(clusters)}
+
+@app.get("/suggested-groups")
+async def list_suggested_groups(
+    gap_hours: float = Query(EVENT_MAX_GAP_HOURS, gt=0),
+    distance_km: float = Query(EVENT_MAX_DISTANCE_KM, gt=0),
+    min_images: int = Query(EVENT_MIN_IMAGES, ge=1),
+    include_matching: bool = False,
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Events found in the library by capture time and position, newest first.
+
+    A new event starts after a gap of more than ``gap_hours`` between photos
+    or a jump of more than ``distance_km``. Events whose images are exactly
+    one existing group are left out unless ``include_matching`` is set.
+    Images without a capture date are not considered.
+    """
+    await event_index.refresh(db)
+    events = event_index.events(gap_hours, distance_km, min_images)
+
+    # Newest first, by start time and then the first image's ID
+    selected = np.lexsort((events.first_ids, events.start_times))[::-1]
+    if not include_matching:
+        selected = selected[events.single_group[selected] < 0]
+    if cursor:
+        values = decode_cursor(cursor)
+        if len(values) != 2 or not all(isinstance(value, int) for value in values):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        start_time, first_id = values
+        before = (events.start_times[selected] < start_time) | (
+            (events.start_times[selected] == start_time) & (events.first_ids[selected] < first_id)
+        )
+        selected = selected[before]
+
+    page = selected[:limit]
+    next_cursor = None
+    if len(selected) > limit:
+        last = page[-1]
+        next_cursor = encode_cursor(int(events.start_times[last]), int(events.first_ids[last]))
+    return {
+        "events": [event_index.describe(events, index) for index in page],
+        "next_cursor": next_cursor
+    }
+
+def parse_bbox(bbox: str) -> tuple:
+    """Parse ``min_lon,min_lat,max_lon,max_lat`` into floats."""
+    try:
+        min_lon, min_lat, max_lon, max_lat = (float(value) for value in bbox.split(","))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="bbox must be min_lon,min_lat,max_lon,max_lat")
+    if not (-90 <= min_lat <= max_lat <= 90 and -180 <= min_lon <= 180 and -180 <= max_lon <= 180):
+        raise HTTPException(status_code=400, detail="bbox is outside of the valid coordinate range")
+    return min_lon, min_lat, max_lon, max_lat
+
+def parse_date_bound(value: str, name: str, end: bool = False) -> datetime:
+    """Parse an ISO date or date-time; a plain date as ``to`` includes that whole day."""
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"{name} must be an ISO date or date-time")
+    if parsed.tzinfo is not None:
+        # Capture times are stored as naive local camera time
+        parsed = parsed.replace(tzinfo=None)
+    if end and len(value) == 10:
+        parsed += timedelta(days=1)
+    return parsed
+
+@app.get("/images/search")
+async def search_images(
+    bbox: Optional[str] = None,
+    date_from: Optional[str] = Query(None, alias="from"),
+    date_to: Optional[str] = Query(None, alias="to"),
+    limit: int = Query(100, ge=1, le=500),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Find images taken inside a bounding box and/or a capture date range.
+
+    ``bbox`` is ``min_lon,min_lat,max_lon,max_lat``. ``from`` and ``to`` are
+    ISO dates or date-times; ``to`` is exclusive for date-times and includes
+    the whole day for plain dates. With a ``bbox``, images are ordered by
+    position from south to north; with only a date range, by capture time.
+    """
+    if bbox is None and date_from is None and date_to is None:
+        raise HTTPException(status_code=400, detail="Provide bbox, from or to")
+
+    selected_fields = parse_image_fields(fields)
+    box = parse_bbox(bbox) if bbox is not None else None
+    taken_from = parse_date_bound(date_from, "from") if date_from is not None else None
+    taken_before = parse_date_bound(date_to, "to", end=True) if date_to is not None else None
+
+    after = None
+    if cursor:
+        values = decode_cursor(cursor)
+        try:
+            if box is not None:
+                latitude, longitude, image_id = values
+                after = (float(latitude), float(longitude), int(image_id))
+            else:
+                date_taken, image_id = values
+                after = (datetime.fromisoformat(date_taken), int(image_id))
+        except (TypeError, ValueError):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    images = await crud.search_images(
+        db,
+        box,
+        taken_from,
+        taken_before,
+        limit,
+        after,
+        include_content_analysis="content_analysis" in selected_fields
+    )
+
+    next_cursor = None
+    if len(images) == limit:
+        last = images[-1]
+        if box is not None:
+            next_cursor = encode_cursor(last.gps_latitude, last.gps_longitude, last.id)
+        else:
+            next_cursor = encode_cursor(last.date_taken.isoformat(), last.id)
+
+    return {
+        "images": [
+            {"group_id": image.group_id, **serialize_image(image, image.group.directory_name, selected_fields)}
+            for image in images
+        ],
+        "next_cursor": next_cursor
+    }
+
+@app.get("/search")
+async def search(
+    q: str = Query(..., min_length=1, max_length=500),
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Full-text search over the content analysis of images, best match first.
+
+    ``q`` is free text; on Postgres it also accepts web-search syntax such as
+    ``"quoted phrases"``, ``or`` and ``-excluded`` words. Only the newest
+    ``SEARCH_MAX_CANDIDATES`` matches are ranked; ``truncated`` is true when
+    there were more.
+    """
+    selected_fields = parse_image_fields(fields)
+    after = None
+    if cursor:
+        values = decode_cursor(cursor)
+        try:
+            score, image_id = values
+            after = (float(score), int(image_id))
+        except (TypeError, ValueError):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    try:
+        matches, truncated = await search_image_ids(db, q, limit, after)
+    except SearchUnavailable as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+    images = await crud.get_images_by_ids(
+        db,
+        [image_id for image_id, _ in matches],
+        include_content_analysis="content_analysis" in selected_fields
+    )
+    scores = dict(matches)
+    next_cursor = None
+    if len(matches) == limit:
+        last_id, last_score = matches[-1]
+        next_cursor = encode_cursor(last_score, last_id)
+
+    return {
+        "query": q,
+        "results": [
+            {
+                "score": scores[image.id],
+                "group_id": image.group_id,
+                **serialize_image(image, image.group.directory_name, selected_fields)
             }
-            for image in group.images
-        ]
-    } 
\ No newline at end of file
+            for image in images
+        ],
+        "truncated": truncated,
+        "next_cursor": next_cursor
+    }
+
+@app.get("/images/{image_id}/thumb")
+async def get_image_thumbnail(
+    image_id: int,
+    size: int = Query(derivatives.DERIVATIVE_SIZES[0]),
+    format: str = Query(derivatives.DERIVATIVE_FORMAT),
+    if_none_match: Optional[str] = Header(None),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Serve a resized copy of an image, rendering it on first request."""
+    if size not in derivatives.DERIVATIVE_SIZES:
+        allowed = ", ".join(str(s) for s in derivatives.DERIVATIVE_SIZES)
+        raise HTTPException(status_code=400, detail=f"Unsupported size, use one of: {allowed}")
+    fmt = format.lower()
+    if fmt not in derivatives.FORMATS:
+        raise HTTPException(status_code=400, detail="Unsupported format, use webp or jpeg")
+
+    image = await crud.get_image(db, image_id)
+    if not image or not image.group:
+        raise HTTPException(status_code=404, detail="Image not found")
+
+    legacy_source = None
+    if not image.blob_key:
+        legacy_source = UPLOADS_DIR / image.group.directory_name / image.stored_filename
+        if not legacy_source.is_file():
+            raise HTTPException(status_code=404, detail="Image file not found")
+
+    etag = derivatives.derivative_etag(legacy_source, image.content_hash, size, fmt)
+    headers = {
+        "ETag": etag,
+        "Cache-Control": "public, max-age=31536000, immutable",
+    }
+    if if_none_match and etag in [tag.strip() for tag in if_none_match.split(",")]:
+        return Response(status_code=304, headers=headers)
+
+    directory, filename = derivative_source(image)
+    path = derivatives.derivative_path(UPLOADS_DIR, directory, filename, size, fmt)
+    # A blob's derivative never goes stale, so an existing one is served without fetching the blob
+    if not (image.blob_key and path.is_file()):
+        try:
+            async with image_file(storage, UPLOADS_DIR, image) as source:
+                path = await asyncio.to_thread(
+                    derivatives.ensure_derivative,
+                    UPLOADS_DIR,
+                    source,
+                    directory,
+                    filename,
+                    size,
+                    fmt,
+                    immutable=bool(image.blob_key)
+                )
+        except FileNotFoundError:
+            raise HTTPException(status_code=404, detail="Image file not found")
+        except Exception as e:
+            raise HTTPException(status_code=422, detail=f"Cannot render image: {str(e)}")
+
+    return FileResponse(path, media_type=derivatives.FORMATS[fmt][1], headers=headers)
+
+@app.get("/blobs/{key:path}")
+async def get_blob(key: str):
+    """Serve a file from the local blob store.
+
+    Blobs are named by their content, so they can be cached indefinitely.
+    With a remote store, image URLs point at the store instead.
+    """
+    if not isinstance(storage, LocalBlobStore) or not is_blob_key(key):
+        raise HTTPException(status_code=404, detail="Blob not found")
+    path = storage.path(key)
+    if not await asyncio.to_thread(path.is_file):
+        raise HTTPException(status_code=404, detail="Blob not found")
+    headers = {"Cache-Control": IMMUTABLE_CACHE_CONTROL, "ETag": f'"{Path(key).stem}"'}
+    return FileResponse(path, media_type=media_type(key), headers=headers)
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: int, db: AsyncSession = Depends(get_async_db)):
+    """Get the status of a content analysis job."""
+    job = await crud.get_analysis_job(db, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    return {
+        "id": job.id,
+        "image_id": job.image_id,
+        "status": job.status,
+        "attempts": job.attempts,
+        "max_attempts": job.max_attempts,
+        "last_error": job.last_error,
+        "run_after": job.run_after.isoformat() if job.run_after else None,
+        "created_at": job.created_at.isoformat(),
+        "updated_at": job.updated_at.isoformat(),
+        "started_at": job.started_at.isoformat() if job.started_at else None,
+        "finished_at": job.finished_at.isoformat() if job.finished_at else None,
+    }
+
+@app.get("/analysis-cache")
+async def get_analysis_cache_stats():
+    """Hit/miss counters of the content-addressed analysis cache, and near-duplicate reuse."""
+    return {**analysis_cache.stats(), "near_duplicates": near_duplicate_index.stats()}
+
+@app.get("/metrics")
+async def get_metrics():
+    """Prometheus metrics: request, upload, metadata, vision and commit latencies and error counts."""
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+@app.get("/analysis-stats")
+async def get_analysis_stats():
+    """Analysis backend in use, payload sizes before and after preprocessing, and request counters."""
+    return {
+        "backend": image_analyzer.backend.name,
+        "preprocessing": image_analyzer.stats(),
+        "requests": image_analyzer.backend.stats()
+    }
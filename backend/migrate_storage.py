@@ -0,0 +1,181 @@
+"""Move images stored in group directories into the blob store.
+
+Images uploaded before the blob store have no ``blob_key``; their files are
+at ``<uploads>/<directory_name>/<stored_filename>``. This walks them in ID
+order, in chunks of ``--chunk-size``: every file is hashed, stored under its
+content key in the store selected with ``STORAGE_BACKEND`` (identical files
+are stored once) and the row's ``blob_key`` and ``content_hash`` are set, one
+transaction per chunk. At most ``--concurrency`` files are handled at once.
+
+The original files are kept, so the application can serve them until the
+new rows are committed. With the local store they are hard links to the
+blobs where possible and take no extra space. ``--delete-originals`` removes
+each migrated file and its derivatives once its chunk is committed, and the
+group directories left empty at the end.
+
+Migrated rows are skipped, so an interrupted run is simply started again.
+
+Usage: python migrate_storage.py [--chunk-size N] [--concurrency N]
+       [--group-id ID] [--delete-originals] [--dry-run] [--uploads-dir DIR]
+"""
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+
+from database import AsyncSessionLocal
+from models import Image
+from services.derivatives import DERIVATIVES_DIRNAME
+from services.logs import configure_logging
+from services.storage import BlobStore, blob_key, create_store
+from services.uploads import SNIFF_LENGTH, sniff_image_type
+import crud
+
+logger = logging.getLogger("migrate_storage")
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def hash_file(path: Path) -> Tuple[str, Optional[str]]:
+    """SHA-256 hex digest and sniffed MIME type of a file."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as handle:
+        header = handle.read(SNIFF_LENGTH)
+        digest.update(header)
+        while chunk := handle.read(HASH_CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest(), sniff_image_type(header)
+
+
+def remove_original(uploads_dir: Path, directory_name: str, stored_filename: str) -> None:
+    """Delete a migrated file and the derivatives rendered from it."""
+    (uploads_dir / directory_name / stored_filename).unlink(missing_ok=True)
+    derivatives = uploads_dir / DERIVATIVES_DIRNAME / directory_name
+    if derivatives.is_dir():
+        for size_dir in derivatives.iterdir():
+            for derivative in size_dir.glob(f"{stored_filename}.*"):
+                derivative.unlink(missing_ok=True)
+
+
+def remove_empty_directories(root: Path) -> int:
+    """Remove ``root`` and the directories below it that are empty, deepest first; returns how many."""
+    removed = 0
+    for directory, _, _ in os.walk(root, topdown=False):
+        if not os.listdir(directory):
+            os.rmdir(directory)
+            removed += 1
+    return removed
+
+
+class Migration:
+    def __init__(self, args: argparse.Namespace, storage: BlobStore):
+        self.args = args
+        self.storage = storage
+        self.semaphore = asyncio.Semaphore(args.concurrency)
+        self.directories = set()
+        self.counts = {
+            "images": 0,
+            "missing_files": 0,
+            "stored": 0,
+            "already_stored": 0,
+            "hash_changed": 0,
+            "failed": 0,
+        }
+
+    async def run(self) -> None:
+        started = time.perf_counter()
+        after_id = 0
+        while True:
+            async with AsyncSessionLocal() as db:
+                chunk = await crud.get_images_without_blob(db, after_id, self.args.chunk_size, self.args.group_id)
+            if not chunk:
+                return
+
+            results = await asyncio.gather(*(self.migrate(image) for image in chunk))
+            updates = [update for update in results if update]
+            if updates and not self.args.dry_run:
+                async with AsyncSessionLocal() as db:
+                    await crud.update_images_bulk(db, [values for values, _ in updates])
+                if self.args.delete_originals:
+                    # Only now do the rows point at the blobs
+                    for _, image in updates:
+                        await asyncio.to_thread(
+                            remove_original, self.args.uploads_dir, image.group.directory_name, image.stored_filename
+                        )
+                        self.directories.add(image.group.directory_name)
+
+            after_id = chunk[-1].id
+            self.counts["images"] += len(chunk)
+            rate = self.counts["images"] / max(time.perf_counter() - started, 1e-9)
+            logger.info("Handled %d images up to ID %d (%.1f/s), %d moved in this chunk",
+                        self.counts["images"], after_id, rate, len(updates))
+
+    async def migrate(self, image: Image) -> Optional[Tuple[Dict[str, Any], Image]]:
+        """Store one image's file; returns the column values to update and the image."""
+        if image.group is None:
+            self.counts["missing_files"] += 1
+            return None
+        path = self.args.uploads_dir / image.group.directory_name / image.stored_filename
+        async with self.semaphore:
+            try:
+                content_hash, content_type = await asyncio.to_thread(hash_file, path)
+            except FileNotFoundError:
+                self.counts["missing_files"] += 1
+                return None
+            if image.content_hash and image.content_hash != content_hash:
+                # The file was changed on disk after the upload; the blob is named after what is there now
+                self.counts["hash_changed"] += 1
+                logger.warning("Image %d: file no longer matches its stored content hash", image.id)
+            key = blob_key(content_hash, content_type or image.content_type)
+            if self.args.dry_run:
+                self.counts["stored"] += 1
+                return None
+            try:
+                created = await self.storage.put(path, key, content_type or image.content_type, keep_source=True)
+            except Exception as e:
+                self.counts["failed"] += 1
+                logger.warning("Image %d: could not store %s: %s", image.id, path, e)
+                return None
+        self.counts["stored" if created else "already_stored"] += 1
+        return {"id": image.id, "blob_key": key, "content_hash": content_hash}, image
+
+
+async def migrate(args: argparse.Namespace) -> Dict[str, Any]:
+    storage = create_store()
+    started = time.perf_counter()
+    migration = Migration(args, storage)
+    await migration.run()
+    summary: Dict[str, Any] = {"dry_run": args.dry_run, "storage": storage.name, **migration.counts}
+    if args.delete_originals and not args.dry_run:
+        summary["directories_removed"] = 0
+        for name in migration.directories:
+            for root in (args.uploads_dir / name, args.uploads_dir / DERIVATIVES_DIRNAME / name):
+                summary["directories_removed"] += await asyncio.to_thread(remove_empty_directories, root)
+    summary["seconds"] = round(time.perf_counter() - started, 3)
+    return summary
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Move images from group directories into the blob store")
+    parser.add_argument("--chunk-size", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=8, help="Files hashed and stored at once")
+    parser.add_argument("--group-id", type=int, help="Only images of this group")
+    parser.add_argument("--delete-originals", action="store_true",
+                        help="Remove migrated files and their derivatives from the group directories")
+    parser.add_argument("--dry-run", action="store_true", help="Hash the files but store and change nothing")
+    parser.add_argument("--uploads-dir", type=Path, default=Path("uploads"))
+    args = parser.parse_args()
+    configure_logging()
+    if args.chunk_size < 1 or args.concurrency < 1:
+        parser.error("--chunk-size and --concurrency must be positive")
+
+    print(json.dumps(asyncio.run(migrate(args)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, JSON
+from sqlalchemy import BigInteger, Column, Integer, String, DateTime, Float, ForeignKey, JSON, Index
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from database import Base
@@ -14,15 +14,22 @@ class ImageGroup(Base):
     # Relationship to images
     images = relationship("Image", back_populates="group", cascade="all, delete-orphan")
 
+    __table_args__ = (
+        # Keyset pagination of the group listing, newest first
+        Index("ix_image_groups_created_at_id", "created_at", "id"),
+    )
+
 class Image(Base):
     __tablename__ = "images"
 
     id = Column(Integer, primary_key=True, index=True)
     group_id = Column(Integer, ForeignKey("image_groups.id"))
     original_filename = Column(String)
-    stored_filename = Column(String)  # The filename on disk
+    stored_filename = Column(String)  # Unique within the group; the file on disk for images without a blob
     content_type = Column(String)
     file_size = Column(Integer)
+    content_hash = Column(String(64), nullable=True, index=True)  # SHA-256 of the file bytes
+    blob_key = Column(String(255), nullable=True, index=True)  # Key in the blob store; NULL for files in the group directory
     uploaded_at = Column(DateTime, default=datetime.utcnow)
     
     # Image metadata
@@ -32,11 +39,72 @@ class Image(Base):
     camera_make = Column(String, nullable=True)
     camera_model = Column(String, nullable=True)
     date_taken = Column(DateTime, nullable=True)
-    gps_latitude = Column(String, nullable=True)
-    gps_longitude = Column(String, nullable=True)
+    gps_latitude = Column(Float, nullable=True)  # Decimal degrees, north positive
+    gps_longitude = Column(Float, nullable=True)  # Decimal degrees, east positive
+    perceptual_hash = Column(BigInteger, nullable=True)  # 64-bit dHash, stored signed
     
     # AI Analysis results stored as JSON
     content_analysis = Column(JSON, nullable=True)
+    analysis_status = Column(String, default="pending")  # pending, running, completed or failed
     
     # Relationship to group
-    group = relationship("ImageGroup", back_populates="images") 
\ No newline at end of file
+    group = relationship("ImageGroup", back_populates="images")
+    analysis_jobs = relationship("AnalysisJob", back_populates="image", cascade="all, delete-orphan")
+
+    __table_args__ = (
+        # Keyset pagination of a group's images in upload order
+        Index("ix_images_group_id_id", "group_id", "id"),
+        # Bounding-box searches; the capture date is included so that date
+        # filters are checked from the index before rows are read
+        Index("ix_images_gps", "gps_latitude", "gps_longitude", "id", "date_taken"),
+        # Capture date searches
+        Index("ix_images_date_taken_id", "date_taken", "id"),
+    )
+
+class AnalysisJob(Base):
+    __tablename__ = "analysis_jobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    image_id = Column(Integer, ForeignKey("images.id"), index=True)
+    status = Column(String, default="pending", index=True)  # pending, running, completed or failed
+    attempts = Column(Integer, default=0)
+    max_attempts = Column(Integer, default=5)
+    last_error = Column(String, nullable=True)
+    run_after = Column(DateTime, default=datetime.utcnow)  # Earliest time the job may be (re)tried
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+
+    # Relationship to image
+    image = relationship("Image", back_populates="analysis_jobs")
+
+class UploadSession(Base):
+    __tablename__ = "upload_sessions"
+
+    id = Column(String(32), primary_key=True)  # Random; knowing it is what allows uploading into the group
+    group_id = Column(Integer, ForeignKey("image_groups.id"), index=True)
+    status = Column(String, default="open")  # open or finalized
+    created_at = Column(DateTime, default=datetime.utcnow)
+    expires_at = Column(DateTime, index=True)  # Extended by every request of the session
+
+    group = relationship("ImageGroup")
+    uploads = relationship("ResumableUpload", back_populates="session", cascade="all, delete-orphan")
+
+class ResumableUpload(Base):
+    __tablename__ = "resumable_uploads"
+
+    id = Column(String(32), primary_key=True)
+    session_id = Column(String(32), ForeignKey("upload_sessions.id"), index=True)
+    original_filename = Column(String)
+    stored_filename = Column(String)  # Unique within the session, and so within its group
+    upload_length = Column(BigInteger)
+    upload_offset = Column(BigInteger, default=0)  # Bytes received and committed to the partial file
+    status = Column(String, default="uploading")  # uploading, processing, completed or failed
+    image_id = Column(Integer, ForeignKey("images.id"), nullable=True)
+    result = Column(JSON, nullable=True)  # The saved file as reported by POST /upload
+    error = Column(String, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+    session = relationship("UploadSession", back_populates="uploads")
@@ -0,0 +1,544 @@
+"""Backends producing the content analysis of an image.
+
+``ANALYSIS_BACKEND`` selects the backend of a deployment:
+
+- ``openai``: a vision model behind the OpenAI API. One client, with a pooled
+  HTTP connection pool, is shared by all requests.
+- ``local``: deterministic Pillow heuristics (dominant colours, brightness,
+  orientation) that need no network or API key, for throughput tests, CI and
+  offline development.
+
+Every backend limits how many analyses run at once (``ANALYSIS_CONCURRENCY``)
+and how many start per second: ``ANALYSIS_RATE_LIMIT`` sets the initial rate,
+which the OpenAI backend then adjusts to the limits reported in its response
+headers. Calls time out after ``ANALYSIS_REQUEST_TIMEOUT`` seconds, and
+transient failures are retried with exponential backoff and jitter. A circuit
+breaker stops calling a backend after repeated transient failures; analyses
+are then deferred with ``AnalysisDeferred`` instead of failing. All of this
+applies across all callers in the process: analysis workers and backfills.
+
+Backends with ``supports_batches`` can also analyze several images in one
+request (``run_batch``); a batched request counts once against the limits.
+"""
+from io import BytesIO
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple, Type
+import asyncio
+import base64
+import json
+import logging
+import os
+import time
+import weakref
+
+from PIL import Image, ImageStat
+import httpx
+import openai
+
+from services.analysis_schema import (
+    ANALYSIS_RESPONSE_FORMAT, BATCH_RESPONSE_FORMAT, StreamingJSONParser, coerce_analysis, parse_lenient,
+    split_batch_results
+)
+from services.image_preprocessing import PreparedImage
+from services.metrics import VISION_SECONDS, record_error
+from services.resilience import CircuitBreaker, RequestStats, TokenBucket, backoff_delay, retry_after
+
+logger = logging.getLogger(__name__)
+
+ANALYSIS_BACKEND = os.getenv("ANALYSIS_BACKEND", "openai").lower()
+# Defaults to the backend's own limit when unset
+ANALYSIS_CONCURRENCY = os.getenv("ANALYSIS_CONCURRENCY")
+ANALYSIS_RATE_LIMIT = float(os.getenv("ANALYSIS_RATE_LIMIT", "0"))
+ANALYSIS_REQUEST_TIMEOUT = float(os.getenv("ANALYSIS_REQUEST_TIMEOUT", "60"))
+# Retries of a transient failure within one analysis, before the job queue's own retries
+ANALYSIS_REQUEST_RETRIES = max(0, int(os.getenv("ANALYSIS_REQUEST_RETRIES", "2")))
+ANALYSIS_BACKOFF_BASE = float(os.getenv("ANALYSIS_BACKOFF_BASE", "1"))
+ANALYSIS_BACKOFF_MAX = float(os.getenv("ANALYSIS_BACKOFF_MAX", "30"))
+ANALYSIS_CIRCUIT_FAILURES = max(1, int(os.getenv("ANALYSIS_CIRCUIT_FAILURES", "5")))
+ANALYSIS_CIRCUIT_RESET = float(os.getenv("ANALYSIS_CIRCUIT_RESET", "30"))
+
+OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4o")
+# Text-only model that turns an unparsable answer into schema-conforming JSON; empty to disable
+OPENAI_REPAIR_MODEL = os.getenv("OPENAI_REPAIR_MODEL", "gpt-4o-mini")
+OPENAI_MAX_CONNECTIONS = max(1, int(os.getenv("OPENAI_MAX_CONNECTIONS", "20")))
+# "low", "high" or "auto"; see the OpenAI vision docs
+ANALYSIS_IMAGE_DETAIL = os.getenv("ANALYSIS_IMAGE_DETAIL", "high")
+
+# Simulated model latency of the local backend, in seconds
+LOCAL_ANALYSIS_DELAY = float(os.getenv("LOCAL_ANALYSIS_DELAY", "0"))
+
+ANALYSIS_PROMPT = (
+    "Analyze this image. Give a detailed description of the scene, the type of location, the time of "
+    "day and weather conditions, the key objects and the activities shown."
+)
+
+BATCH_ANALYSIS_PROMPT = (
+    "Analyze each of the following {count} images separately. They are numbered 1 to {count} in the order "
+    "given. Return one result per image in 'results', with its number in 'index' and fields: "
+    "'description' (detailed scene description), 'location_type' (type of location), "
+    "'time_and_weather' (time of day and weather conditions), 'key_elements' (list of key objects) "
+    "and 'activities' (list of activities)."
+)
+
+REPAIR_PROMPT = (
+    "The following text should have been JSON matching the given schema but could not be parsed. "
+    "Rewrite it as valid JSON matching the schema, using only the information in the text.\n\n"
+)
+
+
+class AnalysisError(Exception):
+    """Content analysis did not produce a result.
+
+    ``retryable`` is False for failures that will not go away on their own,
+    such as a missing API key or an unreadable file. ``retry_after`` is the
+    delay the backend asked for, if any; ``throttled`` marks rate limit
+    responses.
+    """
+
+    def __init__(
+        self,
+        message: str,
+        retryable: bool = True,
+        retry_after: Optional[float] = None,
+        throttled: bool = False
+    ):
+        super().__init__(message)
+        self.retryable = retryable
+        self.retry_after = retry_after
+        self.throttled = throttled
+
+
+class AnalysisDeferred(AnalysisError):
+    """The backend's circuit is open; the analysis should wait, not fail."""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message, retryable=True, retry_after=retry_after)
+
+
+class AnalysisBackend:
+    """Base class of analysis backends.
+
+    Subclasses implement ``analyze``. The concurrency limit and clients are
+    created per event loop on first use, since asyncio primitives and pooled
+    connections cannot be shared between loops; the rate limit, circuit
+    breaker and counters are shared by all loops.
+    """
+
+    name = "base"
+    default_concurrency = 4
+    supports_batches = False
+
+    def __init__(self, concurrency: Optional[int] = None, rate: float = ANALYSIS_RATE_LIMIT):
+        if concurrency is None:
+            concurrency = int(ANALYSIS_CONCURRENCY) if ANALYSIS_CONCURRENCY else self.default_concurrency
+        self.concurrency = max(1, concurrency)
+        self.rate_limiter = TokenBucket(rate)
+        self.circuit = CircuitBreaker(ANALYSIS_CIRCUIT_FAILURES, ANALYSIS_CIRCUIT_RESET)
+        self.request_stats = RequestStats()
+        self._loop_state: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, Any]]" = (
+            weakref.WeakKeyDictionary()
+        )
+
+    def unavailable_reason(self) -> Optional[str]:
+        """Why the backend cannot analyze anything, or None when it can."""
+        return None
+
+    def _state(self) -> Dict[str, Any]:
+        loop = asyncio.get_running_loop()
+        state = self._loop_state.get(loop)
+        if state is None:
+            state = {"semaphore": asyncio.Semaphore(self.concurrency)}
+            self._loop_state[loop] = state
+        return state
+
+    async def run(self, prepared: PreparedImage, image_path: Path) -> Dict[str, Any]:
+        """Analyze an image within the backend's limits, retrying transient failures.
+
+        Raises ``AnalysisDeferred`` while the circuit is open, and the last
+        ``AnalysisError`` once the retries are used up.
+        """
+        return await self._call(lambda: self.analyze(prepared, image_path), "single")
+
+    async def run_batch(
+        self,
+        prepared: List[PreparedImage],
+        image_paths: List[Path]
+    ) -> List[Optional[Dict[str, Any]]]:
+        """Analyze several images in one request, like ``run``.
+
+        Returns the results in input order, with None for images the response
+        had no valid result for.
+        """
+        results = await self._call(lambda: self.analyze_batch(prepared, image_paths), "batch")
+        self.request_stats.batches += 1
+        self.request_stats.batched_images += len(results)
+        return results
+
+    async def _call(self, request: Callable[[], Awaitable[Any]], kind: str) -> Any:
+        stats = self.request_stats
+        async with self._state()["semaphore"]:
+            attempt = 0
+            while True:
+                if not self.circuit.allow():
+                    stats.shed += 1
+                    raise AnalysisDeferred(f"{self.name} backend unavailable", self.circuit.retry_after())
+
+                started = time.perf_counter()
+                try:
+                    wait = self.rate_limiter.reserve()
+                    if wait > 0:
+                        stats.throttle_wait_seconds += wait
+                        await asyncio.sleep(wait)
+
+                    stats.requests += 1
+                    started = time.perf_counter()
+                    result = await asyncio.wait_for(request(), ANALYSIS_REQUEST_TIMEOUT)
+                except asyncio.TimeoutError:
+                    stats.timeouts += 1
+                    outcome = "timeout"
+                    error = AnalysisError(f"Analysis timed out after {ANALYSIS_REQUEST_TIMEOUT:g}s")
+                except AnalysisError as e:
+                    outcome = "throttled" if e.throttled else "error"
+                    error = e
+                except Exception:
+                    # E.g. a response the results could not be read from; the circuit
+                    # must still learn the call ended, or a half-open trial never does
+                    self.circuit.record_failure()
+                    raise
+                except BaseException:
+                    # Cancelled: says nothing about the backend
+                    self.circuit.release_trial()
+                    raise
+                else:
+                    VISION_SECONDS.labels(self.name, kind, "success").observe(time.perf_counter() - started)
+                    stats.succeeded += 1
+                    self.circuit.record_success()
+                    return result
+                VISION_SECONDS.labels(self.name, kind, outcome).observe(time.perf_counter() - started)
+
+                if not error.retryable:
+                    # The backend answered; the problem is the request itself
+                    stats.failed += 1
+                    self.circuit.record_success()
+                    record_error("analysis", error)
+                    raise error
+                self.circuit.record_failure()
+                if error.throttled:
+                    stats.throttled += 1
+                    if error.retry_after:
+                        self.rate_limiter.pause(error.retry_after)
+                if attempt >= ANALYSIS_REQUEST_RETRIES:
+                    stats.failed += 1
+                    record_error("analysis", error)
+                    raise error
+                attempt += 1
+                stats.retries += 1
+                await asyncio.sleep(max(
+                    error.retry_after or 0.0,
+                    backoff_delay(attempt, ANALYSIS_BACKOFF_BASE, ANALYSIS_BACKOFF_MAX)
+                ))
+
+    def stats(self) -> Dict[str, Any]:
+        """Request counters, the current rate limit and the circuit state."""
+        return self.request_stats.snapshot(self.rate_limiter, self.circuit)
+
+    async def analyze(self, prepared: PreparedImage, image_path: Path) -> Dict[str, Any]:
+        """Content analysis of a prepared image; raises ``AnalysisError`` on failure."""
+        raise NotImplementedError
+
+    async def analyze_batch(
+        self,
+        prepared: List[PreparedImage],
+        image_paths: List[Path]
+    ) -> List[Optional[Dict[str, Any]]]:
+        """Content analysis of several images in one request, see ``run_batch``."""
+        raise NotImplementedError
+
+    async def aclose(self) -> None:
+        """Release the clients of the current event loop."""
+        self._loop_state.pop(asyncio.get_running_loop(), None)
+
+
+def _is_transient_api_error(error: Exception) -> bool:
+    """Whether an OpenAI client error is worth retrying."""
+    if isinstance(error, (openai.APIConnectionError, openai.RateLimitError, openai.InternalServerError)):
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code in (408, 409, 429) or error.status_code >= 500
+    return not isinstance(error, openai.OpenAIError)
+
+
+class OpenAIBackend(AnalysisBackend):
+    name = "openai"
+    default_concurrency = 8
+    supports_batches = True
+
+    def __init__(self, api_key: Optional[str] = None, model: str = OPENAI_MODEL, **limits):
+        super().__init__(**limits)
+        self.api_key = api_key if api_key is not None else os.getenv("OPENAI_API_KEY")
+        self.model = model
+
+    def unavailable_reason(self) -> Optional[str]:
+        return None if self.api_key else "OpenAI API key not set"
+
+    def client(self) -> openai.AsyncOpenAI:
+        """The client of the current event loop, keeping its connections alive between requests."""
+        state = self._state()
+        if "client" not in state:
+            state["client"] = openai.AsyncOpenAI(
+                api_key=self.api_key,
+                # Timeouts and retries are handled by ``run``
+                timeout=ANALYSIS_REQUEST_TIMEOUT,
+                max_retries=0,
+                http_client=openai.DefaultAsyncHttpxClient(
+                    limits=httpx.Limits(
+                        max_connections=OPENAI_MAX_CONNECTIONS,
+                        max_keepalive_connections=OPENAI_MAX_CONNECTIONS
+                    )
+                )
+            )
+        return state["client"]
+
+    @staticmethod
+    def _image_part(prepared: PreparedImage) -> Dict[str, Any]:
+        base64_image = base64.b64encode(prepared.data).decode('utf-8')
+        return {
+            "type": "image_url",
+            "image_url": {
+                "url": f"data:{prepared.mime_type};base64,{base64_image}",
+                "detail": ANALYSIS_IMAGE_DETAIL
+            }
+        }
+
+    async def _complete(
+        self,
+        content: List[Dict[str, Any]],
+        max_tokens: int,
+        model: Optional[str] = None,
+        **options
+    ) -> str:
+        """Send one chat completion request and return the text of its answer.
+
+        The answer is streamed; reading stops as soon as the JSON value in it
+        is complete. When the stream breaks off, the part received so far is
+        returned for the parser to complete.
+        """
+        try:
+            raw_response = await self.client().chat.completions.with_raw_response.create(
+                model=model or self.model,
+                messages=[{"role": "user", "content": content}],
+                max_tokens=max_tokens,
+                stream=True,
+                **options
+            )
+        except Exception as api_error:
+            logger.warning("OpenAI API error: %s", api_error)
+            headers = getattr(getattr(api_error, "response", None), "headers", None)
+            if headers:
+                self.rate_limiter.update_from_headers(headers)
+            raise AnalysisError(
+                f"OpenAI API error: {str(api_error)}",
+                retryable=_is_transient_api_error(api_error),
+                retry_after=retry_after(headers),
+                throttled=isinstance(api_error, openai.RateLimitError)
+            ) from api_error
+        self.rate_limiter.update_from_headers(raw_response.headers)
+
+        parts: List[str] = []
+        parser = StreamingJSONParser()
+        stream = raw_response.parse()
+        try:
+            async for chunk in stream:
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if delta:
+                    parts.append(delta)
+                    parser.feed(delta)
+                    if parser.complete:
+                        break
+        except Exception as e:
+            if not parts:
+                raise AnalysisError(f"Error processing response: {str(e)}") from e
+            logger.warning("Response stream broke off after %d characters: %s", sum(len(part) for part in parts), e)
+        finally:
+            await stream.close()
+        if not parts:
+            raise AnalysisError("No content in response")
+        return "".join(parts)
+
+    async def _parse(self, answer: str, response_format: Dict[str, Any]) -> Any:
+        """Parse an answer, repairing it locally or, failing that, with the repair model.
+
+        Returns None when the answer could not be turned into JSON.
+        """
+        stats = self.request_stats
+        try:
+            parsed, repaired = parse_lenient(answer)
+            if repaired:
+                stats.parse_repaired += 1
+            return parsed
+        except ValueError as e:
+            logger.info("Failed to parse response as JSON: %s", e)
+
+        if OPENAI_REPAIR_MODEL:
+            stats.parse_repair_requests += 1
+            schema = json.dumps(response_format["json_schema"]["schema"])
+            try:
+                fixed = await self._complete(
+                    [{"type": "text", "text": f"{REPAIR_PROMPT}Schema: {schema}\n\nText:\n{answer}"}],
+                    max(500, len(answer)),
+                    model=OPENAI_REPAIR_MODEL,
+                    response_format=response_format
+                )
+                return parse_lenient(fixed)[0]
+            except (AnalysisError, ValueError) as e:
+                logger.warning("Repairing the response failed: %s", e)
+        stats.parse_failures += 1
+        return None
+
+    async def analyze_batch(
+        self,
+        prepared: List[PreparedImage],
+        image_paths: List[Path]
+    ) -> List[Optional[Dict[str, Any]]]:
+        content = [{"type": "text", "text": BATCH_ANALYSIS_PROMPT.format(count=len(prepared))}]
+        for number, image in enumerate(prepared, start=1):
+            content.append({"type": "text", "text": f"Image {number}:"})
+            content.append(self._image_part(image))
+        answer = await self._complete(content, 600 * len(prepared), response_format=BATCH_RESPONSE_FORMAT)
+        logger.debug("OpenAI batch response received for %d images", len(prepared))
+        return split_batch_results(await self._parse(answer, BATCH_RESPONSE_FORMAT), len(prepared))
+
+    async def analyze(self, prepared: PreparedImage, image_path: Path) -> Dict[str, Any]:
+        content = [{"type": "text", "text": ANALYSIS_PROMPT}, self._image_part(prepared)]
+        answer = await self._complete(content, 1000, response_format=ANALYSIS_RESPONSE_FORMAT)
+        logger.debug("OpenAI response received for %s", image_path)
+
+        parsed = await self._parse(answer, ANALYSIS_RESPONSE_FORMAT)
+        analysis = coerce_analysis(parsed)
+        if analysis is None:
+            if parsed is not None:
+                self.request_stats.parse_failures += 1
+            # Kept so the paid answer is not lost; a backfill can retry it
+            logger.warning("No usable analysis in the response for %s", image_path)
+            return {
+                "error": "Failed to parse response as an image analysis",
+                "raw_analysis": answer
+            }
+        return analysis
+
+    async def aclose(self) -> None:
+        state = self._loop_state.pop(asyncio.get_running_loop(), None)
+        if state and "client" in state:
+            await state["client"].close()
+
+
+# Reference colours for naming dominant colours
+COLOR_NAMES: List[Tuple[str, Tuple[int, int, int]]] = [
+    ("black", (0, 0, 0)), ("white", (255, 255, 255)), ("gray", (128, 128, 128)),
+    ("red", (200, 30, 30)), ("orange", (240, 140, 20)), ("yellow", (240, 220, 40)),
+    ("green", (40, 160, 60)), ("teal", (0, 128, 128)), ("blue", (40, 90, 200)),
+    ("sky blue", (135, 190, 235)), ("purple", (128, 60, 160)), ("pink", (240, 150, 190)),
+    ("brown", (120, 80, 40)), ("beige", (225, 205, 165)),
+]
+
+
+def _color_name(rgb: Tuple[int, ...]) -> str:
+    return min(COLOR_NAMES, key=lambda named: sum((a - b) ** 2 for a, b in zip(named[1], rgb)))[0]
+
+
+def describe_image(data: bytes) -> Dict[str, Any]:
+    """Deterministic content analysis from pixel statistics alone.
+
+    Returns the same keys as the vision model, plus ``dominant_colors`` as
+    hex codes, most common first.
+    """
+    with Image.open(BytesIO(data)) as img:
+        img.draft("RGB", (128, 128))
+        small = img.convert("RGB")
+    small.thumbnail((64, 64))
+    width, height = small.size
+
+    brightness = ImageStat.Stat(small.convert("L")).mean[0]
+    palette = small.quantize(colors=4, method=Image.Quantize.MEDIANCUT)
+    colors = palette.getpalette()[:4 * 3]
+    counts = sorted(palette.getcolors() or [], reverse=True)
+    dominant = [tuple(colors[index * 3:index * 3 + 3]) for _, index in counts]
+    names = list(dict.fromkeys(_color_name(rgb) for rgb in dominant))
+
+    top = small.crop((0, 0, width, max(1, height // 3)))
+    red, green, blue = ImageStat.Stat(top).mean
+    outdoor = blue > red and blue > green and blue > 110
+
+    if brightness < 50:
+        light = "dark"
+        time_and_weather = "night or a dark interior"
+    elif brightness < 110:
+        light = "dim"
+        time_and_weather = "low light, overcast or dusk"
+    elif brightness < 190:
+        light = "well lit"
+        time_and_weather = "daylight"
+    else:
+        light = "bright"
+        time_and_weather = "bright daylight"
+    orientation = "landscape" if width > height else "portrait" if height > width else "square"
+
+    return {
+        "description": f"A {light} {orientation} image dominated by {', '.join(names)} tones.",
+        "location_type": "outdoor" if outdoor else "unknown",
+        "time_and_weather": time_and_weather,
+        "key_elements": names,
+        "activities": [],
+        "dominant_colors": ["#%02x%02x%02x" % rgb for rgb in dominant],
+    }
+
+
+class LocalBackend(AnalysisBackend):
+    name = "local"
+    default_concurrency = os.cpu_count() or 1
+    supports_batches = True
+
+    async def analyze(self, prepared: PreparedImage, image_path: Path) -> Dict[str, Any]:
+        if LOCAL_ANALYSIS_DELAY:
+            await asyncio.sleep(LOCAL_ANALYSIS_DELAY)
+        try:
+            return await asyncio.to_thread(describe_image, prepared.data)
+        except Exception as e:
+            raise AnalysisError(f"Error analyzing image: {str(e)}", retryable=False) from e
+
+    async def analyze_batch(
+        self,
+        prepared: List[PreparedImage],
+        image_paths: List[Path]
+    ) -> List[Optional[Dict[str, Any]]]:
+        # One simulated round trip for the whole batch; unreadable images get no result
+        if LOCAL_ANALYSIS_DELAY:
+            await asyncio.sleep(LOCAL_ANALYSIS_DELAY)
+
+        def describe_all() -> List[Optional[Dict[str, Any]]]:
+            results = []
+            for image in prepared:
+                try:
+                    results.append(describe_image(image.data))
+                except Exception:
+                    results.append(None)
+            return results
+
+        return await asyncio.to_thread(describe_all)
+
+
+ANALYSIS_BACKENDS: Dict[str, Type[AnalysisBackend]] = {
+    OpenAIBackend.name: OpenAIBackend,
+    LocalBackend.name: LocalBackend,
+}
+
+
+def create_analysis_backend(name: str = ANALYSIS_BACKEND, **options) -> AnalysisBackend:
+    """Instantiate the backend registered under ``name``."""
+    try:
+        backend_class = ANALYSIS_BACKENDS[name]
+    except KeyError:
+        raise ValueError(
+            f"Unknown analysis backend {name!r}; choose one of {', '.join(sorted(ANALYSIS_BACKENDS))}"
+        ) from None
+    return backend_class(**options)
@@ -0,0 +1,96 @@
+"""Content-addressed cache of analysis results.
+
+Results are keyed by the SHA-256 of the image bytes. Recently used entries are
+kept in an in-memory LRU; misses fall back to the ``images`` table, so a
+result survives restarts and is shared between processes.
+"""
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+import os
+import threading
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models import Image
+import crud
+
+ANALYSIS_CACHE_SIZE = max(0, int(os.getenv("ANALYSIS_CACHE_SIZE", "1024")))
+
+
+def metadata_from_image(image: Image) -> Dict[str, Any]:
+    """Rebuild the metadata dict produced by ``ImageAnalyzer.extract_metadata`` from a row."""
+    metadata: Dict[str, Any] = {
+        "width": image.width,
+        "height": image.height,
+        "format": image.format,
+    }
+    if image.camera_make:
+        metadata["camera_make"] = image.camera_make
+    if image.camera_model:
+        metadata["camera_model"] = image.camera_model
+    if image.date_taken:
+        metadata["date_taken"] = image.date_taken.isoformat()
+    if image.perceptual_hash is not None:
+        metadata["perceptual_hash"] = image.perceptual_hash
+    if image.gps_latitude is not None and image.gps_longitude is not None:
+        metadata["gps"] = {
+            "latitude": image.gps_latitude,
+            "longitude": image.gps_longitude
+        }
+    return metadata
+
+
+class AnalysisCache:
+    def __init__(self, maxsize: int = ANALYSIS_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    async def get(self, db: AsyncSession, content_hash: str) -> Optional[Dict[str, Any]]:
+        """Return ``{"metadata": ..., "content_analysis": ...}`` for known bytes, or None."""
+        with self._lock:
+            entry = self._entries.get(content_hash)
+            if entry is not None:
+                self._entries.move_to_end(content_hash)
+                self.hits += 1
+                return entry
+
+        image = await crud.get_analyzed_image_by_hash(db, content_hash)
+        if image is None:
+            with self._lock:
+                self.misses += 1
+            return None
+
+        entry = {
+            "metadata": metadata_from_image(image),
+            "content_analysis": image.content_analysis
+        }
+        with self._lock:
+            self.hits += 1
+        self.put(content_hash, entry["metadata"], entry["content_analysis"])
+        return entry
+
+    def put(self, content_hash: str, metadata: Dict[str, Any], content_analysis: Dict[str, Any]) -> None:
+        """Remember a successful analysis result."""
+        if self.maxsize == 0 or not content_analysis or "error" in content_analysis:
+            return
+        with self._lock:
+            self._entries[content_hash] = {
+                "metadata": metadata,
+                "content_analysis": content_analysis
+            }
+            self._entries.move_to_end(content_hash)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "size": len(self._entries),
+            "maxsize": self.maxsize
+        }
@@ -0,0 +1,259 @@
+"""Schema of content analysis results and tolerant parsing of model output.
+
+The vision model is asked for JSON matching ``ANALYSIS_SCHEMA`` through the
+API's structured output mode, which rules out most malformed answers. What
+can still go wrong is repaired locally before anything else is tried:
+
+- text around the JSON, such as Markdown code fences or a sentence of prose;
+- trailing commas and Python-style single-quoted dicts;
+- answers cut off mid-way (a timeout, ``max_tokens``): ``StreamingJSONParser``
+  follows the structure while the answer streams in and can close it at
+  any point, keeping every complete field.
+
+``coerce_analysis`` then normalises the parsed value to the schema, e.g. a
+comma-separated string where a list was expected.
+"""
+from typing import Any, Dict, List, Optional, Tuple, TypedDict
+import ast
+import json
+import re
+
+TEXT_FIELDS = ("description", "location_type", "time_and_weather")
+LIST_FIELDS = ("key_elements", "activities")
+ANALYSIS_FIELDS = TEXT_FIELDS + LIST_FIELDS
+
+
+class ContentAnalysis(TypedDict):
+    description: str
+    location_type: str
+    time_and_weather: str
+    key_elements: List[str]
+    activities: List[str]
+
+
+ANALYSIS_SCHEMA: Dict[str, Any] = {
+    "type": "object",
+    "properties": {
+        "description": {"type": "string", "description": "Detailed scene description"},
+        "location_type": {"type": "string", "description": "Type of location"},
+        "time_and_weather": {"type": "string", "description": "Time of day and weather conditions"},
+        "key_elements": {"type": "array", "items": {"type": "string"}, "description": "Key objects"},
+        "activities": {"type": "array", "items": {"type": "string"}, "description": "Activities"},
+    },
+    "required": list(ANALYSIS_FIELDS),
+    "additionalProperties": False,
+}
+
+BATCH_SCHEMA: Dict[str, Any] = {
+    "type": "object",
+    "properties": {
+        "results": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {"index": {"type": "integer"}, **ANALYSIS_SCHEMA["properties"]},
+                "required": ["index", *ANALYSIS_FIELDS],
+                "additionalProperties": False,
+            },
+        },
+    },
+    "required": ["results"],
+    "additionalProperties": False,
+}
+
+
+def json_schema_format(name: str, schema: Dict[str, Any]) -> Dict[str, Any]:
+    """``response_format`` of a chat completion request enforcing ``schema``."""
+    return {"type": "json_schema", "json_schema": {"name": name, "strict": True, "schema": schema}}
+
+
+ANALYSIS_RESPONSE_FORMAT = json_schema_format("image_analysis", ANALYSIS_SCHEMA)
+BATCH_RESPONSE_FORMAT = json_schema_format("image_analyses", BATCH_SCHEMA)
+
+
+class StreamingJSONParser:
+    """Incremental JSON scanner that can complete a truncated document.
+
+    ``feed`` the text as it arrives. The scanner tracks open strings, objects
+    and arrays, and remembers the points where the document could be cut
+    cleanly, so ``parse`` can return the complete part of an unfinished
+    answer. Text before the first ``{`` or ``[`` is skipped.
+    """
+
+    def __init__(self):
+        self.text = ""
+        self._started = False
+        self._stack: List[str] = []
+        self._in_string = False
+        self._escape = False
+        self._done = False
+        # (length of text, open containers) at which the document can be cut
+        self._cuts: List[Tuple[int, Tuple[str, ...]]] = []
+
+    def feed(self, chunk: str) -> None:
+        accepted = []
+        length = len(self.text)
+        for char in chunk:
+            if self._done:
+                break
+            if not self._started:
+                if char not in "{[":
+                    continue
+                self._started = True
+            accepted.append(char)
+            length += 1
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+                continue
+            if char == '"':
+                self._in_string = True
+            elif char in "{[":
+                self._stack.append(char)
+                self._cuts.append((length, tuple(self._stack)))
+            elif char in "}]":
+                if self._stack:
+                    self._stack.pop()
+                if not self._stack:
+                    self._done = True
+                else:
+                    self._cuts.append((length, tuple(self._stack)))
+            elif char == ",":
+                self._cuts.append((length - 1, tuple(self._stack)))
+        self.text += "".join(accepted)
+
+    @property
+    def complete(self) -> bool:
+        """Whether the top-level value has been closed."""
+        return self._done
+
+    @staticmethod
+    def _closers(stack: Tuple[str, ...]) -> str:
+        return "".join("}" if opener == "{" else "]" for opener in reversed(stack))
+
+    def parse(self) -> Any:
+        """The document so far, closed where needed; raises ValueError if nothing usable was seen."""
+        if not self._started:
+            raise ValueError("No JSON value found")
+        if self._done:
+            return json.loads(self.text)
+        candidates = [self.text + ('"' if self._in_string else "") + self._closers(tuple(self._stack))]
+        for length, stack in reversed(self._cuts):
+            candidates.append(self.text[:length] + self._closers(stack))
+        for candidate in candidates:
+            try:
+                return json.loads(_strip_trailing_commas(candidate))
+            except ValueError:
+                continue
+        raise ValueError("Truncated JSON could not be completed")
+
+
+_FENCE = re.compile(r"^\s*```[a-zA-Z]*\s*|\s*```\s*$")
+_TRAILING_COMMA = re.compile(r",(\s*[}\]])")
+
+
+def _strip_trailing_commas(text: str) -> str:
+    return _TRAILING_COMMA.sub(r"\1", text)
+
+
+def parse_lenient(text: str) -> Tuple[Any, bool]:
+    """Parse model output as JSON, repairing it where possible.
+
+    Returns ``(value, repaired)``, where ``repaired`` tells whether anything
+    had to be fixed. Raises ValueError when no repair worked.
+    """
+    try:
+        return json.loads(text), False
+    except ValueError:
+        pass
+
+    cleaned = _FENCE.sub("", text.strip())
+    start = min((index for index in (cleaned.find("{"), cleaned.find("[")) if index >= 0), default=-1)
+    if start < 0:
+        raise ValueError("No JSON value found")
+    end = max(cleaned.rfind("}"), cleaned.rfind("]"))
+    candidate = cleaned[start:end + 1] if end > start else cleaned[start:]
+
+    for attempt in (candidate, _strip_trailing_commas(candidate)):
+        try:
+            return json.loads(attempt), True
+        except ValueError:
+            pass
+    try:
+        # A Python dict literal, as the old prompt's example suggested
+        value = ast.literal_eval(candidate)
+        if isinstance(value, (dict, list)):
+            return value, True
+    except (ValueError, SyntaxError, MemoryError, RecursionError):
+        pass
+
+    parser = StreamingJSONParser()
+    parser.feed(cleaned[start:])
+    return parser.parse(), True
+
+
+def _as_text(value: Any) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, list):
+        return ", ".join(_as_text(item) for item in value if item is not None)
+    return str(value).strip()
+
+
+def _as_list(value: Any) -> List[str]:
+    if value is None:
+        return []
+    if isinstance(value, str):
+        items = re.split(r"[,;\n]", value)
+    elif isinstance(value, list):
+        items = [_as_text(item) for item in value]
+    else:
+        items = [_as_text(value)]
+    return [item.strip() for item in items if item and item.strip()]
+
+
+def coerce_analysis(value: Any) -> Optional[ContentAnalysis]:
+    """Normalise a parsed result to the schema, or None when it has no description.
+
+    Keys are matched case-insensitively, missing fields become empty, lists
+    given as strings are split and unknown keys are dropped.
+    """
+    if not isinstance(value, dict):
+        return None
+    fields = {str(key).strip().lower().replace(" ", "_"): item for key, item in value.items()}
+    description = _as_text(fields.get("description"))
+    if not description:
+        return None
+    analysis: Dict[str, Any] = {"description": description}
+    for field in TEXT_FIELDS[1:]:
+        analysis[field] = _as_text(fields.get(field))
+    for field in LIST_FIELDS:
+        analysis[field] = _as_list(fields.get(field))
+    return analysis  # type: ignore[return-value]
+
+
+def split_batch_results(content: Any, count: int) -> List[Optional[ContentAnalysis]]:
+    """Per-image results of a batched response, in input order.
+
+    Entries are None for images without exactly one valid result, so that
+    only those need to be analyzed again on their own.
+    """
+    results: List[Optional[ContentAnalysis]] = [None] * count
+    items = content.get("results") if isinstance(content, dict) else None
+    if not isinstance(items, list):
+        return results
+    seen: Dict[int, int] = {}
+    for item in items:
+        index = item.get("index") if isinstance(item, dict) else None
+        analysis = coerce_analysis(item)
+        if isinstance(index, int) and 1 <= index <= count and analysis is not None:
+            seen[index] = seen.get(index, 0) + 1
+            results[index - 1] = analysis
+    for index, occurrences in seen.items():
+        if occurrences > 1:
+            results[index - 1] = None
+    return results
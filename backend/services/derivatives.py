@@ -0,0 +1,123 @@
+"""Resized copies of uploaded images for grids and previews.
+
+Derivatives live next to the group directories, under
+``<uploads>/_derivatives/<directory>/<size>/<filename>.<ext>``, where
+``directory`` and ``filename`` name the source: its group directory and
+stored filename, or ``_blobs/ab/cd`` and the blob's name for files in the
+blob store (see ``storage.derivative_source``). Group directory names never
+start with an underscore, so the tree cannot collide with an album. Files are written to a temporary name and renamed into
+place, so concurrent requests never serve a partially written derivative.
+"""
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+import os
+import tempfile
+
+from PIL import Image, ImageOps
+
+DERIVATIVES_DIRNAME = "_derivatives"
+DERIVATIVE_SIZES: Tuple[int, ...] = tuple(
+    sorted({int(size) for size in os.getenv("DERIVATIVE_SIZES", "256,1024").split(",") if size.strip()})
+)
+DERIVATIVE_FORMAT = os.getenv("DERIVATIVE_FORMAT", "webp").lower()
+DERIVATIVE_QUALITY = min(100, max(1, int(os.getenv("DERIVATIVE_QUALITY", "80"))))
+# Generate all sizes while handling the upload instead of on first request
+DERIVATIVES_ON_UPLOAD = os.getenv("DERIVATIVES_ON_UPLOAD", "false").lower() in ("1", "true", "yes")
+
+# Bump when the rendering changes so cached copies and ETags are invalidated
+DERIVATIVE_VERSION = 1
+
+FORMATS = {
+    "webp": ("WEBP", "image/webp"),
+    "jpeg": ("JPEG", "image/jpeg"),
+}
+
+
+def derivative_path(uploads_dir: Path, directory: str, filename: str, size: int, fmt: str) -> Path:
+    """Location of a derivative on disk."""
+    return uploads_dir / DERIVATIVES_DIRNAME / directory / str(size) / f"{filename}.{fmt}"
+
+
+def derivative_urls(image_id: int) -> Dict[str, str]:
+    """URLs of every configured derivative size of an image."""
+    return {str(size): f"/images/{image_id}/thumb?size={size}" for size in DERIVATIVE_SIZES}
+
+
+def derivative_etag(source: Optional[Path], content_hash: Optional[str], size: int, fmt: str) -> str:
+    """Strong ETag for a derivative.
+
+    A derivative is fully determined by its source bytes and rendering
+    parameters, so the ETag is known without reading the derivative itself.
+    """
+    if content_hash:
+        source_key = content_hash
+    else:
+        stat = source.stat()
+        source_key = f"{stat.st_mtime_ns:x}-{stat.st_size:x}"
+    return f'"{source_key}-{size}-{fmt}-v{DERIVATIVE_VERSION}"'
+
+
+def generate_derivative(source: Path, destination: Path, size: int, fmt: str) -> Path:
+    """Render a derivative whose longest edge is at most ``size`` pixels."""
+    pil_format, _ = FORMATS[fmt]
+    destination.parent.mkdir(parents=True, exist_ok=True)
+
+    with Image.open(source) as img:
+        img.draft("RGB", (size, size))
+        resized = ImageOps.exif_transpose(img)
+        resized.thumbnail((size, size), Image.Resampling.LANCZOS)
+        if pil_format == "JPEG" and resized.mode in ("RGBA", "LA", "P"):
+            # JPEG has no alpha channel; flatten onto white
+            rgba = resized.convert("RGBA")
+            resized = Image.new("RGB", rgba.size, (255, 255, 255))
+            resized.paste(rgba, mask=rgba.getchannel("A"))
+        elif resized.mode not in ("RGB", "RGBA"):
+            resized = resized.convert("RGB")
+
+        fd, temp_name = tempfile.mkstemp(dir=destination.parent, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as temp_file:
+                resized.save(temp_file, format=pil_format, quality=DERIVATIVE_QUALITY)
+            os.replace(temp_name, destination)
+        except BaseException:
+            os.unlink(temp_name)
+            raise
+
+    return destination
+
+
+def ensure_derivative(
+    uploads_dir: Path,
+    source: Path,
+    directory: str,
+    filename: str,
+    size: int,
+    fmt: str,
+    immutable: bool = False
+) -> Path:
+    """Return the derivative's path, rendering it from ``source`` first if missing or stale.
+
+    With ``immutable``, for blobs whose contents never change, an existing
+    derivative is always current.
+    """
+    destination = derivative_path(uploads_dir, directory, filename, size, fmt)
+    try:
+        rendered = destination.stat().st_mtime_ns
+        if immutable or rendered >= source.stat().st_mtime_ns:
+            return destination
+    except FileNotFoundError:
+        if not source.exists():
+            raise
+    return generate_derivative(source, destination, size, fmt)
+
+
+def generate_all_derivatives(
+    uploads_dir: Path,
+    source: Path,
+    directory: str,
+    filename: str,
+    immutable: bool = False
+) -> None:
+    """Render every configured size in the default format."""
+    for size in DERIVATIVE_SIZES:
+        ensure_derivative(uploads_dir, source, directory, filename, size, DERIVATIVE_FORMAT, immutable)
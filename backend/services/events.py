@@ -0,0 +1,230 @@
+"""Automatic event detection from capture times and GPS positions.
+
+``EventIndex`` holds the capture time, position and group of every dated
+image as NumPy arrays sorted by time. A new event starts wherever
+
+- more than ``max_gap_hours`` pass between two consecutive photos, or
+- a photo was taken more than ``max_distance_km`` away from the previous
+  photo with a position (great-circle distance).
+
+Both tests, and the summary of every event (time span, centre, spread, the
+groups its images are in), are computed with array operations over the whole
+library, so segmenting half a million photos takes milliseconds; see
+``benchmarks/bench_events.py``.
+
+The arrays are filled from the ``images`` table on first use. Afterwards each
+refresh reads only the images added since and merges them into place, so
+photos uploaded out of order (an old card imported late) land in the right
+event. Capture times written to existing rows later, e.g. by a backfill, are
+picked up on the next restart.
+"""
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Tuple
+import asyncio
+import os
+
+import numpy as np
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import crud
+
+EVENT_MAX_GAP_HOURS = float(os.getenv("EVENT_MAX_GAP_HOURS", "8"))
+EVENT_MAX_DISTANCE_KM = float(os.getenv("EVENT_MAX_DISTANCE_KM", "100"))
+EVENT_MIN_IMAGES = max(1, int(os.getenv("EVENT_MIN_IMAGES", "5")))
+# Image IDs listed per event; an event can span thousands of photos
+EVENT_SAMPLE_IMAGES = max(1, int(os.getenv("EVENT_SAMPLE_IMAGES", "20")))
+
+EARTH_RADIUS_KM = 6371.0088
+REFRESH_CHUNK_SIZE = 20000
+EPOCH = datetime(1970, 1, 1)
+SECOND = timedelta(seconds=1)
+
+
+def haversine_km(lat1: np.ndarray, lon1: np.ndarray, lat2: np.ndarray, lon2: np.ndarray) -> np.ndarray:
+    """Great-circle distances between arrays of points given in degrees."""
+    lat1, lon1, lat2, lon2 = (np.radians(values) for values in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+@dataclass
+class Events:
+    """Events found in an ``EventIndex``, as parallel arrays in time order."""
+    starts: np.ndarray  # Index of each event's first image in the sorted arrays
+    ends: np.ndarray  # Index after each event's last image
+    start_times: np.ndarray
+    end_times: np.ndarray
+    first_ids: np.ndarray
+    located: np.ndarray  # Images with a position
+    latitudes: np.ndarray  # Centre of the positions, NaN without any
+    longitudes: np.ndarray
+    radii_km: np.ndarray  # Furthest position from the centre
+    single_group: np.ndarray  # Group whose images are exactly the event's, else -1
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+
+class EventIndex:
+    def __init__(self):
+        self.ids = np.empty(0, dtype=np.int64)
+        self.times = np.empty(0, dtype=np.int64)  # Seconds since the epoch, camera local time
+        self.latitudes = np.empty(0, dtype=np.float64)  # NaN without a position
+        self.longitudes = np.empty(0, dtype=np.float64)
+        self.groups = np.empty(0, dtype=np.int64)
+        self.version = 0
+        self._last_id = 0
+        self._lock = asyncio.Lock()
+        self._cached: Optional[Tuple[tuple, Events]] = None
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    async def refresh(self, db: AsyncSession) -> None:
+        """Merge in the dated images stored since the last refresh."""
+        async with self._lock:
+            while True:
+                rows = await crud.get_event_points(db, self._last_id, REFRESH_CHUNK_SIZE)
+                if rows:
+                    self._last_id = rows[-1][0]
+                    self.add(rows)
+                if len(rows) < REFRESH_CHUNK_SIZE:
+                    return
+
+    def add(self, rows: List[Tuple[int, int, datetime, Optional[float], Optional[float]]]) -> None:
+        """Merge ``(id, group_id, date_taken, latitude, longitude)`` rows into the sorted arrays."""
+        ids, groups, taken, latitudes, longitudes = zip(*rows)
+        # Twice as fast as converting the datetimes through datetime64
+        times = np.fromiter(((moment - EPOCH) // SECOND for moment in taken), np.int64, len(taken))
+        order = np.argsort(times, kind="stable")
+        times = times[order]
+        # One pass over the existing arrays rather than a full re-sort
+        positions = np.searchsorted(self.times, times, side="right")
+        self.times = np.insert(self.times, positions, times)
+        self.ids = np.insert(self.ids, positions, np.array(ids, dtype=np.int64)[order])
+        self.groups = np.insert(self.groups, positions, np.array(groups, dtype=np.int64)[order])
+        self.latitudes = np.insert(self.latitudes, positions, np.array(latitudes, dtype=np.float64)[order])
+        self.longitudes = np.insert(self.longitudes, positions, np.array(longitudes, dtype=np.float64)[order])
+        self.version += 1
+
+    def segment(self, max_gap_hours: float, max_distance_km: float) -> np.ndarray:
+        """Index of the first image of every event."""
+        count = len(self.times)
+        if count == 0:
+            return np.empty(0, dtype=np.int64)
+        breaks = np.empty(count, dtype=bool)
+        breaks[0] = True
+        breaks[1:] = np.diff(self.times) > max_gap_hours * 3600
+
+        # Compare each position with the last one before it, skipping photos without one
+        located = ~np.isnan(self.latitudes)
+        last_fix = np.where(located, np.arange(count), -1)
+        np.maximum.accumulate(last_fix, out=last_fix)
+        previous_fix = np.concatenate(([-1], last_fix[:-1]))
+        checked = np.flatnonzero(located & (previous_fix >= 0))
+        previous = previous_fix[checked]
+        distances = haversine_km(
+            self.latitudes[checked], self.longitudes[checked],
+            self.latitudes[previous], self.longitudes[previous]
+        )
+        breaks[checked[distances > max_distance_km]] = True
+        return np.flatnonzero(breaks)
+
+    def events(self, max_gap_hours: float, max_distance_km: float, min_images: int) -> Events:
+        """Events of at least ``min_images`` images; the last result is cached until new images arrive."""
+        key = (self.version, max_gap_hours, max_distance_km, min_images)
+        if self._cached and self._cached[0] == key:
+            return self._cached[1]
+
+        starts = self.segment(max_gap_hours, max_distance_km)
+        ends = np.append(starts[1:], len(self.times)).astype(np.int64)
+        keep = (ends - starts) >= min_images
+        starts, ends = starts[keep], ends[keep]
+        sizes = ends - starts
+        count = len(starts)
+
+        # Positions of the kept events' images, event after event, and where each event begins in them
+        offsets = np.cumsum(sizes) - sizes
+        members = np.arange(int(sizes.sum()), dtype=np.int64) + np.repeat(starts - offsets, sizes)
+        event_of = np.repeat(np.arange(count), sizes)
+
+        # Centre of the positions as the mean of unit vectors, which works across the antimeridian
+        located = ~np.isnan(self.latitudes[members])
+        latitudes = np.radians(np.where(located, self.latitudes[members], 0.0))
+        longitudes = np.radians(np.where(located, self.longitudes[members], 0.0))
+        vectors = np.stack((
+            np.cos(latitudes) * np.cos(longitudes),
+            np.cos(latitudes) * np.sin(longitudes),
+            np.sin(latitudes),
+        ), axis=1) * located[:, None]
+        sums = np.add.reduceat(vectors, offsets, axis=0) if count else np.zeros((0, 3))
+        located_counts = np.add.reduceat(located.astype(np.int64), offsets) if count else np.zeros(0, np.int64)
+        with np.errstate(invalid="ignore"):
+            centre_latitudes = np.degrees(np.arctan2(sums[:, 2], np.hypot(sums[:, 0], sums[:, 1])))
+            centre_longitudes = np.degrees(np.arctan2(sums[:, 1], sums[:, 0]))
+        centre_latitudes[located_counts == 0] = np.nan
+        centre_longitudes[located_counts == 0] = np.nan
+
+        radii = np.zeros(count)
+        if located.any():
+            distances = haversine_km(
+                self.latitudes[members][located], self.longitudes[members][located],
+                centre_latitudes[event_of][located], centre_longitudes[event_of][located]
+            )
+            np.maximum.at(radii, event_of[located], distances)
+
+        # An event matches a group when all its images, and only those, are in that group
+        single_group = np.full(count, -1, dtype=np.int64)
+        if count:
+            groups = self.groups[members]
+            lowest = np.minimum.reduceat(groups, offsets)
+            highest = np.maximum.reduceat(groups, offsets)
+            matches = (lowest == highest) & (np.bincount(self.groups)[lowest] == sizes)
+            single_group[matches] = lowest[matches]
+
+        events = Events(
+            starts=starts,
+            ends=ends,
+            start_times=self.times[starts],
+            end_times=self.times[ends - 1],
+            first_ids=self.ids[starts],
+            located=located_counts,
+            latitudes=centre_latitudes,
+            longitudes=centre_longitudes,
+            radii_km=radii,
+            single_group=single_group,
+        )
+        self._cached = (key, events)
+        return events
+
+    def describe(self, events: Events, index: int) -> Dict[str, Any]:
+        """API representation of one event.
+
+        ``image_ids`` holds the first ``EVENT_SAMPLE_IMAGES`` images in
+        capture order, e.g. for a preview; ``image_count`` is the total.
+        """
+        start, end = events.starts[index], events.ends[index]
+        group_ids, group_counts = np.unique(self.groups[start:end], return_counts=True)
+        by_size = np.argsort(-group_counts, kind="stable")
+        located = int(events.located[index])
+        return {
+            "start": _isoformat(events.start_times[index]),
+            "end": _isoformat(events.end_times[index]),
+            "image_count": int(end - start),
+            "located_count": located,
+            "center": {
+                "latitude": round(float(events.latitudes[index]), 6),
+                "longitude": round(float(events.longitudes[index]), 6),
+            } if located else None,
+            "radius_km": round(float(events.radii_km[index]), 3) if located else None,
+            "matches_group": int(events.single_group[index]) if events.single_group[index] >= 0 else None,
+            "groups": [
+                {"group_id": int(group_ids[i]), "image_count": int(group_counts[i])} for i in by_size
+            ],
+            "image_ids": [int(image_id) for image_id in self.ids[start:min(end, start + EVENT_SAMPLE_IMAGES)]],
+        }
+
+
+def _isoformat(seconds: np.int64) -> str:
+    return datetime.fromtimestamp(int(seconds), timezone.utc).replace(tzinfo=None).isoformat()
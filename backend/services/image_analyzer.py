@@ -1,236 +1,176 @@
 from pathlib import Path
-from PIL import Image
-from PIL.ExifTags import TAGS, GPSTAGS
-from exif import Image as ExifImage
-from datetime import datetime
-import os
-from typing import Dict, Any, Optional, Tuple
-import base64
-import openai
+import asyncio
+from typing import Dict, Any, List, Optional, Union
 from dotenv import load_dotenv
-import json
+import logging
+import os
+import threading
+from services.analysis_backends import AnalysisBackend, AnalysisError, create_analysis_backend
+from services.image_preprocessing import PreparedImage, prepare_image_for_analysis
+from services.metadata import read_image_metadata, get_metadata_executor
+from services.metrics import METADATA_SECONDS, record_error
 
 load_dotenv()
 
-class ImageAnalyzer:
-    def __init__(self):
-        self.openai_api_key = os.getenv('OPENAI_API_KEY')
-        print("ImageAnalyzer initialized. API key status:", "is set" if self.openai_api_key else "is not set")
-        if self.openai_api_key:
-            openai.api_key = self.openai_api_key
-        else:
-            print("Warning: OpenAI API key not found in environment variables")
-
-    def _convert_to_degrees(self, value: tuple) -> float:
-        """Helper function to convert GPS coordinates to degrees."""
-        d = float(value[0])
-        m = float(value[1])
-        s = float(value[2])
-        return d + (m / 60.0) + (s / 3600.0)
-
-    def _get_gps_data(self, exif_data: dict) -> Optional[Dict[str, float]]:
-        """Extract GPS coordinates from EXIF data."""
-        if not exif_data:
-            return None
-
-        gps_info = {}
-        for key, value in exif_data.items():
-            tag = TAGS.get(key, key)
-            if tag == 'GPSInfo':
-                for t, v in value.items():
-                    sub_tag = GPSTAGS.get(t, t)
-                    gps_info[sub_tag] = v
-
-        if not gps_info:
-            return None
+logger = logging.getLogger(__name__)
 
-        try:
-            lat_data = gps_info.get('GPSLatitude')
-            lon_data = gps_info.get('GPSLongitude')
-            lat_ref = gps_info.get('GPSLatitudeRef')
-            lon_ref = gps_info.get('GPSLongitudeRef')
-
-            if lat_data and lon_data and lat_ref and lon_ref:
-                lat = self._convert_to_degrees(lat_data)
-                lon = self._convert_to_degrees(lon_data)
-
-                if lat_ref != 'N':
-                    lat = -lat
-                if lon_ref != 'E':
-                    lon = -lon
-
-                return {
-                    'latitude': lat,
-                    'longitude': lon
-                }
-        except Exception as e:
-            print(f"Error extracting GPS data: {e}")
-        
-        return None
+# Images packed into one vision request by request_content_analysis_batch; 1 disables batching
+ANALYSIS_BATCH_SIZE = max(1, int(os.getenv("ANALYSIS_BATCH_SIZE", "1")))
 
-    def extract_metadata(self, image_path: Path) -> Dict[str, Any]:
+class ImageAnalyzer:
+    def __init__(self, backend: Optional[AnalysisBackend] = None, batch_size: int = ANALYSIS_BATCH_SIZE):
+        # The backend is chosen per deployment with ANALYSIS_BACKEND
+        self.backend = backend or create_analysis_backend()
+        self.batch_size = batch_size
+        unavailable = self.backend.unavailable_reason()
+        logger.info("ImageAnalyzer initialized with the %s backend: %s", self.backend.name, unavailable or "ready")
+        # Payload size before/after preprocessing, across all analyzed images
+        self.preprocess_stats = {"images": 0, "bytes_before": 0, "bytes_after": 0}
+        self._stats_lock = threading.Lock()
+
+    def extract_metadata(self, image_path: Path, data: Optional[bytes] = None) -> Dict[str, Any]:
         """Extract metadata from an image including EXIF data."""
-        metadata = {
-            'filename': image_path.name,
-            'file_size': os.path.getsize(image_path),
-            'file_type': image_path.suffix.lower(),
-        }
-
-        try:
-            # Use PIL for basic image info
-            with Image.open(image_path) as img:
-                metadata.update({
-                    'width': img.width,
-                    'height': img.height,
-                    'format': img.format,
-                    'mode': img.mode,
-                })
-
-                # Extract EXIF data
-                try:
-                    exif_data = {}
-                    raw_exif = img.getexif() if hasattr(img, 'getexif') else None
-                    if raw_exif:
-                        for tag_id, value in raw_exif.items():
-                            tag = TAGS.get(tag_id, tag_id)
-                            if isinstance(value, bytes):
-                                try:
-                                    value = value.decode()
-                                except:
-                                    value = str(value)
-                            exif_data[tag] = value
-
-                        # Extract specific EXIF data we want
-                        if 'DateTimeOriginal' in exif_data:
-                            try:
-                                metadata['date_taken'] = datetime.strptime(
-                                    exif_data['DateTimeOriginal'], '%Y:%m:%d %H:%M:%S'
-                                ).isoformat()
-                            except Exception:
-                                pass
-                        if 'Make' in exif_data:
-                            metadata['camera_make'] = exif_data['Make']
-                        if 'Model' in exif_data:
-                            metadata['camera_model'] = exif_data['Model']
-
-                        # Extract GPS data
-                        gps_data = self._get_gps_data(exif_data)
-                        if gps_data:
-                            metadata['gps'] = gps_data
-
-                except Exception as e:
-                    metadata['exif_error'] = str(e)
-
-            # Use exif library for additional metadata
-            with open(image_path, 'rb') as img_file:
-                exif_image = ExifImage(img_file)
-                if exif_image.has_exif:
-                    if hasattr(exif_image, 'datetime_original'):
-                        metadata['date_taken'] = datetime.strptime(
-                            exif_image.datetime_original,
-                            '%Y:%m:%d %H:%M:%S'
-                        ).isoformat()
-                    if hasattr(exif_image, 'gps_latitude') and hasattr(exif_image, 'gps_longitude'):
-                        metadata['gps'] = {
-                            'latitude': float(exif_image.gps_latitude),
-                            'longitude': float(exif_image.gps_longitude)
-                        }
+        return read_image_metadata(image_path, data)
+
+    async def extract_metadata_async(self, image_path: Path, data: Optional[bytes] = None) -> Dict[str, Any]:
+        """Run ``extract_metadata`` on the shared metadata executor."""
+        loop = asyncio.get_running_loop()
+        with METADATA_SECONDS.time():
+            return await loop.run_in_executor(get_metadata_executor(), read_image_metadata, image_path, data)
+
+    def _record_preprocessing(self, bytes_before: int, bytes_after: int) -> None:
+        with self._stats_lock:
+            self.preprocess_stats["images"] += 1
+            self.preprocess_stats["bytes_before"] += bytes_before
+            self.preprocess_stats["bytes_after"] += bytes_after
+
+    def stats(self) -> Dict[str, Any]:
+        """Preprocessing totals and the share of payload bytes saved."""
+        with self._stats_lock:
+            stats = dict(self.preprocess_stats)
+        before = stats["bytes_before"]
+        stats["bytes_saved_ratio"] = 1 - stats["bytes_after"] / before if before else 0.0
+        return stats
+
+    async def request_content_analysis(self, image_path: Path) -> Dict[str, Any]:
+        """Analyze image content with the configured backend.
+
+        Unlike ``analyze_image_content`` this raises ``AnalysisError`` when no
+        usable result was obtained, so callers can decide whether to retry.
+        A response that arrives but cannot be parsed as JSON is still returned
+        as an ``{"error": ..., "raw_analysis": ...}`` result.
+        """
+        unavailable = self.backend.unavailable_reason()
+        if unavailable:
+            raise AnalysisError(unavailable, retryable=False)
+
+        prepared = await self._prepare(image_path)
+        logger.debug("Analyzing image: %s (%d -> %d bytes)", image_path, prepared.bytes_before, prepared.bytes_after)
+        return await self.backend.run(prepared, image_path)
+
+    @property
+    def batching(self) -> bool:
+        """Whether several images are analyzed per request."""
+        return self.batch_size > 1 and self.backend.supports_batches
+
+    async def request_content_analysis_batch(
+        self,
+        image_paths: List[Path]
+    ) -> List[Union[Dict[str, Any], AnalysisError]]:
+        """Analyze several images, packing up to ``batch_size`` into one request.
+
+        Returns the result or the ``AnalysisError`` of each image, in order.
+        Images left without a valid result by a batched response are analyzed
+        again with single-image requests.
+        """
+        unavailable = self.backend.unavailable_reason()
+        if unavailable:
+            return [AnalysisError(unavailable, retryable=False) for _ in image_paths]
+
+        prepared = await asyncio.gather(*(self._prepare(path) for path in image_paths), return_exceptions=True)
+        outcomes: List[Union[Dict[str, Any], AnalysisError, None]] = [None] * len(image_paths)
+        ready = []
+        for index, item in enumerate(prepared):
+            if isinstance(item, PreparedImage):
+                ready.append(index)
+            else:
+                outcomes[index] = self._as_analysis_error(item)
+
+        async def run_single(index: int) -> None:
+            try:
+                outcomes[index] = await self.backend.run(prepared[index], image_paths[index])
+            except Exception as e:
+                outcomes[index] = self._as_analysis_error(e)
 
-        except Exception as e:
-            metadata['error'] = str(e)
+        async def run_batch(indexes: List[int]) -> None:
+            if len(indexes) == 1:
+                await run_single(indexes[0])
+                return
+            logger.debug("Analyzing %d images in one request", len(indexes))
+            try:
+                results = await self.backend.run_batch(
+                    [prepared[index] for index in indexes],
+                    [image_paths[index] for index in indexes]
+                )
+            except Exception as e:
+                error = self._as_analysis_error(e)
+                for index in indexes:
+                    outcomes[index] = error
+                return
+            retry = []
+            for index, result in zip(indexes, results):
+                if result is None:
+                    retry.append(index)
+                else:
+                    outcomes[index] = result
+            if retry:
+                logger.info("Batched response had no valid result for %d images, analyzing them one by one", len(retry))
+                self.backend.request_stats.batch_fallbacks += len(retry)
+                await asyncio.gather(*(run_single(index) for index in retry))
+
+        if self.batching:
+            await asyncio.gather(*(
+                run_batch(ready[start:start + self.batch_size]) for start in range(0, len(ready), self.batch_size)
+            ))
+        else:
+            await asyncio.gather(*(run_single(index) for index in ready))
+        return outcomes
 
-        return metadata
+    async def _prepare(self, image_path: Path) -> PreparedImage:
+        try:
+            # Downscale and re-encode off the event loop
+            prepared = await asyncio.to_thread(prepare_image_for_analysis, image_path)
+        except OSError as e:
+            raise AnalysisError(f"Error analyzing image: {str(e)}", retryable=False) from e
+        self._record_preprocessing(prepared.bytes_before, prepared.bytes_after)
+        return prepared
+
+    @staticmethod
+    def _as_analysis_error(error: BaseException) -> AnalysisError:
+        if isinstance(error, AnalysisError):
+            return error
+        return AnalysisError(f"Error analyzing image: {str(error)}")
 
     async def analyze_image_content(self, image_path: Path) -> Dict[str, Any]:
-        """Analyze image content using OpenAI's GPT-4 Vision."""
-        if not self.openai_api_key:
-            print("Warning: OpenAI API key not set")
+        """Analyze image content, returning an ``{"error": ...}`` result on failure."""
+        unavailable = self.backend.unavailable_reason()
+        if unavailable:
+            logger.warning("%s", unavailable)
             return {
-                "error": "OpenAI API key not set",
+                "error": unavailable,
                 "description": "Image content analysis is not available"
             }
 
         try:
-            # Read and encode image
-            with open(image_path, "rb") as image_file:
-                base64_image = base64.b64encode(image_file.read()).decode('utf-8')
-
-            print(f"Analyzing image: {image_path}")
-            client = openai.AsyncOpenAI(api_key=self.openai_api_key)
-            try:
-                response = await client.chat.completions.create(
-                    model="gpt-4o",  # Updated model name
-                    messages=[
-                        {
-                            "role": "user",
-                            "content": [
-                                {
-                                    "type": "text",
-                                    "text": "Analyze this image and provide a JSON response with the following structure: { 'description': 'detailed scene description', 'location_type': 'type of location', 'time_and_weather': 'time of day and weather conditions', 'key_elements': ['list', 'of', 'key', 'objects'], 'activities': ['list', 'of', 'activities'] }"
-                                },
-                                {
-                                    "type": "image_url",
-                                    "image_url": {
-                                        "url": f"data:image/jpeg;base64,{base64_image}",
-                                        "detail": "high"
-                                    }
-                                }
-                            ]
-                        }
-                    ],
-                    max_tokens=1000
-                )
-                print(f"OpenAI response received for {image_path}")
-            except Exception as api_error:
-                print(f"OpenAI API error: {str(api_error)}")
-                return {
-                    "error": f"OpenAI API error: {str(api_error)}",
-                    "description": "Failed to analyze image content"
-                }
-
-            # Parse the response content
-            try:
-                content = response.choices[0].message.content
-                print(f"Raw content from OpenAI: {content}")
-                
-                if content is None:
-                    print(f"No content in response for {image_path}")
-                    return {
-                        "error": "No content in response",
-                        "description": "Failed to analyze image content"
-                    }
-                
-                # Clean up the content by removing backticks and 'json' if present
-                cleaned_content = content.strip()
-                if cleaned_content.startswith("```json"):
-                    cleaned_content = cleaned_content[7:]
-                elif cleaned_content.startswith("```"):
-                    cleaned_content = cleaned_content[3:]
-                if cleaned_content.endswith("```"):
-                    cleaned_content = cleaned_content[:-3]
-                cleaned_content = cleaned_content.strip()
-                
-                # Try to parse as JSON
-                try:
-                    parsed_content = json.loads(cleaned_content)
-                    print(f"Successfully parsed JSON for {image_path}: {parsed_content}")
-                    return parsed_content
-                except json.JSONDecodeError as e:
-                    print(f"Failed to parse JSON for {image_path}: {str(e)}")
-                    print(f"Raw content that failed to parse: {content}")
-                    return {
-                        "error": f"Failed to parse response as JSON: {str(e)}",
-                        "raw_analysis": content
-                    }
-            except Exception as e:
-                print(f"Error processing response for {image_path}: {str(e)}")
-                return {
-                    "error": f"Error processing response: {str(e)}",
-                    "description": "Failed to analyze image content"
-                }
-
+            return await self.request_content_analysis(image_path)
+        except AnalysisError as e:
+            return {
+                "error": str(e),
+                "description": "Failed to analyze image content"
+            }
         except Exception as e:
-            print(f"Error analyzing image {image_path}: {str(e)}")
+            record_error("analysis", e)
+            logger.exception("Error analyzing image %s", image_path)
             return {
                 "error": f"Error analyzing image: {str(e)}",
                 "description": "Failed to analyze image content"
@@ -238,10 +178,17 @@ class ImageAnalyzer:
 
     async def analyze_image(self, image_path: Path) -> Dict[str, Any]:
         """Combine metadata extraction and content analysis."""
-        metadata = self.extract_metadata(image_path)
-        content_analysis = await self.analyze_image_content(image_path)
+        # EXIF parsing is blocking file I/O, keep it off the event loop
+        metadata, content_analysis = await asyncio.gather(
+            self.extract_metadata_async(image_path),
+            self.analyze_image_content(image_path),
+        )
         
         return {
             "metadata": metadata,
             "content_analysis": content_analysis
-        } 
\ No newline at end of file
+        }
+
+    async def aclose(self) -> None:
+        """Close the backend's clients."""
+        await self.backend.aclose()
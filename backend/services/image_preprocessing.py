@@ -0,0 +1,112 @@
+"""Prepare images for the vision model.
+
+Originals can be tens of megabytes; the model only needs a bounded-resolution
+copy. Images are orientation-corrected from EXIF, downscaled so their longest
+edge is at most ``ANALYSIS_MAX_EDGE`` and re-encoded in memory.
+"""
+from dataclasses import dataclass
+from io import BytesIO
+from pathlib import Path
+import mimetypes
+import os
+
+from PIL import Image, ImageOps
+
+try:
+    # HEIC/HEIF support is optional
+    from pillow_heif import register_heif_opener
+    register_heif_opener()
+except ImportError:
+    pass
+
+ANALYSIS_MAX_EDGE = max(64, int(os.getenv("ANALYSIS_MAX_EDGE", "1536")))
+ANALYSIS_IMAGE_QUALITY = min(100, max(1, int(os.getenv("ANALYSIS_IMAGE_QUALITY", "85"))))
+ANALYSIS_IMAGE_FORMAT = os.getenv("ANALYSIS_IMAGE_FORMAT", "JPEG").upper()
+
+# Formats the vision API accepts as-is
+PASSTHROUGH_FORMATS = {"JPEG": "image/jpeg", "PNG": "image/png", "WEBP": "image/webp", "GIF": "image/gif"}
+OUTPUT_MIME_TYPES = {"JPEG": "image/jpeg", "WEBP": "image/webp"}
+
+
+@dataclass
+class PreparedImage:
+    data: bytes
+    mime_type: str
+    bytes_before: int
+    bytes_after: int
+    width: int = 0
+    height: int = 0
+
+
+def prepare_image_for_analysis(
+    image_path: Path,
+    max_edge: int = ANALYSIS_MAX_EDGE,
+    quality: int = ANALYSIS_IMAGE_QUALITY,
+    output_format: str = ANALYSIS_IMAGE_FORMAT
+) -> PreparedImage:
+    """Return a downscaled, upright copy of the image, encoded in memory.
+
+    The original bytes are kept when they are already small enough, upright
+    and in a format the API accepts. Files Pillow cannot read are passed
+    through unchanged with a MIME type guessed from the extension.
+    """
+    if output_format not in OUTPUT_MIME_TYPES:
+        output_format = "JPEG"
+
+    with open(image_path, "rb") as image_file:
+        original = image_file.read()
+
+    try:
+        with Image.open(BytesIO(original)) as img:
+            source_format = img.format
+            orientation = img.getexif().get(0x0112, 1)
+            fits = max(img.size) <= max_edge
+
+            if fits and orientation == 1 and source_format in PASSTHROUGH_FORMATS and not getattr(img, "is_animated", False):
+                original_result = PreparedImage(
+                    data=original,
+                    mime_type=PASSTHROUGH_FORMATS[source_format],
+                    bytes_before=len(original),
+                    bytes_after=len(original),
+                    width=img.width,
+                    height=img.height
+                )
+            else:
+                original_result = None
+
+            # Let the JPEG decoder scale by a power of two while decoding
+            img.draft("RGB", (max_edge, max_edge))
+            prepared = ImageOps.exif_transpose(img)
+            prepared.thumbnail((max_edge, max_edge), Image.Resampling.LANCZOS)
+
+            if output_format == "JPEG" and prepared.mode in ("RGBA", "LA", "P"):
+                # JPEG has no alpha channel; flatten onto white
+                rgba = prepared.convert("RGBA")
+                prepared = Image.new("RGB", rgba.size, (255, 255, 255))
+                prepared.paste(rgba, mask=rgba.getchannel("A"))
+            elif prepared.mode not in ("RGB", "RGBA"):
+                prepared = prepared.convert("RGB")
+
+            buffer = BytesIO()
+            prepared.save(buffer, format=output_format, quality=quality)
+            encoded = buffer.getvalue()
+    except Exception:
+        mime_type = mimetypes.guess_type(image_path.name)[0] or "image/jpeg"
+        return PreparedImage(
+            data=original,
+            mime_type=mime_type,
+            bytes_before=len(original),
+            bytes_after=len(original)
+        )
+
+    if original_result is not None and len(original) <= len(encoded):
+        return original_result
+
+    return PreparedImage(
+        data=encoded,
+        mime_type=OUTPUT_MIME_TYPES[output_format],
+        bytes_before=len(original),
+        bytes_after=len(encoded),
+        width=prepared.width,
+        height=prepared.height
+    )
@@ -0,0 +1,216 @@
+"""Background worker pool for queued image content analysis.
+
+Jobs are rows in the ``analysis_jobs`` table, so they survive restarts: a job
+left in ``running`` by a crashed process is returned to ``pending`` once it
+has been running for longer than ``ANALYSIS_JOB_TIMEOUT`` seconds.
+
+Transient failures (timeouts, rate limits, server errors) are retried with
+backoff and never stored on the image. While the backend's circuit is open,
+claimed jobs go back to ``pending`` without using up an attempt.
+"""
+from contextlib import AsyncExitStack
+from pathlib import Path
+from datetime import timedelta
+from typing import List, Optional
+import asyncio
+import logging
+import os
+import random
+
+from database import AsyncSessionLocal
+from services.image_analyzer import ImageAnalyzer, AnalysisError
+from services.analysis_backends import AnalysisDeferred
+from services.analysis_cache import AnalysisCache, metadata_from_image
+from services.near_duplicates import NearDuplicateIndex
+from services.metrics import record_error
+from services.storage import BlobStore, image_file
+import crud
+
+logger = logging.getLogger(__name__)
+
+ANALYSIS_WORKERS = max(1, int(os.getenv("ANALYSIS_WORKERS", "2")))
+ANALYSIS_MAX_ATTEMPTS = max(1, int(os.getenv("ANALYSIS_MAX_ATTEMPTS", "5")))
+ANALYSIS_RETRY_BASE_DELAY = float(os.getenv("ANALYSIS_RETRY_BASE_DELAY", "5"))
+ANALYSIS_RETRY_MAX_DELAY = float(os.getenv("ANALYSIS_RETRY_MAX_DELAY", "300"))
+ANALYSIS_POLL_INTERVAL = float(os.getenv("ANALYSIS_POLL_INTERVAL", "5"))
+ANALYSIS_JOB_TIMEOUT = float(os.getenv("ANALYSIS_JOB_TIMEOUT", "600"))
+ANALYSIS_SHUTDOWN_TIMEOUT = float(os.getenv("ANALYSIS_SHUTDOWN_TIMEOUT", "10"))
+
+
+def retry_delay(attempts: int) -> float:
+    """Exponential backoff with jitter for the given number of attempts made."""
+    delay = min(ANALYSIS_RETRY_MAX_DELAY, ANALYSIS_RETRY_BASE_DELAY * (2 ** max(0, attempts - 1)))
+    return delay * random.uniform(0.5, 1.0)
+
+
+class AnalysisJobQueue:
+    def __init__(
+        self,
+        analyzer: ImageAnalyzer,
+        uploads_dir: Path,
+        storage: BlobStore,
+        cache: Optional[AnalysisCache] = None,
+        workers: int = ANALYSIS_WORKERS,
+        near_duplicates: Optional[NearDuplicateIndex] = None
+    ):
+        self.analyzer = analyzer
+        self.uploads_dir = uploads_dir
+        self.storage = storage
+        self.cache = cache
+        # Answers jobs from near-identical analyzed images when given
+        self.near_duplicates = near_duplicates
+        self.workers = workers
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+        self._tasks: List[asyncio.Task] = []
+
+    async def start(self) -> None:
+        """Recover interrupted jobs and start the worker tasks."""
+        await self._requeue_stale_jobs()
+        # Created here so that it belongs to the running event loop, which is
+        # a new one each time e.g. a test client starts the application
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self) -> None:
+        """Let the workers finish their current job, cancelling them after a timeout.
+
+        Jobs interrupted by the cancellation are recovered on a later start.
+        """
+        self._stopping = True
+        self._wakeup.set()
+        if not self._tasks:
+            return
+        _, pending = await asyncio.wait(self._tasks, timeout=ANALYSIS_SHUTDOWN_TIMEOUT)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        self._tasks = []
+
+    def notify(self) -> None:
+        """Wake idle workers after new jobs were committed."""
+        self._wakeup.set()
+
+    async def _requeue_stale_jobs(self) -> int:
+        async with AsyncSessionLocal() as db:
+            return await crud.requeue_stale_analysis_jobs(db, timedelta(seconds=ANALYSIS_JOB_TIMEOUT))
+
+    async def _worker(self) -> None:
+        while not self._stopping:
+            try:
+                ran_job = await self.run_next_job()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                record_error("worker", e)
+                logger.exception("Analysis worker error")
+                ran_job = False
+
+            if not ran_job and not self._stopping:
+                # Sleep until new work is announced or the poll interval passes,
+                # which also picks up retries that have become due
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=ANALYSIS_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    await self._requeue_stale_jobs()
+                self._wakeup.clear()
+
+    async def run_next_job(self) -> bool:
+        """Claim and run due jobs. Returns False when there was nothing to do.
+
+        With batching enabled on the analyzer a worker claims up to a batch of
+        jobs and analyzes their images together.
+        """
+        async with AsyncSessionLocal() as db:
+            jobs = await crud.claim_analysis_jobs(db, self.analyzer.batch_size if self.analyzer.batching else 1)
+            if not jobs:
+                return False
+
+            remaining = []
+            for job in jobs:
+                content_hash = job.image.content_hash if job.image else None
+                if self.cache and content_hash:
+                    # The same bytes may have been analyzed since this job was queued
+                    cached = await self.cache.get(db, content_hash)
+                    if cached:
+                        await crud.complete_analysis_job(db, job, cached["content_analysis"])
+                        continue
+                perceptual_hash = job.image.perceptual_hash if job.image else None
+                if self.near_duplicates and perceptual_hash is not None:
+                    # E.g. the next shot of a burst whose first frame has been analyzed
+                    similar = await self.near_duplicates.find_analyzed(db, perceptual_hash, exclude_id=job.image_id)
+                    if similar:
+                        await crud.complete_analysis_job(db, job, similar.content_analysis)
+                        continue
+                remaining.append(job)
+            if not remaining:
+                return True
+
+            # Return the connection to the pool while the model is working
+            await db.commit()
+
+            # Downloaded blobs stay in the cache until they have been analyzed
+            async with AsyncExitStack() as files:
+                analyzable = []
+                for job in remaining:
+                    path = await self._image_path(job, files)
+                    if path is None:
+                        await self._finish_job(db, job, AnalysisError("Image no longer exists", retryable=False))
+                    else:
+                        analyzable.append((job, path))
+                if not analyzable:
+                    return True
+
+                if len(analyzable) == 1:
+                    try:
+                        outcomes = [await self.analyzer.request_content_analysis(analyzable[0][1])]
+                    except Exception as e:
+                        outcomes = [e]
+                else:
+                    outcomes = await self.analyzer.request_content_analysis_batch([path for _, path in analyzable])
+
+            deferred = False
+            for (job, _), outcome in zip(analyzable, outcomes):
+                deferred = await self._finish_job(db, job, outcome) or deferred
+            # After a deferral idle until the poll interval rather than deferring every due job in turn
+            return not deferred
+
+    async def _finish_job(self, db, job, outcome) -> bool:
+        """Record the result or error of a job; returns True when it was deferred."""
+        if isinstance(outcome, AnalysisDeferred):
+            await crud.defer_analysis_job(db, job, max(ANALYSIS_POLL_INTERVAL, outcome.retry_after or 0.0), str(outcome))
+            return True
+        if isinstance(outcome, AnalysisError):
+            if outcome.retryable:
+                # Only permanent failures are recorded on the image
+                await crud.fail_analysis_job(
+                    db, job, str(outcome), max(retry_delay(job.attempts), outcome.retry_after or 0.0)
+                )
+            else:
+                await crud.fail_analysis_job(
+                    db,
+                    job,
+                    str(outcome),
+                    None,
+                    {"error": str(outcome), "description": "Failed to analyze image content"}
+                )
+            return False
+        if isinstance(outcome, Exception):
+            record_error("worker", outcome)
+            logger.error("Analysis job %s failed: %s", job.id, outcome)
+            await crud.fail_analysis_job(db, job, f"Error analyzing image: {str(outcome)}", retry_delay(job.attempts))
+            return False
+
+        await crud.complete_analysis_job(db, job, outcome)
+        if self.cache and job.image and job.image.content_hash:
+            self.cache.put(job.image.content_hash, metadata_from_image(job.image), outcome)
+        return False
+
+    async def _image_path(self, job, files: AsyncExitStack) -> Optional[Path]:
+        if job.image is None:
+            return None
+        try:
+            return await files.enter_async_context(image_file(self.storage, self.uploads_dir, job.image))
+        except FileNotFoundError:
+            return None
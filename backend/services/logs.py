@@ -0,0 +1,52 @@
+"""Logging setup shared by the API server and the command-line tools.
+
+``LOG_FORMAT=json`` (the default) writes one JSON object per line with the
+time, level, logger and message, plus any fields passed with ``extra=``;
+``LOG_FORMAT=text`` writes plain lines for development. ``LOG_LEVEL`` sets
+the level of the application's loggers.
+"""
+from datetime import datetime, timezone
+import json
+import logging
+import os
+import sys
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json").lower()
+
+# Attributes every LogRecord has; anything else came from ``extra=``
+_STANDARD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+
+class JSONFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _STANDARD_ATTRIBUTES and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def configure_logging(level: str = LOG_LEVEL, fmt: str = LOG_FORMAT) -> None:
+    """Send log records to stderr in the configured format; safe to call more than once."""
+    handler = logging.StreamHandler(sys.stderr)
+    if fmt == "json":
+        handler.setFormatter(JSONFormatter())
+    else:
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        if getattr(existing, "_photo_logbook", False):
+            root.removeHandler(existing)
+    handler._photo_logbook = True
+    root.addHandler(handler)
+    root.setLevel(level)
+    # Per-request access lines are left to uvicorn's own logger configuration
+    logging.getLogger("httpx").setLevel(max(logging.WARNING, root.level))
@@ -0,0 +1,153 @@
+"""Single-pass image metadata extraction.
+
+The file is opened once and Pillow only parses the headers it needs: image
+size, format and the EXIF block, including the Exif and GPS sub-IFDs. The only
+pixels decoded are those for the perceptual hash, at a reduced scale where
+the format allows it (see ``services/perceptual_hash.py``). The functions here
+are module level so they can run in a process pool as well as a thread pool.
+"""
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime
+from io import BytesIO
+from pathlib import Path
+from typing import Any, Dict, Optional, Union
+import os
+
+from PIL import Image
+from PIL.ExifTags import IFD
+
+from services.perceptual_hash import dhash, to_signed
+
+# "thread" or "process"; a process pool also moves EXIF parsing off the GIL
+METADATA_EXECUTOR = os.getenv("METADATA_EXECUTOR", "thread").lower()
+METADATA_WORKERS = max(1, int(os.getenv("METADATA_WORKERS", str(min(8, os.cpu_count() or 1)))))
+
+TAG_MAKE = 0x010F
+TAG_MODEL = 0x0110
+TAG_DATETIME_ORIGINAL = 0x9003
+GPS_LATITUDE_REF = 1
+GPS_LATITUDE = 2
+GPS_LONGITUDE_REF = 3
+GPS_LONGITUDE = 4
+
+_executor: Optional[Executor] = None
+
+
+def get_metadata_executor() -> Executor:
+    """Shared executor used for metadata extraction."""
+    global _executor
+    if _executor is None:
+        if METADATA_EXECUTOR == "process":
+            _executor = ProcessPoolExecutor(max_workers=METADATA_WORKERS)
+        else:
+            _executor = ThreadPoolExecutor(max_workers=METADATA_WORKERS, thread_name_prefix="metadata")
+    return _executor
+
+
+def _convert_to_degrees(value: tuple) -> float:
+    """Convert a (degrees, minutes, seconds) EXIF rational triple to degrees."""
+    d = float(value[0])
+    m = float(value[1])
+    s = float(value[2])
+    return d + (m / 60.0) + (s / 3600.0)
+
+
+def _clean_string(value: Any) -> Optional[str]:
+    if isinstance(value, bytes):
+        try:
+            value = value.decode()
+        except UnicodeDecodeError:
+            value = value.decode("latin-1")
+    if value is None:
+        return None
+    value = str(value).strip("\x00 ")
+    return value or None
+
+
+def _read_gps(gps_ifd: Dict[int, Any]) -> Optional[Dict[str, float]]:
+    lat_data = gps_ifd.get(GPS_LATITUDE)
+    lon_data = gps_ifd.get(GPS_LONGITUDE)
+    lat_ref = _clean_string(gps_ifd.get(GPS_LATITUDE_REF))
+    lon_ref = _clean_string(gps_ifd.get(GPS_LONGITUDE_REF))
+    if not (lat_data and lon_data and lat_ref and lon_ref):
+        return None
+
+    lat = _convert_to_degrees(lat_data)
+    lon = _convert_to_degrees(lon_data)
+    if lat_ref != 'N':
+        lat = -lat
+    if lon_ref != 'E':
+        lon = -lon
+    return {
+        'latitude': lat,
+        'longitude': lon
+    }
+
+
+def read_image_metadata(image_path: Path, data: Optional[Union[bytes, memoryview]] = None) -> Dict[str, Any]:
+    """Extract size, format, camera, EXIF date/GPS metadata and the perceptual hash of an image.
+
+    When the caller already holds the file's bytes (``data``) they are parsed
+    from memory and the file is not touched at all.
+    """
+    metadata: Dict[str, Any] = {
+        'filename': image_path.name,
+        'file_type': image_path.suffix.lower(),
+    }
+
+    try:
+        if data is not None:
+            metadata['file_size'] = len(data)
+            source = BytesIO(data)
+        else:
+            source = open(image_path, 'rb')
+            metadata['file_size'] = os.fstat(source.fileno()).st_size
+    except OSError as e:
+        metadata['error'] = str(e)
+        return metadata
+
+    try:
+        with source, Image.open(source) as img:
+            metadata.update({
+                'width': img.width,
+                'height': img.height,
+                'format': img.format,
+                'mode': img.mode,
+            })
+
+            try:
+                exif = img.getexif()
+                if exif:
+                    exif_ifd = exif.get_ifd(IFD.Exif)
+                    date_taken = _clean_string(exif_ifd.get(TAG_DATETIME_ORIGINAL) or exif.get(TAG_DATETIME_ORIGINAL))
+                    if date_taken:
+                        try:
+                            metadata['date_taken'] = datetime.strptime(
+                                date_taken, '%Y:%m:%d %H:%M:%S'
+                            ).isoformat()
+                        except ValueError:
+                            pass
+
+                    camera_make = _clean_string(exif.get(TAG_MAKE))
+                    if camera_make:
+                        metadata['camera_make'] = camera_make
+                    camera_model = _clean_string(exif.get(TAG_MODEL))
+                    if camera_model:
+                        metadata['camera_model'] = camera_model
+
+                    gps_data = _read_gps(exif.get_ifd(IFD.GPSInfo))
+                    if gps_data:
+                        metadata['gps'] = gps_data
+            except Exception as e:
+                metadata['exif_error'] = str(e)
+
+            try:
+                # Last, as decoding at a reduced scale changes the image's size
+                metadata['perceptual_hash'] = to_signed(dhash(img))
+            except Exception as e:
+                metadata['perceptual_hash_error'] = str(e)
+
+    except Exception as e:
+        metadata['error'] = str(e)
+
+    return metadata
@@ -0,0 +1,117 @@
+"""Prometheus metrics of the backend, served at ``/metrics``.
+
+Metrics live in the default ``prometheus_client`` registry of the process.
+With several server processes every process reports its own values; scrape
+each one, or run a single process per container.
+
+The request counters and circuit state that analysis backends keep anyway
+(see ``services/resilience.py``) are exported by a collector when scraped,
+rather than being counted twice.
+"""
+from typing import Any, Dict, Iterable
+
+from prometheus_client import Counter, Histogram, REGISTRY
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+# Seconds, from 1 ms to about a minute
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+# Bytes, from 16 KiB to 256 MiB in steps of four
+SIZE_BUCKETS = tuple(16 * 1024 * 4 ** power for power in range(8))
+
+HTTP_REQUEST_SECONDS = Histogram(
+    "photo_logbook_http_request_seconds",
+    "Time to handle an HTTP request, by route template; /upload is the end-to-end upload latency",
+    ["method", "route", "status"],
+    buckets=LATENCY_BUCKETS
+)
+UPLOAD_FILE_BYTES = Histogram(
+    "photo_logbook_upload_file_bytes",
+    "Size of each uploaded file",
+    buckets=SIZE_BUCKETS
+)
+UPLOAD_SAVE_SECONDS = Histogram(
+    "photo_logbook_upload_save_seconds",
+    "Time to stream one uploaded file to disk, including hashing and type checks",
+    buckets=LATENCY_BUCKETS
+)
+METADATA_SECONDS = Histogram(
+    "photo_logbook_metadata_extraction_seconds",
+    "Time to extract the metadata of one image, including waiting for the executor",
+    buckets=LATENCY_BUCKETS
+)
+VISION_SECONDS = Histogram(
+    "photo_logbook_vision_request_seconds",
+    "Latency of one request to the analysis backend, by outcome",
+    ["backend", "kind", "outcome"],
+    buckets=LATENCY_BUCKETS
+)
+DB_COMMIT_SECONDS = Histogram(
+    "photo_logbook_db_commit_seconds",
+    "Time the database takes to commit a transaction",
+    buckets=LATENCY_BUCKETS
+)
+ERRORS = Counter(
+    "photo_logbook_errors_total",
+    "Errors by the stage they happened in and their type",
+    ["stage", "type"]
+)
+
+
+def record_error(stage: str, error: BaseException) -> None:
+    ERRORS.labels(stage=stage, type=type(error).__name__).inc()
+
+
+class AnalysisBackendCollector:
+    """Exports the request stats of the registered analysis backends."""
+
+    def __init__(self):
+        self.backends: Dict[str, Any] = {}
+
+    def collect(self) -> Iterable:
+        counters = {}
+        rate = GaugeMetricFamily(
+            "photo_logbook_analysis_rate_limit_per_second",
+            "Requests per second currently allowed by the backend's rate limiter (0: unlimited)",
+            labels=["backend"]
+        )
+        circuit_open = GaugeMetricFamily(
+            "photo_logbook_analysis_circuit_open",
+            "1 while the backend's circuit breaker is not closed",
+            labels=["backend"]
+        )
+        open_seconds = CounterMetricFamily(
+            "photo_logbook_analysis_circuit_open_seconds",
+            "Total time the backend's circuit breaker has not been closed",
+            labels=["backend"]
+        )
+        throttle_wait = CounterMetricFamily(
+            "photo_logbook_analysis_throttle_wait_seconds",
+            "Total time requests waited for the backend's rate limiter",
+            labels=["backend"]
+        )
+        for backend in self.backends.values():
+            stats = backend.stats()
+            labels = [backend.name]
+            for name in backend.request_stats.COUNTERS:
+                if name not in counters:
+                    counters[name] = CounterMetricFamily(
+                        f"photo_logbook_analysis_{name}",
+                        f"Analysis backend counter: {name.replace('_', ' ')}",
+                        labels=["backend"]
+                    )
+                counters[name].add_metric(labels, stats[name])
+            rate.add_metric(labels, stats["rate_limit_per_second"])
+            circuit_open.add_metric(labels, 0 if stats["circuit_state"] == "closed" else 1)
+            open_seconds.add_metric(labels, stats["circuit_open_seconds"])
+            throttle_wait.add_metric(labels, stats["throttle_wait_seconds"])
+        yield from counters.values()
+        yield from (rate, circuit_open, open_seconds, throttle_wait)
+
+
+_analysis_backends = AnalysisBackendCollector()
+REGISTRY.register(_analysis_backends)
+
+
+def register_analysis_backend(backend) -> None:
+    """Export the request stats of ``backend`` at ``/metrics``, replacing one of the same name."""
+    _analysis_backends.backends[backend.name] = backend
@@ -0,0 +1,150 @@
+"""Near-duplicate lookup over the perceptual hashes of stored images.
+
+``NearDuplicateIndex`` keeps the hash of every image in a ``MultiIndexHash``.
+It is filled from the ``images`` table on first use and afterwards only reads
+the rows added since, so images stored by other processes are found as well.
+Hashes written to existing rows later, e.g. by a backfill, are picked up on
+the next restart. Hashes of featureless images (see ``is_informative``) are
+left out: they would match every other plain colour or clear sky.
+
+The index serves two purposes: listing clusters of near-identical images
+(re-encoded or slightly edited copies, burst shots) and, with
+``NEAR_DUPLICATE_REUSE``, answering content analysis from an already analyzed
+image whose hash is at most ``NEAR_DUPLICATE_REUSE_DISTANCE`` bits away
+instead of sending another request to the vision model.
+"""
+from collections import defaultdict
+from typing import Dict, List, Optional, Sequence, Tuple
+import asyncio
+import os
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models import Image
+from services.perceptual_hash import MultiIndexHash, is_informative
+import crud
+
+# Hashes at most this many bits apart (of 64) count as near duplicates
+NEAR_DUPLICATE_DISTANCE = int(os.getenv("NEAR_DUPLICATE_DISTANCE", "6"))
+# Reuse the analysis of a near-identical image rather than calling the model
+NEAR_DUPLICATE_REUSE = os.getenv("NEAR_DUPLICATE_REUSE", "false").lower() in ("1", "true", "yes")
+NEAR_DUPLICATE_REUSE_DISTANCE = int(os.getenv("NEAR_DUPLICATE_REUSE_DISTANCE", "2"))
+# Near duplicates from one camera taken within this many seconds are a burst
+BURST_SECONDS = float(os.getenv("BURST_SECONDS", "10"))
+
+REFRESH_CHUNK_SIZE = 10000
+
+
+def is_burst(images: Sequence[Image]) -> bool:
+    """Whether the images were shot in quick succession with the same camera."""
+    if any(image.date_taken is None for image in images):
+        return False
+    if len({(image.camera_make, image.camera_model) for image in images}) > 1:
+        return False
+    taken = [image.date_taken for image in images]
+    return (max(taken) - min(taken)).total_seconds() <= BURST_SECONDS
+
+
+def has_reusable_analysis(image: Image) -> bool:
+    return (
+        image.analysis_status == "completed"
+        and bool(image.content_analysis)
+        and "error" not in image.content_analysis
+    )
+
+
+class NearDuplicateIndex:
+    def __init__(self):
+        self.hashes = MultiIndexHash()
+        self.groups: Dict[int, int] = {}
+        self.reused = 0
+        self.uninformative = 0
+        self._last_id = 0
+        self._lock = asyncio.Lock()
+
+    async def refresh(self, db: AsyncSession) -> None:
+        """Add the images stored since the last refresh."""
+        async with self._lock:
+            while True:
+                rows = await crud.get_perceptual_hashes(db, self._last_id, REFRESH_CHUNK_SIZE)
+                for image_id, group_id, perceptual_hash in rows:
+                    self.add(image_id, group_id, perceptual_hash)
+                if rows:
+                    self._last_id = rows[-1][0]
+                if len(rows) < REFRESH_CHUNK_SIZE:
+                    return
+
+    def add(self, image_id: int, group_id: int, perceptual_hash: int) -> None:
+        if not is_informative(perceptual_hash):
+            self.uninformative += 1
+            return
+        self.hashes.add(image_id, perceptual_hash)
+        self.groups[image_id] = group_id
+
+    async def find(self, db: AsyncSession, perceptual_hash: int, distance: int) -> List[Tuple[int, int]]:
+        """``(distance, image_id)`` of the stored images within ``distance`` bits, closest first."""
+        await self.refresh(db)
+        return self.hashes.search(perceptual_hash, distance)
+
+    async def find_analyzed(
+        self,
+        db: AsyncSession,
+        perceptual_hash: int,
+        exclude_id: Optional[int] = None,
+        distance: int = NEAR_DUPLICATE_REUSE_DISTANCE
+    ) -> Optional[Image]:
+        """The closest successfully analyzed image within ``distance`` bits, if any."""
+        if not is_informative(perceptual_hash):
+            return None
+        matches = [image_id for _, image_id in await self.find(db, perceptual_hash, distance) if image_id != exclude_id]
+        # A handful is enough: the closest ones are usually analyzed
+        for image in await crud.get_images_by_ids(db, matches[:20]):
+            if has_reusable_analysis(image):
+                self.reused += 1
+                return image
+        return None
+
+    async def clusters(
+        self,
+        db: AsyncSession,
+        group_id: Optional[int] = None,
+        distance: int = NEAR_DUPLICATE_DISTANCE
+    ) -> List[List[int]]:
+        """Image IDs linked by hashes at most ``distance`` apart, largest cluster first.
+
+        Images are linked in chains (single linkage), so two members of a
+        cluster can be further apart than ``distance``. With ``group_id``
+        only that group's images are considered.
+        """
+        await self.refresh(db)
+        members = [
+            image_id for image_id, image_group in self.groups.items()
+            if group_id is None or image_group == group_id
+        ]
+        # A library-wide search compares every image, keep it off the event loop
+        return await asyncio.to_thread(self._clusters, members, distance)
+
+    def _clusters(self, members: List[int], distance: int) -> List[List[int]]:
+        parent = {image_id: image_id for image_id in members}
+
+        def root(image_id: int) -> int:
+            while parent[image_id] != image_id:
+                parent[image_id] = parent[parent[image_id]]
+                image_id = parent[image_id]
+            return image_id
+
+        for image_id in members:
+            for _, other in self.hashes.search(self.hashes.hashes[image_id], distance):
+                if other != image_id and other in parent:
+                    parent[root(other)] = root(image_id)
+
+        clusters: Dict[int, List[int]] = defaultdict(list)
+        for image_id in members:
+            clusters[root(image_id)].append(image_id)
+        return sorted(
+            (sorted(cluster) for cluster in clusters.values() if len(cluster) > 1),
+            key=lambda cluster: (-len(cluster), cluster[0])
+        )
+
+    def stats(self) -> Dict[str, int]:
+        return {"images": len(self.hashes), "reused": self.reused, "uninformative": self.uninformative}
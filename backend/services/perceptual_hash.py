@@ -0,0 +1,133 @@
+"""Perceptual image hashes and a Hamming-distance index over them.
+
+``dhash`` is the difference hash: the image is reduced to 9x8 grey pixels and
+each of the 64 bits tells whether a pixel is darker than its right neighbour.
+Re-encoding, resizing and small edits change few bits, so near-identical
+images are those whose hashes differ in few bits (their Hamming distance).
+Images without texture (a plain colour, a clear sky) hash to nearly all zero
+or all one bits whatever they show, since colour is not part of the hash;
+``is_informative`` tells them apart, and such hashes must not be matched.
+
+``MultiIndexHash`` finds the hashes within a distance of a query without
+comparing it to every stored hash (multi-index hashing): hashes are split into
+four 16-bit chunks with one table each. Two hashes at most ``r`` bits apart
+have at least one chunk that differs in at most ``r // 4`` bits, so only the
+table entries that close to one of the query's chunks need to be compared.
+"""
+from collections import defaultdict
+from itertools import combinations
+from typing import Dict, Iterable, List, Set, Tuple
+
+from PIL import Image
+
+HASH_BITS = 64
+CHUNKS = 4
+CHUNK_BITS = HASH_BITS // CHUNKS
+CHUNK_MASK = (1 << CHUNK_BITS) - 1
+# Searches further apart enumerate too many chunk values to beat a scan
+MAX_SEARCH_DISTANCE = 15
+# Hashes with fewer set (or unset) bits than this come from featureless images
+MIN_INFORMATIVE_BITS = 5
+
+
+def dhash(image: Image.Image) -> int:
+    """64-bit difference hash of an image.
+
+    For JPEG the image is decoded at a reduced scale, which is much cheaper
+    than decoding it in full. The image object is changed by this and should
+    not be used afterwards.
+    """
+    image.draft("L", (64, 64))
+    small = image.convert("L").resize((9, 8), Image.Resampling.BILINEAR, reducing_gap=2.0)
+    pixels = small.tobytes()
+    value = 0
+    for row in range(8):
+        for column in range(8):
+            left = pixels[row * 9 + column]
+            value = (value << 1) | (left > pixels[row * 9 + column + 1])
+    return value
+
+
+def is_informative(value: int) -> bool:
+    """Whether a hash describes the image's structure rather than the lack of it."""
+    bits = bin(from_signed(value)).count("1")
+    return MIN_INFORMATIVE_BITS <= bits <= HASH_BITS - MIN_INFORMATIVE_BITS
+
+
+def to_signed(value: int) -> int:
+    """The 64-bit hash as a signed integer, the range of a BIGINT column."""
+    return value - (1 << HASH_BITS) if value >= 1 << (HASH_BITS - 1) else value
+
+
+def from_signed(value: int) -> int:
+    return value & ((1 << HASH_BITS) - 1)
+
+
+def hamming_distance(a: int, b: int) -> int:
+    return bin(from_signed(a) ^ from_signed(b)).count("1")
+
+
+def _flip_masks(distance: int) -> List[int]:
+    """Every 16-bit mask with at most ``distance`` bits set."""
+    masks = [0]
+    for bits in range(1, distance + 1):
+        masks.extend(sum(1 << bit for bit in chosen) for chosen in combinations(range(CHUNK_BITS), bits))
+    return masks
+
+
+class MultiIndexHash:
+    """Index of 64-bit hashes by key, searchable by Hamming distance."""
+
+    def __init__(self):
+        self.hashes: Dict[int, int] = {}
+        self._tables: List[Dict[int, List[int]]] = [defaultdict(list) for _ in range(CHUNKS)]
+        self._masks: Dict[int, List[int]] = {}
+
+    def __len__(self) -> int:
+        return len(self.hashes)
+
+    @staticmethod
+    def _chunks(value: int) -> Iterable[Tuple[int, int]]:
+        for index in range(CHUNKS):
+            yield index, (value >> (index * CHUNK_BITS)) & CHUNK_MASK
+
+    def add(self, key: int, value: int) -> None:
+        value = from_signed(value)
+        if key in self.hashes:
+            self.remove(key)
+        self.hashes[key] = value
+        for index, chunk in self._chunks(value):
+            self._tables[index][chunk].append(key)
+
+    def remove(self, key: int) -> None:
+        value = self.hashes.pop(key, None)
+        if value is None:
+            return
+        for index, chunk in self._chunks(value):
+            bucket = self._tables[index][chunk]
+            bucket.remove(key)
+            if not bucket:
+                del self._tables[index][chunk]
+
+    def search(self, value: int, distance: int) -> List[Tuple[int, int]]:
+        """``(distance, key)`` of every stored hash within ``distance`` bits, closest first."""
+        if not 0 <= distance <= MAX_SEARCH_DISTANCE:
+            raise ValueError(f"distance must be between 0 and {MAX_SEARCH_DISTANCE}")
+        value = from_signed(value)
+        masks = self._masks.get(distance // CHUNKS)
+        if masks is None:
+            masks = self._masks[distance // CHUNKS] = _flip_masks(distance // CHUNKS)
+        seen: Set[int] = set()
+        matches = []
+        for index, chunk in self._chunks(value):
+            table = self._tables[index]
+            for mask in masks:
+                for key in table.get(chunk ^ mask, ()):
+                    if key in seen:
+                        continue
+                    seen.add(key)
+                    found = bin(value ^ self.hashes[key]).count("1")
+                    if found <= distance:
+                        matches.append((found, key))
+        matches.sort()
+        return matches
@@ -0,0 +1,210 @@
+"""Rate limiting, backoff and circuit breaking for calls to an analysis backend.
+
+The state here is plain Python without asyncio primitives: updates happen
+between awaits, so one instance can be shared by every event loop and task of
+the process.
+"""
+from typing import Any, Dict, Mapping, Optional
+import random
+import re
+import time
+
+_DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+_DURATION_UNITS = {"h": 3600.0, "m": 60.0, "s": 1.0, "ms": 0.001}
+
+
+def parse_duration(value: Optional[str]) -> Optional[float]:
+    """Seconds in a rate limit reset header such as ``"1s"``, ``"6m0s"`` or ``"120ms"``."""
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = _DURATION_PART.findall(value)
+    if not parts:
+        return None
+    return sum(float(number) * _DURATION_UNITS[unit] for number, unit in parts)
+
+
+def retry_after(headers: Optional[Mapping[str, str]]) -> Optional[float]:
+    """Delay requested by a ``retry-after-ms`` or ``retry-after`` header, in seconds."""
+    if not headers:
+        return None
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except ValueError:
+        return None
+    return None
+
+
+def backoff_delay(attempt: int, base: float, maximum: float) -> float:
+    """Exponential backoff with full jitter for the ``attempt``-th retry (1-based)."""
+    return random.uniform(0, min(maximum, base * (2 ** max(0, attempt - 1))))
+
+
+class TokenBucket:
+    """Token bucket limiting how many requests start per second.
+
+    ``rate`` tokens are added per second, up to ``capacity``; a rate of 0
+    disables the limit. Requests that find the bucket empty reserve a future
+    token and sleep until it is due. ``update_from_headers`` retunes the rate
+    from the limits a server reports, and ``pause`` holds all requests back,
+    e.g. for the ``retry-after`` of a 429 response.
+    """
+
+    def __init__(self, rate: float = 0.0, capacity: Optional[float] = None):
+        self.rate = max(0.0, rate)
+        self.capacity = capacity if capacity is not None else max(1.0, self.rate)
+        self.tokens = self.capacity
+        self.paused_until = 0.0
+        self._updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        if self.rate:
+            self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self) -> float:
+        """Take a token; returns how long to wait before using it."""
+        now = time.monotonic()
+        self._refill(now)
+        wait = max(0.0, self.paused_until - now)
+        if self.rate:
+            self.tokens -= 1
+            if self.tokens < 0:
+                wait = max(wait, -self.tokens / self.rate)
+        return wait
+
+    def pause(self, seconds: float) -> None:
+        """Hold back every request for ``seconds``."""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def update_from_headers(self, headers: Mapping[str, str]) -> None:
+        """Adopt the request limit reported in ``x-ratelimit-*`` response headers.
+
+        The limit is per minute; the bucket refills at the matching rate and
+        never holds more tokens than requests remain. When requests or tokens
+        are used up, requests pause until the reported reset.
+        """
+        now = time.monotonic()
+        self._refill(now)
+        try:
+            limit = headers.get("x-ratelimit-limit-requests")
+            if limit:
+                unlimited = not self.rate
+                self.rate = float(limit) / 60
+                self.capacity = max(1.0, self.rate)
+                if unlimited:
+                    # The first limit seen; start with a full bucket
+                    self.tokens = self.capacity
+            remaining = headers.get("x-ratelimit-remaining-requests")
+            if remaining is not None:
+                self.tokens = min(self.tokens, float(remaining))
+        except ValueError:
+            return
+        for kind in ("requests", "tokens"):
+            if headers.get(f"x-ratelimit-remaining-{kind}") == "0":
+                reset = parse_duration(headers.get(f"x-ratelimit-reset-{kind}"))
+                if reset:
+                    self.pause(reset)
+
+
+class CircuitBreaker:
+    """Stops calls to a failing backend for a while.
+
+    After ``failure_threshold`` consecutive failures the circuit opens and
+    ``allow`` refuses calls for ``reset_timeout`` seconds. Then one trial call
+    is let through (half-open): its success closes the circuit, its failure
+    opens it again. Every call that ``allow`` lets through must end in
+    ``record_success``, ``record_failure`` or ``release_trial``.
+    """
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened = 0
+        self._opened_at = 0.0
+        self._open_seconds = 0.0
+        self._trial_running = False
+
+    def allow(self) -> bool:
+        """Whether a call may go ahead now."""
+        if self.state == "closed":
+            return True
+        if self.state == "open" and time.monotonic() - self._opened_at >= self.reset_timeout:
+            self.state = "half_open"
+        if self.state == "half_open" and not self._trial_running:
+            self._trial_running = True
+            return True
+        return False
+
+    def retry_after(self) -> float:
+        """Seconds until the circuit lets a trial call through."""
+        if self.state == "closed":
+            return 0.0
+        return max(0.0, self._opened_at + self.reset_timeout - time.monotonic())
+
+    def record_success(self) -> None:
+        if self.state != "closed":
+            self._open_seconds += time.monotonic() - self._opened_at
+        self.state = "closed"
+        self.failures = 0
+        self._trial_running = False
+
+    def release_trial(self) -> None:
+        """End a call that neither succeeded nor failed, e.g. one that was cancelled.
+
+        The state is kept; in half-open the next call becomes the trial.
+        """
+        self._trial_running = False
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self.state == "half_open" or (self.state == "closed" and self.failures >= self.failure_threshold):
+            if self.state == "closed":
+                self.opened += 1
+                self._opened_at = time.monotonic()
+            else:
+                # A failed trial restarts the wait, but the outage continues
+                self._open_seconds += time.monotonic() - self._opened_at
+                self._opened_at = time.monotonic()
+            self.state = "open"
+        self._trial_running = False
+
+    def open_seconds(self) -> float:
+        """Total time the circuit has not been closed, including a current outage."""
+        current = time.monotonic() - self._opened_at if self.state != "closed" else 0.0
+        return self._open_seconds + current
+
+
+class RequestStats:
+    """Counters of the requests made to a backend."""
+
+    COUNTERS = (
+        "requests", "succeeded", "failed", "retries", "throttled", "timeouts", "shed",
+        "batches", "batched_images", "batch_fallbacks",
+        "parse_repaired", "parse_repair_requests", "parse_failures",
+    )
+
+    def __init__(self):
+        for name in self.COUNTERS:
+            setattr(self, name, 0)
+        self.throttle_wait_seconds = 0.0
+
+    def snapshot(self, bucket: TokenBucket, breaker: CircuitBreaker) -> Dict[str, Any]:
+        stats: Dict[str, Any] = {name: getattr(self, name) for name in self.COUNTERS}
+        stats.update({
+            "throttle_wait_seconds": round(self.throttle_wait_seconds, 3),
+            "rate_limit_per_second": bucket.rate,
+            "circuit_state": breaker.state,
+            "circuit_opened": breaker.opened,
+            "circuit_open_seconds": round(breaker.open_seconds(), 3),
+        })
+        return stats
@@ -0,0 +1,244 @@
+"""Resumable uploads of large batches, following the tus protocol (tus.io).
+
+A client opens an upload session, which creates the group, then registers
+each file with its length and sends its bytes in any number of PATCH
+requests, each starting at the offset the server has recorded. After a
+dropped connection a HEAD request tells it where to continue. Every file is
+stored and queued for analysis as soon as its last byte arrives, exactly like
+a file of ``POST /upload``; finalizing the session closes it to new files.
+
+Received bytes are appended to a partial file in the blob store's staging
+directory, and the offset is committed after every request, including one
+cut short by a disconnect, so uploads resume across restarts too. A session
+expires ``UPLOAD_SESSION_TTL`` seconds after its last request;
+``ResumableUploads`` then deletes it, its partial files and, if it was never
+finalized and stored nothing, its group.
+"""
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+from pathlib import Path
+from typing import AsyncIterator, Dict, Optional
+import asyncio
+import base64
+import binascii
+import hashlib
+import logging
+import os
+import secrets
+import time
+
+from starlette.requests import ClientDisconnect
+
+from database import AsyncSessionLocal
+from services.metrics import record_error
+from services.uploads import SNIFF_LENGTH, UPLOAD_CHUNK_SIZE, SavedUpload, UploadRejected, sniff_image_type
+import crud
+
+logger = logging.getLogger(__name__)
+
+UPLOAD_SESSION_TTL = float(os.getenv("UPLOAD_SESSION_TTL", str(24 * 3600)))
+UPLOAD_SESSION_CLEANUP_INTERVAL = float(os.getenv("UPLOAD_SESSION_CLEANUP_INTERVAL", "600"))
+
+TUS_VERSION = "1.0.0"
+TUS_EXTENSIONS = "creation,expiration,termination"
+# Content type of PATCH request bodies
+OFFSET_CONTENT_TYPE = "application/offset+octet-stream"
+
+PARTIAL_PREFIX = ".resumable-"
+# Staged files of POST /upload requests, left behind only if the process died
+STAGED_UPLOAD_PATTERN = ".upload-*.part"
+
+
+def new_id() -> str:
+    """Unguessable ID of a session or file; the URLs built from it are the only credential."""
+    return secrets.token_hex(16)
+
+
+def session_expiry() -> datetime:
+    return datetime.utcnow() + timedelta(seconds=UPLOAD_SESSION_TTL)
+
+
+def http_date(moment: datetime) -> str:
+    """A naive UTC datetime in the format of the ``Upload-Expires`` header."""
+    return format_datetime(moment.replace(tzinfo=timezone.utc), usegmt=True)
+
+
+def parse_upload_metadata(header: str) -> Dict[str, str]:
+    """Decode an ``Upload-Metadata`` header: comma separated keys with base64 encoded values.
+
+    Raises ``ValueError`` for a malformed header.
+    """
+    metadata = {}
+    for pair in filter(None, (item.strip() for item in header.split(","))):
+        key, _, value = pair.partition(" ")
+        try:
+            metadata[key] = base64.b64decode(value.strip(), validate=True).decode()
+        except (binascii.Error, UnicodeDecodeError) as e:
+            raise ValueError(f"Invalid Upload-Metadata value for {key}") from e
+    return metadata
+
+
+def _write(path: Path, offset: int, chunks: list) -> None:
+    with open(path, "r+b") as handle:
+        handle.seek(offset)
+        for chunk in chunks:
+            handle.write(chunk)
+
+
+def _read_header(path: Path) -> bytes:
+    with open(path, "rb") as handle:
+        return handle.read(SNIFF_LENGTH)
+
+
+async def receive_chunks(
+    chunks: AsyncIterator[bytes],
+    path: Path,
+    offset: int,
+    length: int,
+    filename: str
+) -> int:
+    """Write a PATCH body to the partial file at ``offset``; returns the offset reached.
+
+    A dropped connection ends the body early, and the bytes that did arrive
+    count. Raises ``UploadRejected`` when the body goes past the declared
+    length or the first bytes are not an image.
+    """
+    # Bytes past the recorded offset are from a request that was never counted
+    await asyncio.to_thread(os.truncate, path, offset)
+    header = await asyncio.to_thread(_read_header, path) if 0 < offset < SNIFF_LENGTH else b""
+    sniffed = offset >= SNIFF_LENGTH
+    pending, pending_size = [], 0
+    try:
+        async for chunk in chunks:
+            if offset + pending_size + len(chunk) > length:
+                raise UploadRejected(f"{filename} is longer than its declared length of {length} bytes")
+            if not sniffed:
+                header += chunk[:SNIFF_LENGTH - len(header)]
+                if len(header) >= min(SNIFF_LENGTH, length):
+                    if sniff_image_type(header) is None:
+                        raise UploadRejected(f"{filename} is not an image file")
+                    sniffed = True
+            pending.append(chunk)
+            pending_size += len(chunk)
+            # The server hands over small pieces; write them to disk in larger ones
+            if pending_size >= UPLOAD_CHUNK_SIZE:
+                await asyncio.to_thread(_write, path, offset, pending)
+                offset += pending_size
+                pending, pending_size = [], 0
+    except ClientDisconnect:
+        pass
+    if pending:
+        await asyncio.to_thread(_write, path, offset, pending)
+        offset += pending_size
+    return offset
+
+
+def staged_upload(path: Path, filename: str) -> SavedUpload:
+    """Describe a completely received partial file like ``save_upload_stream`` describes its output."""
+    digest = hashlib.sha256()
+    size = 0
+    with open(path, "rb") as handle:
+        first_chunk = handle.read(UPLOAD_CHUNK_SIZE)
+        chunk = first_chunk
+        while chunk:
+            digest.update(chunk)
+            size += len(chunk)
+            chunk = handle.read(UPLOAD_CHUNK_SIZE)
+    content_type = sniff_image_type(first_chunk[:SNIFF_LENGTH])
+    if content_type is None:
+        raise UploadRejected(f"{filename} is not an image file")
+    return SavedUpload(
+        path=path,
+        filename=filename,
+        size=size,
+        content_hash=digest.hexdigest(),
+        content_type=content_type,
+        data=first_chunk if len(first_chunk) == size else None
+    )
+
+
+class ResumableUploads:
+    """Partial files of the open sessions, and the task that removes expired ones."""
+
+    def __init__(self, staging_dir: Path):
+        self.staging_dir = staging_dir
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def partial_path(self, upload_id: str) -> Path:
+        return self.staging_dir / f"{PARTIAL_PREFIX}{upload_id}.part"
+
+    def create_partial(self, upload_id: str) -> None:
+        self.partial_path(upload_id).touch()
+
+    def remove_partial(self, upload_id: str) -> None:
+        self.partial_path(upload_id).unlink(missing_ok=True)
+        self._locks.pop(upload_id, None)
+
+    def lock(self, key: str) -> asyncio.Lock:
+        """Lock serialising the requests of one file or session within this process.
+
+        Offsets are also advanced with a conditional UPDATE, so requests
+        handled by different processes cannot both count the same range.
+        """
+        return self._locks.setdefault(key, asyncio.Lock())
+
+    async def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.cleanup()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                record_error("upload_cleanup", e)
+                logger.exception("Upload session cleanup failed")
+            await asyncio.sleep(UPLOAD_SESSION_CLEANUP_INTERVAL)
+
+    async def cleanup(self) -> Dict[str, int]:
+        """Delete expired sessions and partial files that no open session refers to."""
+        counts = {"sessions": 0, "groups": 0, "partial_files": 0}
+        async with AsyncSessionLocal() as db:
+            sessions = await crud.get_expired_upload_sessions(db, datetime.utcnow())
+            if sessions:
+                for session in sessions:
+                    for upload in session.uploads:
+                        self.remove_partial(upload.id)
+                    self._locks.pop(session.id, None)
+                counts["groups"] = await crud.delete_upload_sessions(db, sessions)
+                counts["sessions"] = len(sessions)
+
+            # Left behind by a crash between creating a file and committing its row,
+            # or by an interrupted POST /upload
+            cutoff = time.time() - UPLOAD_SESSION_TTL
+            stale = [
+                path
+                for pattern in (f"{PARTIAL_PREFIX}*.part", STAGED_UPLOAD_PATTERN)
+                for path in self.staging_dir.glob(pattern)
+                if path.stat().st_mtime < cutoff
+            ]
+            partial_ids = {
+                path: path.name[len(PARTIAL_PREFIX):-len(".part")]
+                for path in stale
+                if path.name.startswith(PARTIAL_PREFIX)
+            }
+            known = await crud.get_resumable_upload_ids(db, list(partial_ids.values()))
+            for path in stale:
+                if partial_ids.get(path) in known:
+                    continue
+                path.unlink(missing_ok=True)
+                counts["partial_files"] += 1
+
+        if any(counts.values()):
+            logger.info("Removed %(sessions)d expired upload sessions, %(groups)d empty groups "
+                        "and %(partial_files)d abandoned partial files", counts)
+        return counts
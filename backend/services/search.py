@@ -0,0 +1,127 @@
+"""Full-text search over the content analysis of images.
+
+The model's ``description``, ``key_elements``, ``activities``,
+``location_type`` and ``time_and_weather`` are indexed by the database
+itself: a weighted ``tsvector`` with a GIN index on Postgres, an FTS5 table on
+SQLite. Triggers on ``images`` keep the index current whenever an analysis is
+stored (see the ``c4e19b7d2a60`` migration), so nothing here writes to it.
+
+Results are ranked with ``ts_rank_cd`` or FTS5's BM25 and paginated with a
+``(score, image_id)`` keyset, where a higher score is a better match. Scoring
+every match of a very common word is what makes full-text search slow on a
+large library, so only the ``SEARCH_MAX_CANDIDATES`` newest matches are
+ranked; ``truncated`` tells callers when older matches were left out.
+"""
+from typing import List, Optional, Tuple
+import os
+import re
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+# Text search configuration of the Postgres index; must match the migration
+SEARCH_TEXT_CONFIG = "english"
+SEARCH_MAX_CANDIDATES = max(1, int(os.getenv("SEARCH_MAX_CANDIDATES", "10000")))
+
+_TOKEN = re.compile(r"\w+", re.UNICODE)
+
+
+class SearchUnavailable(Exception):
+    """The database has no full-text index, e.g. its migrations have not been run."""
+
+
+def fts5_query(query: str) -> Optional[str]:
+    """Turn free text into an FTS5 query matching all of its words.
+
+    Every word is quoted, so FTS5 operators and punctuation in user input are
+    taken literally. The last word also matches as a prefix, for search as
+    you type. Returns None when the text has no words.
+    """
+    tokens = _TOKEN.findall(query)
+    if not tokens:
+        return None
+    terms = [f'"{token}"' for token in tokens]
+    terms[-1] += "*"
+    return " ".join(terms)
+
+
+_POSTGRES_MATCHES = f"""
+    SELECT image_id, ts_rank_cd(document, websearch_to_tsquery('{SEARCH_TEXT_CONFIG}', :query)) AS score
+    FROM (
+        SELECT image_id, document
+        FROM image_search_index
+        WHERE document @@ websearch_to_tsquery('{SEARCH_TEXT_CONFIG}', :query)
+        ORDER BY image_id DESC
+        LIMIT :candidates
+    ) AS candidates
+"""
+
+# FTS5's rank is BM25 with the field weights set by the migration; lower is
+# better. It is only computed for the rows the LIMIT lets through.
+_SQLITE_MATCHES = """
+    SELECT rowid AS image_id, -rank AS score
+    FROM image_search_fts
+    WHERE image_search_fts MATCH :query
+    ORDER BY rowid DESC
+    LIMIT :candidates
+"""
+
+
+# Whether there are matches past the candidates, without ranking any of them
+_POSTGRES_TRUNCATED = f"""
+    SELECT 1 FROM image_search_index
+    WHERE document @@ websearch_to_tsquery('{SEARCH_TEXT_CONFIG}', :query)
+    LIMIT 1 OFFSET :candidates
+"""
+
+_SQLITE_TRUNCATED = """
+    SELECT 1 FROM image_search_fts
+    WHERE image_search_fts MATCH :query
+    LIMIT 1 OFFSET :candidates
+"""
+
+
+def _search_statement(matches: str, paginated: bool):
+    keyset = "WHERE score < :after_score OR (score = :after_score AND image_id > :after_id)" if paginated else ""
+    return text(f"""
+        SELECT image_id, score FROM ({matches}) AS matches
+        {keyset}
+        ORDER BY score DESC, image_id
+        LIMIT :limit
+    """)
+
+
+async def search_image_ids(
+    db: AsyncSession,
+    query: str,
+    limit: int,
+    after: Optional[Tuple[float, int]] = None
+) -> Tuple[List[Tuple[int, float]], bool]:
+    """IDs and scores of the images best matching ``query``, best first.
+
+    ``after`` is the ``(score, image_id)`` of the last result of the previous
+    page. Also returns whether more than ``SEARCH_MAX_CANDIDATES`` images
+    match, in which case the older ones are not among the results. Raises
+    ``SearchUnavailable`` when the index does not exist.
+    """
+    dialect = db.bind.dialect.name
+    if dialect == "postgresql":
+        matches, truncated, match = _POSTGRES_MATCHES, _POSTGRES_TRUNCATED, query
+    elif dialect == "sqlite":
+        matches, truncated, match = _SQLITE_MATCHES, _SQLITE_TRUNCATED, fts5_query(query)
+        if match is None:
+            return [], False
+    else:
+        raise SearchUnavailable(f"Full-text search is not supported on {dialect}")
+
+    parameters = {"query": match, "limit": limit, "candidates": SEARCH_MAX_CANDIDATES}
+    if after is not None:
+        parameters["after_score"], parameters["after_id"] = after
+    try:
+        rows = await db.execute(_search_statement(matches, after is not None), parameters)
+        more = await db.execute(text(truncated), {"query": match, "candidates": SEARCH_MAX_CANDIDATES})
+    except Exception as e:
+        if "image_search" in str(getattr(e, "orig", None) or e):
+            raise SearchUnavailable("The search index is missing; run the database migrations") from e
+        raise
+    return [(image_id, score) for image_id, score in rows], more.first() is not None
@@ -0,0 +1,453 @@
+"""Content-addressed storage of uploaded files.
+
+Every file is stored once under a key derived from its SHA-256,
+``ab/cd/abcd…<64 hex digits>.jpg``: the first two pairs of hex digits fan
+the files out over 65,536 directories (or key prefixes), so no directory
+grows with the library, and identical uploads share one copy. Keys never
+collide for different content, whatever the uploaded names were.
+
+``STORAGE_BACKEND`` selects where blobs live:
+
+- ``local``: under ``STORAGE_DIR``, served by the application at
+  ``/blobs/<key>``.
+- ``s3``: in ``S3_BUCKET`` on AWS or any S3-compatible server given with
+  ``S3_ENDPOINT_URL`` (MinIO, or ``moto_server`` for local testing).
+  Credentials come from the usual AWS environment variables. URLs point at
+  ``S3_PUBLIC_URL`` if set, else they are presigned and expire after
+  ``S3_URL_EXPIRY`` seconds. Metadata extraction, analysis and exports need
+  a local file; blobs are downloaded to ``STORAGE_CACHE_DIR`` for that, and
+  the least recently used ones are removed beyond ``STORAGE_CACHE_BYTES``,
+  except those still in use (see ``BlobStore.local_file``). Exports read
+  blobs straight from the bucket instead.
+
+Images stored before the blob store have no ``blob_key`` and are still read
+from their group directory; ``migrate_storage.py`` moves them over.
+"""
+from collections import Counter
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import AsyncIterator, BinaryIO, Iterator, Optional, Tuple
+import asyncio
+import logging
+import os
+import re
+import tempfile
+import threading
+
+logger = logging.getLogger(__name__)
+
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "local").lower()
+# Outside ``uploads``, whose group directories are served as static files
+STORAGE_DIR = Path(os.getenv("STORAGE_DIR", "storage/blobs"))
+STORAGE_CACHE_DIR = Path(os.getenv("STORAGE_CACHE_DIR", "storage/cache"))
+STORAGE_CACHE_BYTES = int(os.getenv("STORAGE_CACHE_BYTES", str(2 * 1024 * 1024 * 1024)))
+
+S3_BUCKET = os.getenv("S3_BUCKET", "")
+S3_PREFIX = os.getenv("S3_PREFIX", "")
+S3_ENDPOINT_URL = os.getenv("S3_ENDPOINT_URL") or None
+S3_REGION = os.getenv("S3_REGION") or None
+S3_PUBLIC_URL = os.getenv("S3_PUBLIC_URL", "").rstrip("/")
+S3_URL_EXPIRY = int(os.getenv("S3_URL_EXPIRY", "3600"))
+
+# Derivatives of blobs are kept under this name, next to the group directories
+BLOBS_DIRNAME = "_blobs"
+
+EXTENSIONS = {
+    "image/jpeg": ".jpg",
+    "image/png": ".png",
+    "image/gif": ".gif",
+    "image/webp": ".webp",
+    "image/tiff": ".tif",
+    "image/bmp": ".bmp",
+    "image/heic": ".heic",
+    "image/heif": ".heif",
+    "image/avif": ".avif",
+}
+MEDIA_TYPES = {extension: media_type for media_type, extension in EXTENSIONS.items()}
+KEY_PATTERN = re.compile(r"[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}(\.[a-z0-9]+)?")
+READ_CHUNK_SIZE = 1024 * 1024
+# Stored blobs never change
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+def blob_key(content_hash: str, content_type: Optional[str] = None) -> str:
+    """Key of a file from its SHA-256 hex digest and MIME type."""
+    content_hash = content_hash.lower()
+    extension = EXTENSIONS.get(content_type or "", "")
+    return f"{content_hash[:2]}/{content_hash[2:4]}/{content_hash}{extension}"
+
+
+def is_blob_key(key: str) -> bool:
+    return KEY_PATTERN.fullmatch(key) is not None
+
+
+def media_type(key: str) -> str:
+    return MEDIA_TYPES.get(Path(key).suffix, "application/octet-stream")
+
+
+class BlobStore:
+    """Where stored files live. Methods taking a key expect a valid one."""
+
+    name = "base"
+
+    def __init__(self, staging_dir: Path):
+        # Uploads are written here before ``put``, on the same device where that matters
+        self.staging_dir = staging_dir
+        self.staging_dir.mkdir(parents=True, exist_ok=True)
+
+    async def put(self, source: Path, key: str, content_type: Optional[str] = None, keep_source: bool = False) -> bool:
+        """Store a file under ``key``; returns False if that blob already existed.
+
+        ``source`` is removed afterwards unless ``keep_source``.
+        """
+        raise NotImplementedError
+
+    async def exists(self, key: str) -> bool:
+        raise NotImplementedError
+
+    async def delete(self, key: str) -> None:
+        raise NotImplementedError
+
+    def list_blobs(self) -> Iterator[Tuple[str, float]]:
+        """``(key, modified)`` of every stored blob, ``modified`` in seconds since the epoch; blocking."""
+        raise NotImplementedError
+
+    async def local_path(self, key: str) -> Path:
+        """A local file with the blob's contents, for reading only.
+
+        A downloaded copy may be removed again at any time; use
+        ``local_file`` to keep it while it is being read.
+        """
+        raise NotImplementedError
+
+    @asynccontextmanager
+    async def local_file(self, key: str) -> AsyncIterator[Path]:
+        """``local_path`` of a blob, kept in place until the block exits."""
+        yield await self.local_path(key)
+
+    async def size(self, key: str) -> int:
+        """Size of a blob in bytes; raises ``FileNotFoundError`` if there is none."""
+        raise NotImplementedError
+
+    def read(self, key: str, start: int, stop: int, chunk_size: int = READ_CHUNK_SIZE) -> AsyncIterator[bytes]:
+        """Bytes ``start`` to ``stop`` (exclusive) of a blob, in chunks."""
+        raise NotImplementedError
+
+    def url(self, key: str) -> str:
+        raise NotImplementedError
+
+
+class LocalBlobStore(BlobStore):
+    name = "local"
+
+    def __init__(self, root: Path = STORAGE_DIR):
+        super().__init__(root / ".staging")
+        self.root = root
+
+    def path(self, key: str) -> Path:
+        return self.root / key
+
+    def _put(self, source: Path, key: str, keep_source: bool) -> bool:
+        destination = self.path(key)
+        destination.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            # A link is atomic and never replaces an existing blob
+            os.link(source, destination)
+            created = True
+        except FileExistsError:
+            created = False
+        except OSError:
+            # Another device: copy to a temporary name next to the blob first
+            fd, temp_name = tempfile.mkstemp(dir=destination.parent, suffix=".part")
+            try:
+                with os.fdopen(fd, "wb") as target, open(source, "rb") as origin:
+                    while chunk := origin.read(1024 * 1024):
+                        target.write(chunk)
+                try:
+                    os.link(temp_name, destination)
+                    created = True
+                except FileExistsError:
+                    created = False
+            finally:
+                os.unlink(temp_name)
+        if not keep_source:
+            source.unlink(missing_ok=True)
+        return created
+
+    async def put(self, source: Path, key: str, content_type: Optional[str] = None, keep_source: bool = False) -> bool:
+        return await asyncio.to_thread(self._put, source, key, keep_source)
+
+    async def exists(self, key: str) -> bool:
+        return await asyncio.to_thread(self.path(key).is_file)
+
+    async def delete(self, key: str) -> None:
+        await asyncio.to_thread(self.path(key).unlink, missing_ok=True)
+
+    def list_blobs(self) -> Iterator[Tuple[str, float]]:
+        for directory, _, filenames in os.walk(self.root):
+            if Path(directory) == self.staging_dir:
+                continue
+            for filename in filenames:
+                path = Path(directory, filename)
+                key = path.relative_to(self.root).as_posix()
+                if is_blob_key(key):
+                    yield key, path.stat().st_mtime
+
+    async def local_path(self, key: str) -> Path:
+        return self.path(key)
+
+    async def size(self, key: str) -> int:
+        status = await asyncio.to_thread(os.stat, self.path(key))
+        return status.st_size
+
+    async def read(self, key: str, start: int, stop: int, chunk_size: int = READ_CHUNK_SIZE) -> AsyncIterator[bytes]:
+        handle = await asyncio.to_thread(open, self.path(key), "rb")
+        try:
+            await asyncio.to_thread(handle.seek, start)
+            while start < stop:
+                chunk = await asyncio.to_thread(handle.read, min(chunk_size, stop - start))
+                if not chunk:
+                    return
+                start += len(chunk)
+                yield chunk
+        finally:
+            await asyncio.to_thread(handle.close)
+
+    def url(self, key: str) -> str:
+        return f"/blobs/{key}"
+
+
+class S3BlobStore(BlobStore):
+    name = "s3"
+
+    def __init__(
+        self,
+        bucket: str = S3_BUCKET,
+        prefix: str = S3_PREFIX,
+        endpoint_url: Optional[str] = S3_ENDPOINT_URL,
+        region: Optional[str] = S3_REGION,
+        cache_dir: Path = STORAGE_CACHE_DIR,
+        cache_bytes: int = STORAGE_CACHE_BYTES
+    ):
+        # Only needed with this backend
+        import boto3
+        from botocore.config import Config
+
+        if not bucket:
+            raise ValueError("S3_BUCKET is required with STORAGE_BACKEND=s3")
+        super().__init__(cache_dir / ".staging")
+        self.bucket = bucket
+        self.prefix = prefix
+        self.cache_dir = cache_dir
+        self.cache_bytes = cache_bytes
+        self._cached_bytes: Optional[int] = None
+        # Downloads in use, which eviction leaves alone; eviction runs in worker threads
+        self._pins: Counter = Counter()
+        self._pins_lock = threading.Lock()
+        self._client = boto3.client(
+            "s3",
+            endpoint_url=endpoint_url,
+            region_name=region,
+            # S3-compatible servers on a plain host name do not resolve bucket subdomains
+            config=Config(s3={"addressing_style": "path"} if endpoint_url else {}),
+        )
+        self._client_error = self._client.exceptions.ClientError
+
+    def _object_key(self, key: str) -> str:
+        return f"{self.prefix}{key}"
+
+    def _head(self, key: str) -> Optional[dict]:
+        try:
+            return self._client.head_object(Bucket=self.bucket, Key=self._object_key(key))
+        except self._client_error as e:
+            if _not_found(e):
+                return None
+            raise
+
+    def _exists(self, key: str) -> bool:
+        return self._head(key) is not None
+
+    def _put(self, source: Path, key: str, content_type: Optional[str], keep_source: bool) -> bool:
+        created = False
+        if not self._exists(key):
+            self._client.upload_file(
+                str(source),
+                self.bucket,
+                self._object_key(key),
+                ExtraArgs={
+                    "ContentType": content_type or media_type(key),
+                    "CacheControl": IMMUTABLE_CACHE_CONTROL,
+                },
+            )
+            created = True
+        if not keep_source:
+            source.unlink(missing_ok=True)
+        return created
+
+    async def put(self, source: Path, key: str, content_type: Optional[str] = None, keep_source: bool = False) -> bool:
+        return await asyncio.to_thread(self._put, source, key, content_type, keep_source)
+
+    async def exists(self, key: str) -> bool:
+        return await asyncio.to_thread(self._exists, key)
+
+    async def delete(self, key: str) -> None:
+        await asyncio.to_thread(self._client.delete_object, Bucket=self.bucket, Key=self._object_key(key))
+        (self.cache_dir / key).unlink(missing_ok=True)
+
+    def list_blobs(self) -> Iterator[Tuple[str, float]]:
+        pages = self._client.get_paginator("list_objects_v2").paginate(Bucket=self.bucket, Prefix=self.prefix)
+        for page in pages:
+            for item in page.get("Contents", []):
+                key = item["Key"][len(self.prefix):]
+                if is_blob_key(key):
+                    yield key, item["LastModified"].timestamp()
+
+    def _download(self, key: str) -> Path:
+        path = self.cache_dir / key
+        if path.is_file():
+            # Mark as recently used for eviction
+            os.utime(path)
+            return path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, temp_name = tempfile.mkstemp(dir=path.parent, suffix=".part")
+        os.close(fd)
+        try:
+            self._client.download_file(self.bucket, self._object_key(key), temp_name)
+            os.replace(temp_name, path)
+        except BaseException as e:
+            os.unlink(temp_name)
+            if isinstance(e, self._client_error) and _not_found(e):
+                raise FileNotFoundError(f"No blob {key} in bucket {self.bucket}") from e
+            raise
+        if self._cached_bytes is None:
+            self._cached_bytes = sum(entry.stat().st_size for entry in self._cache_files())
+        else:
+            self._cached_bytes += path.stat().st_size
+        if self._cached_bytes > self.cache_bytes:
+            self._evict(keep=path)
+        return path
+
+    def _cache_files(self):
+        for directory, _, filenames in os.walk(self.cache_dir):
+            if Path(directory) == self.staging_dir:
+                continue
+            for filename in filenames:
+                if not filename.endswith(".part"):
+                    yield Path(directory) / filename
+
+    def _evict(self, keep: Path) -> None:
+        """Remove the least recently used downloads until the cache is at 80% of its limit.
+
+        Downloads in use are kept, even if that leaves the cache above its limit.
+        """
+        with self._pins_lock:
+            pinned = {self.cache_dir / key for key in self._pins}
+        files = sorted(
+            ((path.stat(), path) for path in self._cache_files() if path != keep and path not in pinned),
+            key=lambda item: item[0].st_mtime
+        )
+        target = self.cache_bytes * 0.8
+        for status, path in files:
+            if self._cached_bytes <= target:
+                break
+            path.unlink(missing_ok=True)
+            self._cached_bytes -= status.st_size
+
+    async def local_path(self, key: str) -> Path:
+        return await asyncio.to_thread(self._download, key)
+
+    @asynccontextmanager
+    async def local_file(self, key: str) -> AsyncIterator[Path]:
+        # Pinned before the download, whose own eviction must not remove it either
+        with self._pins_lock:
+            self._pins[key] += 1
+        try:
+            yield await self.local_path(key)
+        finally:
+            with self._pins_lock:
+                self._pins[key] -= 1
+                if not self._pins[key]:
+                    del self._pins[key]
+
+    async def size(self, key: str) -> int:
+        head = await asyncio.to_thread(self._head, key)
+        if head is None:
+            raise FileNotFoundError(f"No blob {key} in bucket {self.bucket}")
+        return head["ContentLength"]
+
+    def _open(self, key: str, start: int, stop: int) -> BinaryIO:
+        try:
+            response = self._client.get_object(
+                Bucket=self.bucket, Key=self._object_key(key), Range=f"bytes={start}-{stop - 1}"
+            )
+        except self._client_error as e:
+            if _not_found(e):
+                raise FileNotFoundError(f"No blob {key} in bucket {self.bucket}") from e
+            raise
+        return response["Body"]
+
+    async def read(self, key: str, start: int, stop: int, chunk_size: int = READ_CHUNK_SIZE) -> AsyncIterator[bytes]:
+        if start >= stop:
+            return
+        body = await asyncio.to_thread(self._open, key, start, stop)
+        try:
+            while chunk := await asyncio.to_thread(body.read, chunk_size):
+                yield chunk
+        finally:
+            await asyncio.to_thread(body.close)
+
+    def url(self, key: str) -> str:
+        if S3_PUBLIC_URL:
+            return f"{S3_PUBLIC_URL}/{self._object_key(key)}"
+        return self._client.generate_presigned_url(
+            "get_object",
+            Params={"Bucket": self.bucket, "Key": self._object_key(key)},
+            ExpiresIn=S3_URL_EXPIRY,
+        )
+
+
+def _not_found(error) -> bool:
+    return error.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound")
+
+
+def create_store(backend: str = STORAGE_BACKEND) -> BlobStore:
+    """The blob store configured by ``STORAGE_BACKEND``."""
+    if backend == "local":
+        return LocalBlobStore()
+    if backend == "s3":
+        return S3BlobStore()
+    raise ValueError(f"Unknown STORAGE_BACKEND {backend!r}, use local or s3")
+
+
+def derivative_source(image) -> Tuple[str, str]:
+    """``(directory, filename)`` naming an image's derivatives.
+
+    Derivatives of blobs are named after the blob, so identical uploads
+    share them.
+    """
+    if image.blob_key:
+        return blob_derivative_source(image.blob_key)
+    return image.group.directory_name, image.stored_filename
+
+
+def blob_derivative_source(key: str) -> Tuple[str, str]:
+    directory, _, filename = key.rpartition("/")
+    return f"{BLOBS_DIRNAME}/{directory}", filename
+
+
+@asynccontextmanager
+async def image_file(store: BlobStore, uploads_dir: Path, image) -> AsyncIterator[Optional[Path]]:
+    """Local file of an image, from the blob store or its group directory, kept until the block exits."""
+    if image.blob_key:
+        async with store.local_file(image.blob_key) as path:
+            yield path
+    elif image.group is None:
+        yield None
+    else:
+        yield uploads_dir / image.group.directory_name / image.stored_filename
+
+
+def image_url(store: BlobStore, image, directory_name: str) -> str:
+    if image.blob_key:
+        return store.url(image.blob_key)
+    return f"/uploads/{directory_name}/{image.stored_filename}"
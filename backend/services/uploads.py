@@ -0,0 +1,170 @@
+"""Streaming writes of uploaded files.
+
+Uploads are copied in chunks to a temporary file in the blob store's staging
+directory. The SHA-256 and size are computed while writing and the real image
+type is sniffed from the first bytes. Disk writes happen in a worker thread,
+so the event loop stays free for other requests while large files are stored.
+Once complete, the caller reads what it needs from the staged file and moves
+it into the blob store under its content key.
+"""
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import Optional
+import asyncio
+import hashlib
+import os
+import tempfile
+
+from fastapi import UploadFile
+
+UPLOAD_CHUNK_SIZE = max(64 * 1024, int(os.getenv("UPLOAD_CHUNK_SIZE", str(1024 * 1024))))
+MAX_UPLOAD_FILE_BYTES = int(os.getenv("MAX_UPLOAD_FILE_BYTES", str(100 * 1024 * 1024)))
+MAX_UPLOAD_REQUEST_BYTES = int(os.getenv("MAX_UPLOAD_REQUEST_BYTES", str(2 * 1024 * 1024 * 1024)))
+
+# Bytes needed to recognise every supported format
+SNIFF_LENGTH = 32
+
+
+class UploadRejected(Exception):
+    """An uploaded file was refused; the message is shown to the client."""
+
+
+@dataclass
+class SavedUpload:
+    path: Path  # The staged file
+    filename: str  # Name to store the image under
+    size: int
+    content_hash: str
+    content_type: str
+    # The whole file when it fit in the first chunk, for parsing without a re-read
+    data: Optional[bytes] = None
+
+
+class UploadBudget:
+    """Bytes a single request may still write across all of its files."""
+
+    def __init__(self, limit: int = MAX_UPLOAD_REQUEST_BYTES):
+        self.remaining = limit
+
+    def consume(self, size: int) -> None:
+        if size > self.remaining:
+            self.remaining = 0
+            raise UploadRejected("upload exceeds the maximum request size")
+        self.remaining -= size
+
+
+def sniff_image_type(header: bytes) -> Optional[str]:
+    """MIME type of an image from its magic bytes, or None if not a known image."""
+    if header.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if header.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if header[:6] in (b"GIF87a", b"GIF89a"):
+        return "image/gif"
+    if header[:4] == b"RIFF" and header[8:12] == b"WEBP":
+        return "image/webp"
+    if header[:4] in (b"II*\x00", b"MM\x00*"):
+        return "image/tiff"
+    if header.startswith(b"BM"):
+        return "image/bmp"
+    if header[4:8] == b"ftyp":
+        brand = header[8:12]
+        if brand in (b"heic", b"heix", b"hevc", b"hevx", b"heim", b"heis"):
+            return "image/heic"
+        if brand in (b"mif1", b"msf1"):
+            return "image/heif"
+        if brand in (b"avif", b"avis"):
+            return "image/avif"
+    return None
+
+
+def unique_filename(original_filename: str) -> str:
+    """Stored name for an upload: the original stem with a timestamp."""
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    original_name = Path(original_filename).stem
+    extension = Path(original_filename).suffix
+    return f"{original_name}_{timestamp}{extension}"
+
+
+def number_filename(filename: str, taken: set) -> str:
+    """``filename``, or the first of ``name_1.ext``, ``name_2.ext``... that is not in ``taken``."""
+    stem, extension = Path(filename).stem, Path(filename).suffix
+    name = filename
+    counter = 1
+    while name in taken:
+        name = f"{stem}_{counter}{extension}"
+        counter += 1
+    return name
+
+
+def _write_chunk(handle, digest, chunk: bytes) -> None:
+    digest.update(chunk)
+    handle.write(chunk)
+
+
+async def save_upload_stream(
+    upload_file: UploadFile,
+    directory: Path,
+    budget: Optional[UploadBudget] = None,
+    max_file_bytes: int = MAX_UPLOAD_FILE_BYTES
+) -> SavedUpload:
+    """Stream an upload to a temporary file in ``directory`` and return what was staged.
+
+    The caller owns the staged file. Raises ``UploadRejected`` for files
+    without a name, files that are not images and files over the size
+    limits; nothing is left on disk then.
+    """
+    if not upload_file.filename:
+        raise UploadRejected("Filename is required")
+
+    fd, temp_name = tempfile.mkstemp(dir=directory, prefix=".upload-", suffix=".part")
+    temp_path = Path(temp_name)
+    digest = hashlib.sha256()
+    size = 0
+    content_type = None
+    first_chunk = b""
+
+    try:
+        with os.fdopen(fd, "wb") as handle:
+            while True:
+                chunk = await upload_file.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+
+                if content_type is None:
+                    # Short reads are possible; sniff once enough bytes have arrived
+                    first_chunk += chunk
+                    if len(first_chunk) >= SNIFF_LENGTH:
+                        content_type = sniff_image_type(first_chunk)
+                        if content_type is None:
+                            raise UploadRejected(f"{upload_file.filename} is not an image file")
+
+                size += len(chunk)
+                if size > max_file_bytes:
+                    raise UploadRejected(
+                        f"{upload_file.filename} exceeds the maximum file size of {max_file_bytes} bytes"
+                    )
+                if budget is not None:
+                    budget.consume(len(chunk))
+
+                await asyncio.to_thread(_write_chunk, handle, digest, chunk)
+
+        if content_type is None:
+            content_type = sniff_image_type(first_chunk)
+            if content_type is None:
+                raise UploadRejected(f"{upload_file.filename} is not an image file")
+    except BaseException:
+        temp_path.unlink(missing_ok=True)
+        raise
+    finally:
+        await upload_file.close()
+
+    return SavedUpload(
+        path=temp_path,
+        filename=unique_filename(upload_file.filename),
+        size=size,
+        content_hash=digest.hexdigest(),
+        content_type=content_type,
+        data=first_chunk if len(first_chunk) == size else None
+    )
@@ -0,0 +1,477 @@
+"""Zip archives streamed while they are built, with byte range support.
+
+``ZipArchive`` lays out the whole archive before any byte is sent. Files from
+disk are stored as they are: uploads are JPEG and other already compressed
+formats, so deflating them again only costs CPU. Small in-memory members are
+deflated up front. Generated members, such as a metadata sidecar too large to
+hold in memory, are stored too: their size and checksum are measured in a
+first pass and the contents are generated again while they are sent. Every
+header, offset and the total size are therefore known in advance, which gives
+the response a ``Content-Length`` and lets it serve byte ranges for resumed
+downloads.
+
+Files of a remote store are added with ``add_remote`` and read in byte ranges
+while they are sent, so an export starts without downloading them first.
+
+The CRC-32 of a stored file is not needed before its data: local headers
+leave it out and a data descriptor after the data carries it, so a file is
+read once while it is sent. Only the descriptors and the central directory
+need the checksums; a range that starts past a file reads the skipped file
+to get its checksum, and checksums are cached by path, size and modification
+time for the next attempt.
+
+Files are read ``EXPORT_CHUNK_SIZE`` bytes at a time in a worker thread, and
+each chunk is handed to the server before the next is read, so memory use
+does not grow with the archive and other requests keep being served.
+"""
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import AsyncIterator, BinaryIO, Callable, List, Optional, Tuple
+import asyncio
+import hashlib
+import os
+import re
+import struct
+import zlib
+
+EXPORT_CHUNK_SIZE = max(64 * 1024, int(os.getenv("EXPORT_CHUNK_SIZE", str(1024 * 1024))))
+
+CRC_CACHE_SIZE = 100000
+ZIP64_LIMIT = 0xFFFFFFFF
+ZIP64_COUNT_LIMIT = 0xFFFF
+
+STORED = 0
+DEFLATED = 8
+FLAG_DATA_DESCRIPTOR = 0x08
+FLAG_UTF8 = 0x800
+VERSION = 20
+VERSION_ZIP64 = 45
+MADE_BY_UNIX = 3 << 8
+FILE_MODE = 0o100644 << 16
+
+LOCAL_HEADER = struct.Struct("<IHHHHHIIIHH")
+CENTRAL_HEADER = struct.Struct("<IHHHHHHIIIHHHHHII")
+DATA_DESCRIPTOR = struct.Struct("<IIII")
+DATA_DESCRIPTOR_ZIP64 = struct.Struct("<IIQQ")
+END_OF_CENTRAL_DIRECTORY = struct.Struct("<IHHHHIIH")
+ZIP64_END_OF_CENTRAL_DIRECTORY = struct.Struct("<IQHHIIQQQQ")
+ZIP64_END_LOCATOR = struct.Struct("<IIQI")
+
+_crc_cache: "OrderedDict[Tuple[str, int, int], int]" = OrderedDict()
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """``(start, stop)`` of a single-range ``Range`` header, stop exclusive.
+
+    Returns None for headers to ignore (other units, several ranges,
+    malformed), which means sending the whole archive.
+    """
+    match = re.fullmatch(r"\s*bytes\s*=\s*(\d*)\s*-\s*(\d*)\s*", header)
+    if not match or match.group(1) == match.group(2) == "":
+        return None
+    first, last = match.groups()
+    if first == "":
+        start, stop = max(0, size - int(last)), size
+    else:
+        start = int(first)
+        stop = min(size, int(last) + 1) if last else size
+        if last and int(last) < start:
+            return None
+    if start >= size or start >= stop:
+        raise RangeNotSatisfiable()
+    return start, stop
+
+
+def _dos_datetime(moment: datetime) -> Tuple[int, int]:
+    if moment.year < 1980:
+        moment = datetime(1980, 1, 1)
+    return (
+        (moment.hour << 11) | (moment.minute << 5) | (moment.second // 2),
+        ((moment.year - 1980) << 9) | (moment.month << 5) | moment.day,
+    )
+
+
+def _file_crc(path: Path) -> int:
+    crc = 0
+    with open(path, "rb") as handle:
+        while chunk := handle.read(EXPORT_CHUNK_SIZE):
+            crc = zlib.crc32(chunk, crc)
+    return crc
+
+
+def _open_at(path: Path, offset: int) -> BinaryIO:
+    handle = open(path, "rb")
+    handle.seek(offset)
+    return handle
+
+
+@dataclass
+class _Member:
+    name: bytes
+    flags: int
+    method: int
+    time: int
+    date: int
+    size: int
+    compressed_size: int
+    offset: int
+    crc: Optional[int] = None
+    path: Optional[Path] = None
+    mtime_ns: int = 0
+    data: Optional[bytes] = None  # Compressed contents of in-memory members
+    generate: Optional[Callable[[], AsyncIterator[bytes]]] = None  # Contents of generated members
+    read: Optional[Callable[[int, int], AsyncIterator[bytes]]] = None  # Byte ranges of remote files
+    source: Optional[str] = None  # Name of a remote file
+
+    @property
+    def origin(self) -> str:
+        return self.source or str(self.path)
+
+    @property
+    def zip64(self) -> bool:
+        return self.size >= ZIP64_LIMIT or self.compressed_size >= ZIP64_LIMIT
+
+    @property
+    def cache_key(self) -> Tuple[str, int, int]:
+        return self.origin, self.size, self.mtime_ns
+
+    def local_header(self) -> bytes:
+        extra = struct.pack("<HHQQ", 0x0001, 16, self.size, self.compressed_size) if self.zip64 else b""
+        return LOCAL_HEADER.pack(
+            0x04034B50,
+            VERSION_ZIP64 if self.zip64 else VERSION,
+            self.flags,
+            self.method,
+            self.time,
+            self.date,
+            # With a data descriptor the checksum follows the data
+            0 if self.flags & FLAG_DATA_DESCRIPTOR else self.crc,
+            ZIP64_LIMIT if self.zip64 else self.compressed_size,
+            ZIP64_LIMIT if self.zip64 else self.size,
+            len(self.name),
+            len(extra),
+        ) + self.name + extra
+
+    def descriptor_length(self) -> int:
+        if not self.flags & FLAG_DATA_DESCRIPTOR:
+            return 0
+        return (DATA_DESCRIPTOR_ZIP64 if self.zip64 else DATA_DESCRIPTOR).size
+
+    def descriptor(self) -> bytes:
+        layout = DATA_DESCRIPTOR_ZIP64 if self.zip64 else DATA_DESCRIPTOR
+        return layout.pack(0x08074B50, self.crc, self.compressed_size, self.size)
+
+    def _central_extra(self) -> bytes:
+        # Only the fields that do not fit their 32-bit slot, in this order
+        values = [value for value in (self.size, self.compressed_size, self.offset) if value >= ZIP64_LIMIT]
+        if not values:
+            return b""
+        return struct.pack(f"<HH{len(values)}Q", 0x0001, 8 * len(values), *values)
+
+    def central_header_length(self) -> int:
+        return CENTRAL_HEADER.size + len(self.name) + len(self._central_extra())
+
+    def central_header(self) -> bytes:
+        extra = self._central_extra()
+        version = VERSION_ZIP64 if extra else VERSION
+        return CENTRAL_HEADER.pack(
+            0x02014B50,
+            MADE_BY_UNIX | version,
+            version,
+            self.flags,
+            self.method,
+            self.time,
+            self.date,
+            self.crc,
+            min(self.compressed_size, ZIP64_LIMIT),
+            min(self.size, ZIP64_LIMIT),
+            len(self.name),
+            len(extra),
+            0,
+            0,
+            0,
+            FILE_MODE,
+            min(self.offset, ZIP64_LIMIT),
+        ) + self.name + extra
+
+
+class ZipArchive:
+    """A zip archive laid out up front and produced on demand, in whole or by range.
+
+    Add members with ``add_file`` and ``add_bytes``, then ``close`` it; ``size``
+    and ``etag`` are then final and ``stream`` yields any part of it.
+    """
+
+    def __init__(self):
+        self.size = 0
+        self._members: List[_Member] = []
+        # (offset, length, kind, member) in archive order
+        self._parts: List[Tuple[int, int, str, Optional[_Member]]] = []
+        self._end = b""
+        self._digest = hashlib.sha256()
+        self._closed = False
+
+    def __len__(self) -> int:
+        return len(self._members)
+
+    def _append(self, member: _Member) -> None:
+        if self._closed:
+            raise ValueError("archive is closed")
+        header = member.local_header()
+        self._parts.append((self.size, len(header), "local_header", member))
+        self._parts.append((self.size + len(header), member.compressed_size, "data", member))
+        self._parts.append((
+            self.size + len(header) + member.compressed_size, member.descriptor_length(), "descriptor", member
+        ))
+        self.size += len(header) + member.compressed_size + member.descriptor_length()
+        self._members.append(member)
+        # Checksums of files are only known once read, their size and mtime stand in for them
+        identity = (
+            member.name, member.origin, member.size, member.mtime_ns,
+            (member.data is not None or member.generate is not None) and member.crc
+        )
+        self._digest.update(repr(identity).encode())
+
+    def add_file(self, name: str, path: Path, modified: datetime) -> None:
+        """Add a file from disk, stored uncompressed; raises OSError if it cannot be read."""
+        status = os.stat(path)
+        time, date = _dos_datetime(modified)
+        self._append(_Member(
+            name=name.encode(),
+            flags=FLAG_DATA_DESCRIPTOR | FLAG_UTF8,
+            method=STORED,
+            time=time,
+            date=date,
+            size=status.st_size,
+            compressed_size=status.st_size,
+            offset=self.size,
+            crc=_crc_cache.get((str(path), status.st_size, status.st_mtime_ns)),
+            path=path,
+            mtime_ns=status.st_mtime_ns,
+        ))
+
+    def add_remote(
+        self,
+        name: str,
+        source: str,
+        size: int,
+        read: Callable[[int, int], AsyncIterator[bytes]],
+        modified: datetime
+    ) -> None:
+        """Add a file read by ``read(start, stop)`` while it is sent, stored uncompressed.
+
+        ``source`` names the file for the ``ETag`` and the checksum cache, so
+        it must name other contents whenever they change, as a content hash does.
+        """
+        time, date = _dos_datetime(modified)
+        self._append(_Member(
+            name=name.encode(),
+            flags=FLAG_DATA_DESCRIPTOR | FLAG_UTF8,
+            method=STORED,
+            time=time,
+            date=date,
+            size=size,
+            compressed_size=size,
+            offset=self.size,
+            crc=_crc_cache.get((source, size, 0)),
+            read=read,
+            source=source,
+        ))
+
+    def add_bytes(self, name: str, data: bytes, modified: datetime) -> None:
+        """Add contents held in memory, deflated."""
+        compressor = zlib.compressobj(6, zlib.DEFLATED, -15)
+        compressed = compressor.compress(data) + compressor.flush()
+        time, date = _dos_datetime(modified)
+        self._append(_Member(
+            name=name.encode(),
+            flags=FLAG_UTF8,
+            method=DEFLATED,
+            time=time,
+            date=date,
+            size=len(data),
+            compressed_size=len(compressed),
+            offset=self.size,
+            crc=zlib.crc32(data),
+            data=compressed,
+        ))
+
+    def add_generated(
+        self,
+        name: str,
+        size: int,
+        crc: int,
+        generate: Callable[[], AsyncIterator[bytes]],
+        modified: datetime
+    ) -> None:
+        """Add contents produced by ``generate`` on demand, stored uncompressed.
+
+        ``size`` and ``crc`` are those of the contents from a first run of
+        ``generate``; every later run must produce the same bytes, otherwise
+        streaming the member raises ``OSError``.
+        """
+        time, date = _dos_datetime(modified)
+        self._append(_Member(
+            name=name.encode(),
+            flags=FLAG_UTF8,
+            method=STORED,
+            time=time,
+            date=date,
+            size=size,
+            compressed_size=size,
+            offset=self.size,
+            crc=crc,
+            generate=generate,
+        ))
+
+    def close(self) -> None:
+        """Lay out the central directory; no members can be added afterwards."""
+        directory_offset = self.size
+        for member in self._members:
+            self._parts.append((self.size, member.central_header_length(), "central_header", member))
+            self.size += member.central_header_length()
+        directory_size = self.size - directory_offset
+
+        count = len(self._members)
+        end = b""
+        if count >= ZIP64_COUNT_LIMIT or directory_offset >= ZIP64_LIMIT or directory_size >= ZIP64_LIMIT:
+            end += ZIP64_END_OF_CENTRAL_DIRECTORY.pack(
+                0x06064B50,
+                ZIP64_END_OF_CENTRAL_DIRECTORY.size - 12,
+                MADE_BY_UNIX | VERSION_ZIP64,
+                VERSION_ZIP64,
+                0,
+                0,
+                count,
+                count,
+                directory_size,
+                directory_offset,
+            )
+            end += ZIP64_END_LOCATOR.pack(0x07064B50, 0, self.size, 1)
+        end += END_OF_CENTRAL_DIRECTORY.pack(
+            0x06054B50,
+            0,
+            0,
+            min(count, ZIP64_COUNT_LIMIT),
+            min(count, ZIP64_COUNT_LIMIT),
+            min(directory_size, ZIP64_LIMIT),
+            min(directory_offset, ZIP64_LIMIT),
+            0,
+        )
+        self._parts.append((self.size, len(end), "end", None))
+        self.size += len(end)
+        self._end = end
+        self._closed = True
+
+    @property
+    def etag(self) -> str:
+        """Strong validator of the archive's contents, for ``If-Range``."""
+        return f'"{self._digest.hexdigest()[:32]}"'
+
+    async def _crc(self, member: _Member) -> int:
+        if member.crc is None:
+            if member.read is not None:
+                async for _ in self._read(member, 0, member.size):
+                    pass
+            else:
+                member.crc = await asyncio.to_thread(_file_crc, member.path)
+                _remember_crc(member)
+        return member.crc
+
+    async def _read(self, member: _Member, start: int, stop: int) -> AsyncIterator[bytes]:
+        if member.data is not None:
+            yield member.data[start:stop]
+            return
+        if member.generate is not None:
+            async for chunk in _read_generated(member, start, stop):
+                yield chunk
+            return
+        # A file sent in full yields its checksum on the way
+        whole = start == 0 and stop == member.size and member.crc is None
+        chunks = member.read(start, stop) if member.read is not None else _read_file(member.path, start, stop)
+        crc = 0
+        position = start
+        try:
+            async for chunk in chunks:
+                crc = zlib.crc32(chunk, crc)
+                position += len(chunk)
+                yield chunk
+        finally:
+            await chunks.aclose()
+        if position != stop:
+            raise OSError(f"{member.origin} changed size while it was being exported")
+        if whole:
+            member.crc = crc
+            _remember_crc(member)
+
+    async def stream(self, start: int = 0, stop: Optional[int] = None) -> AsyncIterator[bytes]:
+        """Bytes ``start`` to ``stop`` (exclusive) of the archive, in chunks."""
+        if not self._closed:
+            raise ValueError("close the archive before streaming it")
+        stop = self.size if stop is None else stop
+        for offset, length, kind, member in self._parts:
+            if offset + length <= start or length == 0:
+                continue
+            if offset >= stop:
+                break
+            low, high = max(start, offset) - offset, min(stop, offset + length) - offset
+            if kind == "data":
+                async for chunk in self._read(member, low, high):
+                    yield chunk
+            elif kind == "local_header":
+                yield member.local_header()[low:high]
+            elif kind == "descriptor":
+                await self._crc(member)
+                yield member.descriptor()[low:high]
+            elif kind == "central_header":
+                await self._crc(member)
+                yield member.central_header()[low:high]
+            else:
+                yield self._end[low:high]
+
+
+async def _read_file(path: Path, start: int, stop: int) -> AsyncIterator[bytes]:
+    handle = await asyncio.to_thread(_open_at, path, start)
+    try:
+        while start < stop:
+            chunk = await asyncio.to_thread(handle.read, min(EXPORT_CHUNK_SIZE, stop - start))
+            if not chunk:
+                return
+            start += len(chunk)
+            yield chunk
+    finally:
+        await asyncio.to_thread(handle.close)
+
+
+async def _read_generated(member: _Member, start: int, stop: int) -> AsyncIterator[bytes]:
+    # Generated from the start every time; the part before ``start`` is dropped
+    crc = 0
+    position = 0
+    contents = member.generate()
+    try:
+        async for chunk in contents:
+            crc = zlib.crc32(chunk, crc)
+            end = position + len(chunk)
+            if end > start and position < stop:
+                yield chunk[max(0, start - position):min(stop, end) - position]
+            position = end
+            # Only a member sent to its end is generated to the end, which checks all of it
+            if position >= stop and stop < member.size:
+                return
+    finally:
+        await contents.aclose()
+    if position != member.size or crc != member.crc:
+        raise OSError(f"{member.name.decode()} changed while it was being exported")
+
+
+def _remember_crc(member: _Member) -> None:
+    _crc_cache[member.cache_key] = member.crc
+    _crc_cache.move_to_end(member.cache_key)
+    while len(_crc_cache) > CRC_CACHE_SIZE:
+        _crc_cache.popitem(last=False)
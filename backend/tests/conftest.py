@@ -0,0 +1,46 @@
+"""Fixtures for tests that run the application against a throwaway SQLite database.
+
+``main`` and ``database`` read their settings when imported and the
+application keeps its files relative to the working directory, so both are
+set up when the session starts, before any test module imports them.
+"""
+import os
+import shutil
+import tempfile
+
+import pytest
+
+WORK_DIR = pytest.StashKey()
+
+
+def pytest_sessionstart(session):
+    work_dir = tempfile.mkdtemp(prefix="photo-logbook-tests-")
+    session.config.stash[WORK_DIR] = (os.getcwd(), work_dir)
+    os.chdir(work_dir)
+    os.environ["DATABASE_URL"] = f"sqlite:///{work_dir}/test.db"
+    os.environ.pop("ASYNC_DATABASE_URL", None)
+    os.environ["STORAGE_BACKEND"] = "local"
+    # Analysis fails right away instead of calling out
+    os.environ["ANALYSIS_BACKEND"] = "openai"
+    os.environ.pop("OPENAI_API_KEY", None)
+
+
+def pytest_sessionfinish(session):
+    if WORK_DIR in session.config.stash:
+        previous_dir, work_dir = session.config.stash[WORK_DIR]
+        os.chdir(previous_dir)
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+@pytest.fixture
+def client():
+    from fastapi.testclient import TestClient
+
+    import database
+    import main
+    import models
+
+    models.Base.metadata.drop_all(database.engine)
+    models.Base.metadata.create_all(database.engine)
+    with TestClient(main.app) as test_client:
+        yield test_client
@@ -0,0 +1,43 @@
+import crud
+import database
+import models
+from database import AsyncSessionLocal
+
+
+def image(stored_filename: str, **metadata) -> dict:
+    return dict(
+        original_filename=stored_filename, stored_filename=stored_filename, content_type="image/jpeg",
+        file_size=100, metadata={"width": 4, "height": 3, "format": "JPEG", **metadata},
+        content_analysis=None, analysis_status="pending"
+    )
+
+
+def test_bulk_insert_reports_only_the_rows_that_fail(client):
+    # Stored filenames are unique per group by convention; enforce it so a
+    # duplicate makes its row violate a constraint
+    with database.engine.begin() as connection:
+        connection.exec_driver_sql("CREATE UNIQUE INDEX ux_images_group_file ON images (group_id, stored_filename)")
+
+    async def insert():
+        async with AsyncSessionLocal() as db:
+            group = await crud.create_image_group(db, "Trip", "trip", commit=False)
+            first = await crud.create_images_bulk(db, group.id, [image("taken.jpg")])
+            names = ["a.jpg", "taken.jpg", "b.jpg", "bad-date.jpg", "c.jpg"]
+            batch = [image(name) for name in names]
+            batch[3]["metadata"]["date_taken"] = "yesterday"
+            return group.id, first, names, await crud.create_images_bulk(db, group.id, batch)
+
+    group_id, first, names, outcomes = client.portal.call(insert)
+    assert "id" in first[0]
+    assert "UNIQUE constraint failed" in outcomes[1]["error"]
+    assert "yesterday" in outcomes[3]["error"]
+
+    with database.SessionLocal() as db:
+        stored = {row.id: row for row in db.query(models.Image).filter_by(group_id=group_id)}
+        jobs = {job.id: job.image_id for job in db.query(models.AnalysisJob)}
+    assert len(stored) == 4
+    # Every outcome names the row of its own file and that row's job
+    for name, outcome in zip(names, outcomes):
+        if "error" not in outcome:
+            assert stored[outcome["id"]].stored_filename == name
+            assert jobs[outcome["job_id"]] == outcome["id"]
@@ -0,0 +1,63 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from services.events import EVENT_SAMPLE_IMAGES, EventIndex
+
+PARIS = (48.8566, 2.3522)
+LONDON = (51.5074, -0.1278)  # About 340 km from Paris
+
+# (id, group_id, date_taken, latitude, longitude)
+DAY_TRIP = [
+    (1, 1, datetime(2024, 5, 1, 10, 0), *PARIS),
+    (2, 1, datetime(2024, 5, 1, 10, 30), 48.8606, 2.3376),
+    (3, 1, datetime(2024, 5, 1, 11, 0), None, None),
+]
+EVENING = [
+    # Nine hours after the last photo
+    (4, 2, datetime(2024, 5, 1, 20, 0), 48.8530, 2.3499),
+    # An hour later, but in another city
+    (5, 2, datetime(2024, 5, 1, 21, 0), *LONDON),
+    (6, 2, datetime(2024, 5, 1, 21, 30), 51.5080, -0.1290),
+]
+
+
+def test_events_split_on_time_gaps_and_distance():
+    index = EventIndex()
+    # Imported out of order
+    index.add(EVENING)
+    index.add(DAY_TRIP)
+
+    events = index.events(max_gap_hours=8, max_distance_km=100, min_images=1)
+    described = [index.describe(events, i) for i in range(len(events))]
+    assert [event["image_ids"] for event in described] == [[1, 2, 3], [4], [5, 6]]
+
+    day_trip, evening, london = described
+    assert (day_trip["start"], day_trip["end"]) == ("2024-05-01T10:00:00", "2024-05-01T11:00:00")
+    assert (day_trip["image_count"], day_trip["located_count"]) == (3, 2)
+    # Group 1 is exactly this event; group 2 spans two events
+    assert day_trip["matches_group"] == 1
+    assert evening["matches_group"] is None
+    assert london["groups"] == [{"group_id": 2, "image_count": 2}]
+    assert london["center"]["latitude"] == pytest.approx(51.5077, abs=1e-4)
+    assert london["center"]["longitude"] == pytest.approx(-0.1284, abs=1e-4)
+    assert 0 < london["radius_km"] < 0.1
+
+    # Single photos are not events; wider limits merge the evening into one
+    events = index.events(max_gap_hours=8, max_distance_km=100, min_images=2)
+    assert [index.describe(events, i)["image_ids"] for i in range(len(events))] == [[1, 2, 3], [5, 6]]
+    merged = index.events(max_gap_hours=12, max_distance_km=500, min_images=1)
+    assert [index.describe(merged, i)["image_count"] for i in range(len(merged))] == [6]
+
+
+def test_large_events_list_a_sample_of_their_images():
+    start = datetime(2024, 7, 14, 22, 0)
+    burst = [(100 + i, 3, start + timedelta(seconds=i), *PARIS) for i in range(EVENT_SAMPLE_IMAGES + 10)]
+    index = EventIndex()
+    index.add(list(reversed(burst)))
+
+    events = index.events(max_gap_hours=8, max_distance_km=100, min_images=1)
+    event = index.describe(events, 0)
+    assert event["image_count"] == len(burst)
+    # The first photos in capture order
+    assert event["image_ids"] == [row[0] for row in burst[:EVENT_SAMPLE_IMAGES]]
@@ -0,0 +1,149 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+import crud
+import database
+import main
+import models
+from database import AsyncSessionLocal
+from services import job_queue
+from services.analysis_backends import AnalysisError
+from services.job_queue import AnalysisJobQueue
+
+ANALYSIS = {"description": "A beach at sunset"}
+
+
+class ScriptedAnalyzer:
+    """Answers each request with the next outcome, raising it if it is an error."""
+
+    batching = False
+    batch_size = 1
+
+    def __init__(self, *outcomes):
+        self.outcomes = list(outcomes)
+        self.requests = 0
+
+    async def request_content_analysis(self, path):
+        assert path.exists()
+        self.requests += 1
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+
+@pytest.fixture
+def queue_image(client, tmp_path):
+    """ID of a pending image with a queued job, the application's own workers stopped."""
+    client.portal.call(main.analysis_queue.stop)
+    (tmp_path / "trip").mkdir()
+    (tmp_path / "trip" / "a.jpg").write_bytes(b"jpeg")
+
+    async def create():
+        async with AsyncSessionLocal() as db:
+            group = await crud.create_image_group(db, "Trip", "trip", commit=False)
+            outcomes = await crud.create_images_bulk(db, group.id, [dict(
+                original_filename="a.jpg", stored_filename="a.jpg", content_type="image/jpeg", file_size=4,
+                metadata={}, content_analysis=None, analysis_status="pending"
+            )])
+            return outcomes[0]["id"]
+
+    return client.portal.call(create)
+
+
+def make_queue(tmp_path, analyzer) -> AnalysisJobQueue:
+    return AnalysisJobQueue(analyzer, tmp_path, main.storage, workers=1)
+
+
+def job_row(image_id: int) -> models.AnalysisJob:
+    with database.SessionLocal() as db:
+        job = db.query(models.AnalysisJob).filter_by(image_id=image_id).one()
+        # Loads the image along with it
+        assert job.image is not None
+        db.expunge(job)
+        return job
+
+
+def make_due(image_id: int) -> None:
+    with database.engine.begin() as connection:
+        connection.exec_driver_sql(
+            "UPDATE analysis_jobs SET run_after = ? WHERE image_id = ?", (datetime.utcnow(), image_id)
+        )
+
+
+def test_a_failed_job_backs_off_and_is_retried(client, tmp_path, monkeypatch, queue_image):
+    monkeypatch.setattr(job_queue, "ANALYSIS_RETRY_BASE_DELAY", 60)
+    analyzer = ScriptedAnalyzer(AnalysisError("Rate limited"), RuntimeError("Connection reset"), ANALYSIS)
+    queue = make_queue(tmp_path, analyzer)
+
+    assert client.portal.call(queue.run_next_job)
+    job = job_row(queue_image)
+    assert (job.status, job.attempts, job.last_error, job.image.analysis_status) == ("pending", 1, "Rate limited", "pending")
+    # 60 seconds with jitter of up to half
+    assert timedelta(seconds=29) < job.run_after - job.updated_at <= timedelta(seconds=60)
+    # Not due yet
+    assert not client.portal.call(queue.run_next_job)
+    assert analyzer.requests == 1
+
+    make_due(queue_image)
+    assert client.portal.call(queue.run_next_job)
+    job = job_row(queue_image)
+    assert (job.status, job.attempts, job.image.analysis_status) == ("pending", 2, "pending")
+    assert job.last_error == "Error analyzing image: Connection reset"
+    # The delay doubles with every attempt
+    assert timedelta(seconds=59) < job.run_after - job.updated_at <= timedelta(seconds=120)
+
+    make_due(queue_image)
+    assert client.portal.call(queue.run_next_job)
+    job = job_row(queue_image)
+    assert (job.status, job.attempts, job.last_error, job.image.analysis_status) == ("completed", 3, None, "completed")
+    assert client.get(f"/jobs/{job.id}").json()["status"] == "completed"
+    assert client.get(f"/groups/{job.image.group_id}").json()["files"][0]["analysis"]["content_analysis"] == ANALYSIS
+
+
+def test_a_job_fails_for_good_after_its_last_attempt(client, tmp_path, queue_image):
+    with database.engine.begin() as connection:
+        connection.exec_driver_sql("UPDATE analysis_jobs SET max_attempts = 1")
+    queue = make_queue(tmp_path, ScriptedAnalyzer(AnalysisError("Rate limited")))
+
+    assert client.portal.call(queue.run_next_job)
+    job = job_row(queue_image)
+    assert (job.status, job.attempts, job.image.analysis_status) == ("failed", 1, "failed")
+    assert job.finished_at is not None
+
+
+def test_claimed_jobs_are_not_claimed_again(client, queue_image):
+    async def claim():
+        async with AsyncSessionLocal() as db:
+            return [job.image_id for job in await crud.claim_analysis_jobs(db, 5)]
+
+    assert client.portal.call(claim) == [queue_image]
+    assert client.portal.call(claim) == []
+    job = job_row(queue_image)
+    assert (job.status, job.attempts, job.image.analysis_status) == ("running", 1, "running")
+
+
+def test_the_job_of_a_stalled_worker_is_requeued(client, tmp_path, monkeypatch, queue_image):
+    async def claim():
+        async with AsyncSessionLocal() as db:
+            return await crud.claim_analysis_jobs(db, 1)
+
+    # Claimed by a worker that never finishes it
+    assert client.portal.call(claim)
+    queue = make_queue(tmp_path, ScriptedAnalyzer(ANALYSIS))
+    assert client.portal.call(queue._requeue_stale_jobs) == 0
+    assert job_row(queue_image).status == "running"
+
+    with database.engine.begin() as connection:
+        connection.exec_driver_sql(
+            "UPDATE analysis_jobs SET started_at = ?",
+            (datetime.utcnow() - timedelta(seconds=job_queue.ANALYSIS_JOB_TIMEOUT + 1),)
+        )
+    assert client.portal.call(queue._requeue_stale_jobs) == 1
+    job = job_row(queue_image)
+    assert (job.status, job.image.analysis_status) == ("pending", "pending")
+
+    assert client.portal.call(queue.run_next_job)
+    job = job_row(queue_image)
+    assert (job.status, job.attempts) == ("completed", 2)
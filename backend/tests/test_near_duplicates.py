@@ -0,0 +1,58 @@
+import asyncio
+import io
+import math
+
+from PIL import Image, ImageDraw
+
+from services.near_duplicates import NearDuplicateIndex
+from services.perceptual_hash import dhash, hamming_distance, is_informative
+
+
+def plain(color) -> Image.Image:
+    return Image.new("RGB", (640, 480), color)
+
+
+def sky() -> Image.Image:
+    # Brighter towards the bottom only: no left-right gradient at all
+    image = Image.new("RGB", (640, 480))
+    draw = ImageDraw.Draw(image)
+    for y in range(480):
+        draw.line([(0, y), (639, y)], fill=(90 + y // 8, 150 + y // 8, 230))
+    return image
+
+
+def scene() -> Image.Image:
+    # Smooth structure everywhere, so re-encoding flips few comparisons
+    image = Image.new("L", (640, 480))
+    image.putdata([
+        int(127 + 60 * math.sin(x / 37 + y / 53) + 60 * math.sin(x / 23 - y / 41))
+        for y in range(480) for x in range(640)
+    ])
+    return image.convert("RGB")
+
+
+def reencoded(image: Image.Image) -> Image.Image:
+    buffer = io.BytesIO()
+    image.save(buffer, "JPEG", quality=60)
+    return Image.open(io.BytesIO(buffer.getvalue()))
+
+
+def test_featureless_images_are_not_informative():
+    hashes = [dhash(plain((220, 20, 20))), dhash(plain((20, 20, 220))), dhash(sky())]
+    assert hamming_distance(hashes[0], hashes[1]) == 0
+    assert not any(is_informative(value) for value in hashes)
+    assert is_informative(dhash(scene()))
+
+
+def test_featureless_images_are_neither_clustered_nor_reused():
+    index = NearDuplicateIndex()
+    index.add(1, 1, dhash(plain((220, 20, 20))))
+    index.add(2, 1, dhash(plain((20, 20, 220))))
+    index.add(3, 1, dhash(sky()))
+    index.add(4, 2, dhash(scene()))
+    index.add(5, 2, dhash(reencoded(scene())))
+
+    assert index._clusters(list(index.groups), 6) == [[4, 5]]
+    assert index.stats()["uninformative"] == 3
+    # Returns before looking anything up, so no database is needed
+    assert asyncio.run(index.find_analyzed(None, dhash(sky()))) is None
@@ -0,0 +1,111 @@
+import base64
+import json
+from datetime import datetime, timedelta
+
+import pytest
+
+import database
+import models
+
+
+def cursor(*values) -> str:
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode().rstrip("=")
+
+
+@pytest.mark.parametrize("value", [
+    "not base64!",
+    cursor(1),
+    cursor(1, 2, 3),
+    cursor("yesterday", 1),
+    base64.urlsafe_b64encode(b'{"id": 1}').decode(),
+])
+def test_malformed_group_cursor_is_a_bad_request(client, value):
+    response = client.get("/groups", params={"cursor": value})
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Invalid cursor"
+
+
+def add_groups(count: int, created_at: datetime) -> None:
+    with database.SessionLocal() as db:
+        for index in range(count):
+            db.add(models.ImageGroup(title=f"Group {index}", directory_name=f"{created_at:%Y%m%d_%H%M}_{index}", created_at=created_at))
+        db.commit()
+
+
+def add_images(group_title: str, positions, taken_at: datetime) -> int:
+    with database.SessionLocal() as db:
+        group = models.ImageGroup(title=group_title, directory_name=group_title.lower(), created_at=taken_at)
+        group.images = [
+            models.Image(
+                original_filename=f"{index}.jpg", stored_filename=f"{index}.jpg", content_type="image/jpeg",
+                file_size=100, width=4, height=3, format="JPEG", date_taken=taken_at,
+                gps_latitude=latitude, gps_longitude=longitude, analysis_status="completed"
+            )
+            for index, (latitude, longitude) in enumerate(positions)
+        ]
+        db.add(group)
+        db.commit()
+        return group.id
+
+
+def pages(client, url: str, key: str, **params) -> list:
+    """Items of every page of ``url``, following ``next_cursor`` to the end."""
+    items, cursor = [], None
+    while True:
+        response = client.get(url, params={**params, **({"cursor": cursor} if cursor else {})})
+        assert response.status_code == 200
+        page = response.json()
+        assert len(page[key]) <= params["limit"]
+        items.extend(page[key])
+        cursor = page["next_cursor"]
+        if cursor is None:
+            return items
+
+
+def test_groups_created_at_the_same_time_are_paged_by_id(client):
+    created_at = datetime(2024, 5, 1, 12, 0)
+    add_groups(7, created_at)
+    add_groups(2, created_at + timedelta(hours=1))
+
+    groups = pages(client, "/groups", "groups", limit=2)
+    ids = [group["id"] for group in groups]
+    # Newest first, ties broken by ID, every group exactly once
+    assert ids == [9, 8, 7, 6, 5, 4, 3, 2, 1]
+    assert pages(client, "/groups", "groups", limit=4) == groups
+
+
+def test_group_images_round_trip_through_cursors(client):
+    group_id = add_images("Trip", [(None, None)] * 7, datetime(2024, 5, 1, 12, 0))
+    ids = [image["id"] for image in pages(client, f"/groups/{group_id}", "files", limit=3, fields="id")]
+    assert ids == sorted(ids) and len(set(ids)) == 7
+
+
+def test_image_search_pages_through_ties(client):
+    taken_at = datetime(2024, 5, 1, 12, 0)
+    add_images("Trip", [(48.85, 2.35)] * 5, taken_at)
+    add_images("Hike", [(48.85, 2.35)] * 2 + [(48.9, 2.4)] * 2, taken_at)
+
+    by_date = [image["id"] for image in pages(client, "/images/search", "images", limit=2, fields="id", **{"from": "2024-05-01"})]
+    assert by_date == list(range(1, 10))
+    by_position = pages(client, "/images/search", "images", limit=3, fields="id,metadata", bbox="2,48,3,49")
+    assert [image["id"] for image in by_position] == [1, 2, 3, 4, 5, 6, 7, 8, 9]
+    assert by_position[-1]["analysis"]["metadata"]["gps"] == {"latitude": 48.9, "longitude": 2.4}
+
+
+@pytest.mark.parametrize("url, params, value", [
+    ("/groups/1", {}, "not base64!"),
+    ("/groups/1", {}, cursor("1")),
+    ("/groups/1", {}, cursor(1, 2)),
+    ("/images/search", {"from": "2024-01-01"}, cursor(1)),
+    ("/images/search", {"from": "2024-01-01"}, cursor("yesterday", 1)),
+    ("/images/search", {"bbox": "2,48,3,49"}, cursor("2024-01-01T00:00:00", 1)),
+    ("/suggested-groups", {}, cursor(1.5, 1)),
+    ("/suggested-groups", {}, cursor(1)),
+    ("/search", {"q": "beach"}, cursor("best", 1)),
+    ("/search", {"q": "beach"}, base64.urlsafe_b64encode(b'"text"').decode()),
+])
+def test_malformed_cursors_are_bad_requests(client, url, params, value):
+    add_images("Trip", [(None, None)], datetime(2024, 5, 1, 12, 0))
+    response = client.get(url, params={**params, "cursor": value})
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Invalid cursor"
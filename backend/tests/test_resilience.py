@@ -0,0 +1,76 @@
+import asyncio
+
+import pytest
+
+from services.analysis_backends import AnalysisBackend
+from services.resilience import CircuitBreaker
+
+
+class ScriptedBackend(AnalysisBackend):
+    name = "scripted"
+
+    def __init__(self, analyze):
+        super().__init__(concurrency=1)
+        self._analyze = analyze
+
+    async def analyze(self, prepared, image_path):
+        return await self._analyze()
+
+
+def half_open_backend(analyze) -> ScriptedBackend:
+    backend = ScriptedBackend(analyze)
+    # Opens on the first failure and lets a trial through right away
+    backend.circuit = CircuitBreaker(failure_threshold=1, reset_timeout=0.0)
+    backend.circuit.record_failure()
+    assert backend.circuit.state == "open"
+    return backend
+
+
+def test_trial_that_raises_an_unexpected_error_reopens_the_circuit():
+    async def analyze():
+        raise TypeError("unexpected response shape")
+
+    backend = half_open_backend(analyze)
+    with pytest.raises(TypeError):
+        asyncio.run(backend.run(None, None))
+
+    assert backend.circuit.state == "open"
+    # The reset timeout is zero, so the next call is the next trial
+    assert backend.circuit.allow()
+
+
+def test_cancelled_trial_lets_the_next_call_through():
+    async def scenario(backend):
+        task = asyncio.create_task(backend.run(None, None))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    async def analyze():
+        await asyncio.Event().wait()
+
+    backend = half_open_backend(analyze)
+    asyncio.run(scenario(backend))
+
+    assert backend.circuit.state == "half_open"
+    assert backend.circuit.allow()
+
+
+def test_successful_trial_closes_the_circuit():
+    async def analyze():
+        return {"description": "ok"}
+
+    backend = half_open_backend(analyze)
+    assert asyncio.run(backend.run(None, None)) == {"description": "ok"}
+    assert backend.circuit.state == "closed"
+
+
+def test_release_trial_keeps_the_state():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.0)
+    breaker.record_failure()
+    assert breaker.allow()
+    assert not breaker.allow()
+    breaker.release_trial()
+    assert breaker.state == "half_open"
+    assert breaker.allow()
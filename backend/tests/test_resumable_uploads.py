@@ -0,0 +1,170 @@
+import asyncio
+import base64
+import io
+from datetime import datetime, timedelta
+
+from PIL import Image
+from starlette.requests import ClientDisconnect
+
+import database
+import main
+from services.resumable_uploads import receive_chunks
+
+TUS_HEADERS = {"Tus-Resumable": "1.0.0"}
+PATCH_HEADERS = {**TUS_HEADERS, "Content-Type": "application/offset+octet-stream"}
+
+
+def jpeg(size=(1200, 900)) -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGB", size, (200, 40, 40)).save(buffer, "JPEG")
+    return buffer.getvalue()
+
+
+def open_session(client, title="Phone dump") -> dict:
+    response = client.post("/upload-sessions", data={"group_title": title})
+    assert response.status_code == 201
+    return response.json()
+
+
+def create_file(client, session: dict, length: int, filename="IMG_0001.jpg") -> str:
+    metadata = "filename " + base64.b64encode(filename.encode()).decode()
+    response = client.post(
+        session["upload_url"], headers={**TUS_HEADERS, "Upload-Length": str(length), "Upload-Metadata": metadata}
+    )
+    assert response.status_code == 201
+    return response.headers["Location"]
+
+
+def send(client, url: str, offset: int, body: bytes):
+    return client.patch(url, content=body, headers={**PATCH_HEADERS, "Upload-Offset": str(offset)})
+
+
+def test_a_dropped_body_keeps_the_bytes_received(tmp_path):
+    data = jpeg()
+    partial = tmp_path / "partial"
+    # Bytes past the recorded offset, from a request that was never counted
+    partial.write_bytes(data[:1000] + b"garbage")
+
+    async def dropped():
+        yield data[1000:3000]
+        yield data[3000:5000]
+        raise ClientDisconnect()
+
+    offset = asyncio.run(receive_chunks(dropped(), partial, 1000, len(data), "IMG_0001.jpg"))
+    assert offset == 5000
+    assert partial.read_bytes() == data[:5000]
+
+    async def rest():
+        yield data[5000:]
+
+    assert asyncio.run(receive_chunks(rest(), partial, offset, len(data), "IMG_0001.jpg")) == len(data)
+    assert partial.read_bytes() == data
+
+
+def test_upload_resumes_from_the_offset_the_server_reports(client):
+    session = open_session(client)
+    data = jpeg()
+    url = create_file(client, session, len(data))
+    third = len(data) // 3
+
+    response = send(client, url, 0, data[:third])
+    assert response.status_code == 204
+    assert response.headers["Upload-Offset"] == str(third)
+
+    # After a dropped connection the client asks where to continue
+    response = client.head(url, headers=TUS_HEADERS)
+    assert response.headers["Upload-Offset"] == str(third)
+    assert response.headers["Upload-Length"] == str(len(data))
+
+    response = send(client, url, third, data[third:])
+    assert response.status_code == 200
+    saved = response.json()
+    assert saved["original_name"] == "IMG_0001.jpg"
+
+    group = client.get(f"/groups/{session['group_id']}").json()
+    assert [image["id"] for image in group["files"]] == [saved["id"]]
+
+
+def test_patch_at_another_offset_is_a_conflict(client):
+    session = open_session(client)
+    data = jpeg()
+    url = create_file(client, session, len(data))
+    assert send(client, url, 0, data[:1000]).status_code == 204
+
+    # A retry of the first request, which the server has already counted
+    response = send(client, url, 0, data[:2000])
+    assert response.status_code == 409
+    assert client.head(url, headers=TUS_HEADERS).headers["Upload-Offset"] == "1000"
+
+
+def test_body_longer_than_the_declared_length_fails_the_file(client):
+    session = open_session(client)
+    data = jpeg()
+    url = create_file(client, session, 1000)
+
+    response = send(client, url, 0, data[:1500])
+    assert response.status_code == 422
+    assert "longer than its declared length" in response.json()["detail"]
+    assert send(client, url, 0, data[:1000]).status_code == 422
+
+
+def test_body_that_is_not_an_image_fails_the_file(client):
+    session = open_session(client)
+    url = create_file(client, session, 100, filename="notes.jpg")
+
+    response = send(client, url, 0, b"x" * 60)
+    assert response.status_code == 422
+    assert response.json()["detail"] == "notes.jpg is not an image file"
+    assert send(client, url, 60, b"x" * 40).status_code == 422
+
+
+def test_finalize_reports_incomplete_files(client):
+    session = open_session(client)
+    data = jpeg()
+    complete = create_file(client, session, len(data), filename="complete.jpg")
+    incomplete = create_file(client, session, len(data), filename="incomplete.jpg")
+    assert send(client, complete, 0, data).status_code == 200
+    assert send(client, incomplete, 0, data[:1000]).status_code == 204
+    partial = main.resumable_uploads.partial_path(incomplete.rsplit("/", 1)[1])
+    assert partial.exists()
+
+    response = client.post(f"/upload-sessions/{session['session_id']}/finalize")
+    assert response.status_code == 200
+    result = response.json()
+    assert result["status"] == "finalized"
+    assert [file["original_name"] for file in result["saved_files"]] == ["complete.jpg"]
+    assert result["errors"] == ["incomplete.jpg was not completely uploaded"]
+    assert not partial.exists()
+
+    # Closed to further data and to new files
+    assert send(client, incomplete, 1000, data[1000:]).status_code == 422
+    metadata = "filename " + base64.b64encode(b"late.jpg").decode()
+    response = client.post(
+        session["upload_url"], headers={**TUS_HEADERS, "Upload-Length": "10", "Upload-Metadata": metadata}
+    )
+    assert response.status_code == 409
+
+
+def test_cleanup_removes_an_abandoned_session_and_its_empty_group(client):
+    abandoned = open_session(client, title="Abandoned")
+    kept = open_session(client, title="Kept")
+    data = jpeg()
+    partial_url = create_file(client, abandoned, len(data))
+    assert send(client, partial_url, 0, data[:1000]).status_code == 204
+    assert send(client, create_file(client, kept, len(data)), 0, data).status_code == 200
+    partial = main.resumable_uploads.partial_path(partial_url.rsplit("/", 1)[1])
+
+    with database.engine.begin() as connection:
+        connection.exec_driver_sql(
+            "UPDATE upload_sessions SET expires_at = ?", (datetime.utcnow() - timedelta(seconds=1),)
+        )
+    assert client.head(partial_url, headers=TUS_HEADERS).status_code == 410
+
+    counts = client.portal.call(main.resumable_uploads.cleanup)
+    assert counts["sessions"] == 2
+    assert counts["groups"] == 1
+    assert not partial.exists()
+    assert client.get(f"/groups/{abandoned['group_id']}").status_code == 404
+    # A group with stored files outlives its session
+    assert client.get(f"/groups/{kept['group_id']}").status_code == 200
+    assert client.get(f"/upload-sessions/{kept['session_id']}").status_code == 404
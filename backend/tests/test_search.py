@@ -0,0 +1,129 @@
+from pathlib import Path
+
+import pytest
+from alembic import command
+from alembic.config import Config
+from fastapi.testclient import TestClient
+
+import crud
+import database
+import main
+import models
+from database import AsyncSessionLocal
+from services import search
+
+ALEMBIC_DIR = Path(__file__).resolve().parent.parent / "alembic"
+
+
+def drop_schema() -> None:
+    models.Base.metadata.drop_all(database.engine)
+    with database.engine.begin() as connection:
+        connection.exec_driver_sql("DROP TABLE IF EXISTS image_search_fts")
+        connection.exec_driver_sql("DROP TABLE IF EXISTS alembic_version")
+
+
+@pytest.fixture
+def migrated_client():
+    """Test client on a database built by the migrations, full-text index included."""
+    drop_schema()
+    # Without an ini file, so that the test run's logging is left alone
+    config = Config()
+    config.set_main_option("script_location", str(ALEMBIC_DIR))
+    command.upgrade(config, "head")
+    with TestClient(main.app) as test_client:
+        yield test_client
+    drop_schema()
+
+
+def analysis(description: str, *key_elements: str) -> dict:
+    return {"description": description, "key_elements": list(key_elements), "location_type": "outdoor"}
+
+
+def add_images(client, analyses) -> list:
+    async def insert():
+        async with AsyncSessionLocal() as db:
+            group = await crud.create_image_group(db, "Trip", "trip", commit=False)
+            outcomes = await crud.create_images_bulk(db, group.id, [
+                dict(
+                    original_filename=f"{index}.jpg", stored_filename=f"{index}.jpg", content_type="image/jpeg",
+                    file_size=100, metadata={}, content_analysis=content_analysis, analysis_status="completed"
+                )
+                for index, content_analysis in enumerate(analyses)
+            ])
+            return [outcome["id"] for outcome in outcomes]
+
+    return client.portal.call(insert)
+
+
+def hits(client, q: str, **params) -> list:
+    response = client.get("/search", params={"q": q, "fields": "id", **params})
+    assert response.status_code == 200
+    return [result["id"] for result in response.json()["results"]]
+
+
+def test_index_follows_inserts_updates_and_deletes(migrated_client):
+    client = migrated_client
+    beach, forest, failed = add_images(client, [
+        analysis("Waves breaking on a sandy beach", "surf", "sand"),
+        analysis("A path through a pine forest", "trees"),
+        {"error": "Analysis failed", "description": "Failed to analyze image content"},
+    ])
+    assert hits(client, "beach") == [beach]
+    assert hits(client, "sand") == [beach]
+    # Prefix match on the last word, as typed
+    assert hits(client, "for") == [forest]
+    assert hits(client, "analyze") == []
+
+    async def update():
+        async with AsyncSessionLocal() as db:
+            await crud.update_images_bulk(db, [
+                {"id": forest, "content_analysis": analysis("Children playing on the beach"), "analysis_status": "completed"},
+                {"id": failed, "content_analysis": analysis("Dunes behind the beach"), "analysis_status": "completed"},
+            ])
+
+    client.portal.call(update)
+    assert sorted(hits(client, "beach")) == [beach, forest, failed]
+    assert hits(client, "forest") == []
+
+    with database.engine.begin() as connection:
+        connection.exec_driver_sql("DELETE FROM images WHERE id = ?", (beach,))
+    assert sorted(hits(client, "beach")) == [forest, failed]
+    assert hits(client, "sand") == []
+
+
+def test_search_pages_through_every_match_best_first(migrated_client):
+    client = migrated_client
+    ids = add_images(client, [
+        analysis(f"Boats in a harbor {'at dusk ' * index}", *["harbor"] * (5 - index)) for index in range(5)
+    ] + [analysis("A mountain lake")])
+
+    results, cursor = [], None
+    while True:
+        params = {"limit": 2, "cursor": cursor} if cursor else {"limit": 2}
+        page = client.get("/search", params={"q": "harbor", "fields": "id", **params}).json()
+        assert not page["truncated"]
+        results.extend(page["results"])
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+
+    assert sorted(result["id"] for result in results) == ids[:5]
+    scores = [result["score"] for result in results]
+    assert scores == sorted(scores, reverse=True)
+    # More mentions rank higher
+    assert results[0]["id"] == ids[0]
+
+
+def test_only_the_newest_candidates_are_ranked(migrated_client, monkeypatch):
+    client = migrated_client
+    ids = add_images(client, [analysis("Snow on the roofs") for _ in range(4)])
+    monkeypatch.setattr(search, "SEARCH_MAX_CANDIDATES", 3)
+
+    response = client.get("/search", params={"q": "snow", "fields": "id"}).json()
+    assert response["truncated"]
+    assert sorted(result["id"] for result in response["results"]) == ids[1:]
+
+    monkeypatch.setattr(search, "SEARCH_MAX_CANDIDATES", 4)
+    response = client.get("/search", params={"q": "snow", "fields": "id"}).json()
+    assert not response["truncated"]
+    assert sorted(result["id"] for result in response["results"]) == ids
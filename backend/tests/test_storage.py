@@ -0,0 +1,225 @@
+import asyncio
+import hashlib
+import io
+import os
+import zipfile
+
+import boto3
+import pytest
+from moto import mock_aws
+from PIL import Image
+
+from services.storage import S3BlobStore, blob_key
+
+BUCKET = "photos"
+
+
+@pytest.fixture
+def s3(monkeypatch):
+    for name in ("AWS_ACCESS_KEY_ID", "AWS_SECRET_ACCESS_KEY"):
+        monkeypatch.setenv(name, "testing")
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+    with mock_aws():
+        client = boto3.client("s3", region_name="us-east-1")
+        client.create_bucket(Bucket=BUCKET)
+        yield client
+
+
+def make_store(tmp_path, cache_bytes=10 * 1024 * 1024) -> S3BlobStore:
+    return S3BlobStore(
+        bucket=BUCKET, prefix="blobs/", endpoint_url=None, region="us-east-1",
+        cache_dir=tmp_path / "cache", cache_bytes=cache_bytes
+    )
+
+
+def put(store: S3BlobStore, tmp_path, data: bytes, keep_source=False):
+    source = tmp_path / "upload.part"
+    source.write_bytes(data)
+    key = blob_key(hashlib.sha256(data).hexdigest(), "image/jpeg")
+    return key, asyncio.run(store.put(source, key, "image/jpeg", keep_source=keep_source))
+
+
+def test_put_stores_each_blob_once(s3, tmp_path):
+    store = make_store(tmp_path)
+    key, created = put(store, tmp_path, b"a" * 100)
+    assert created
+    assert not (tmp_path / "upload.part").exists()
+    assert put(store, tmp_path, b"a" * 100, keep_source=True) == (key, False)
+    assert (tmp_path / "upload.part").exists()
+
+    stored = s3.head_object(Bucket=BUCKET, Key=f"blobs/{key}")
+    assert stored["ContentType"] == "image/jpeg"
+    assert asyncio.run(store.exists(key))
+    assert not asyncio.run(store.exists(blob_key("0" * 64, "image/jpeg")))
+
+
+def test_local_path_downloads_into_the_cache(s3, tmp_path):
+    store = make_store(tmp_path)
+    key, _ = put(store, tmp_path, b"a" * 100)
+
+    path = asyncio.run(store.local_path(key))
+    assert path == tmp_path / "cache" / key
+    assert path.read_bytes() == b"a" * 100
+    with pytest.raises(FileNotFoundError):
+        asyncio.run(store.local_path(blob_key("0" * 64, "image/jpeg")))
+
+
+def test_size_and_ranges_are_read_from_the_bucket(s3, tmp_path):
+    store = make_store(tmp_path)
+    data = bytes(range(256)) * 40
+    key, _ = put(store, tmp_path, data)
+
+    async def read(start, stop):
+        return b"".join([chunk async for chunk in store.read(key, start, stop, chunk_size=1000)])
+
+    assert asyncio.run(store.size(key)) == len(data)
+    assert asyncio.run(read(100, 5000)) == data[100:5000]
+    assert not (tmp_path / "cache" / key).exists()
+    with pytest.raises(FileNotFoundError):
+        asyncio.run(store.size(blob_key("0" * 64, "image/jpeg")))
+
+
+def test_least_recently_used_downloads_are_evicted(s3, tmp_path):
+    store = make_store(tmp_path, cache_bytes=300)
+    keys = [put(store, tmp_path, bytes([value]) * (100 + value))[0] for value in range(3)]
+
+    first, second = (asyncio.run(store.local_path(key)) for key in keys[:2])
+    os.utime(first, (1, 1))
+    os.utime(second, (2, 2))
+    third = asyncio.run(store.local_path(keys[2]))
+
+    # 303 bytes are over the limit; removing the oldest brings them under 80% of it
+    assert not first.exists()
+    assert second.exists() and third.exists()
+
+
+def test_downloads_in_use_are_not_evicted(s3, tmp_path):
+    store = make_store(tmp_path, cache_bytes=150)
+    keys = [put(store, tmp_path, bytes([value]) * 100)[0] for value in range(3)]
+
+    async def read_while_downloading():
+        async with store.local_file(keys[0]) as path:
+            os.utime(path, (1, 1))
+            for key in keys[1:]:
+                await store.local_path(key)
+            return path.read_bytes()
+
+    assert asyncio.run(read_while_downloading()) == bytes([0]) * 100
+    # Released, it is the first to go
+    asyncio.run(store.local_path(keys[1]))
+    assert not (tmp_path / "cache" / keys[0]).exists()
+
+
+def jpeg(color) -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGB", (320, 240), color).save(buffer, "JPEG")
+    return buffer.getvalue()
+
+
+def test_export_streams_blobs_from_the_bucket(s3, tmp_path, client, monkeypatch):
+    import main
+
+    store = make_store(tmp_path)
+    monkeypatch.setattr(main, "storage", store)
+    images = [jpeg((200, 0, 0)), jpeg((0, 200, 0))]
+    response = client.post(
+        "/upload",
+        data={"group_title": "Trip"},
+        files=[("files", (f"{index}.jpg", data, "image/jpeg")) for index, data in enumerate(images)]
+    )
+    uploaded = response.json()
+    group_id = uploaded["group_id"]
+    assert len(s3.list_objects_v2(Bucket=BUCKET, Prefix="blobs/")["Contents"]) == 2
+
+    # Without the sidecar, which changes while the uploads are being analyzed
+    url = f"/groups/{group_id}/export?metadata=false"
+    export = client.get(url)
+    assert export.status_code == 200
+    archive = zipfile.ZipFile(io.BytesIO(export.content))
+    assert archive.testzip() is None
+    for entry, data in zip(uploaded["saved_files"], images):
+        assert archive.read(entry["saved_name"]) == data
+
+    resumed = client.get(url, headers={"Range": "bytes=100-", "If-Range": export.headers["ETag"]})
+    assert resumed.status_code == 206
+    assert resumed.content == export.content[100:]
+    # Read from the bucket, not downloaded into the cache first
+    assert not list((tmp_path / "cache").rglob("*.jpg"))
+
+    # A blob gone from the bucket is left out, not fatal
+    s3.delete_object(Bucket=BUCKET, Key=f"blobs/{blob_key(hashlib.sha256(images[0]).hexdigest(), 'image/jpeg')}")
+    export = client.get(url)
+    names = zipfile.ZipFile(io.BytesIO(export.content)).namelist()
+    assert names == [uploaded["saved_files"][1]["saved_name"]]
+
+
+def test_only_group_directories_are_served_under_uploads(client):
+    import main
+
+    assert main.UPLOADS_DIR.resolve() not in main.storage.root.resolve().parents
+    for directory in ("_blobs", "_cache/.staging", "Trip_20240101"):
+        (main.UPLOADS_DIR / directory).mkdir(parents=True, exist_ok=True)
+        (main.UPLOADS_DIR / directory / "a.jpg").write_bytes(jpeg((0, 0, 200)))
+
+    assert client.get("/uploads/Trip_20240101/a.jpg").status_code == 200
+    assert client.get("/uploads/_blobs/a.jpg").status_code == 404
+    assert client.get("/uploads/_cache/.staging/a.jpg").status_code == 404
+    assert client.get("/uploads/Trip_20240101/../_blobs/a.jpg").status_code == 404
+
+
+def test_blobs_of_unsaved_uploads_are_deleted(client, monkeypatch):
+    import crud
+    import main
+
+    kept = jpeg((10, 20, 30))
+    response = client.post("/upload", data={"group_title": "First"}, files=[("files", ("kept.jpg", kept, "image/jpeg"))])
+    assert response.json()["saved_files"]
+
+    async def failing_insert(db, group_id, images, max_attempts=5):
+        await db.commit()
+        return [{"error": "constraint failed"} for _ in images]
+
+    monkeypatch.setattr(crud, "create_images_bulk", failing_insert)
+    lost = jpeg((200, 200, 0))
+    response = client.post(
+        "/upload",
+        data={"group_title": "Second"},
+        files=[("files", ("again.jpg", kept, "image/jpeg")), ("files", ("lost.jpg", lost, "image/jpeg"))]
+    )
+    assert len(response.json()["errors"]) == 2
+
+    # The blob of the earlier identical upload stays, the new one goes
+    assert asyncio.run(main.storage.exists(blob_key(hashlib.sha256(kept).hexdigest(), "image/jpeg")))
+    assert not asyncio.run(main.storage.exists(blob_key(hashlib.sha256(lost).hexdigest(), "image/jpeg")))
+
+
+def test_delete_orphans_removes_old_unreferenced_blobs(client):
+    import backfill
+    import main
+
+    stored = jpeg((10, 20, 30))
+    response = client.post("/upload", data={"group_title": "Trip"}, files=[("files", ("a.jpg", stored, "image/jpeg"))])
+    assert response.json()["saved_files"]
+    keys = []
+    for value in range(2):
+        data = bytes([value]) * 100
+        key, _ = put(main.storage, main.storage.staging_dir, data)
+        keys.append(key)
+    # Only the first is old enough to be past any upload still writing its row
+    os.utime(main.storage.path(keys[0]), (1, 1))
+
+    counts = client.portal.call(backfill.find_orphans, main.UPLOADS_DIR, main.storage, True)
+    # Blobs of earlier tests outlive their database, but are all recent
+    assert counts["orphan_blobs"] >= 2
+    assert counts["deleted_blobs"] == 1
+    assert not main.storage.path(keys[0]).exists()
+    assert main.storage.path(keys[1]).exists()
+    assert asyncio.run(main.storage.exists(blob_key(hashlib.sha256(stored).hexdigest(), "image/jpeg")))
+
+
+def test_s3_store_lists_its_blobs(s3, tmp_path):
+    store = make_store(tmp_path)
+    key, _ = put(store, tmp_path, b"a" * 100)
+    s3.put_object(Bucket=BUCKET, Key="blobs/not-a-blob.txt", Body=b"x")
+    s3.put_object(Bucket=BUCKET, Key=f"other/{key}", Body=b"x")
+    assert [listed for listed, _ in store.list_blobs()] == [key]
@@ -1,5 +1,7 @@
-import React, { useState, useEffect, useCallback } from 'react';
+import React, { useState, useEffect, useCallback, useRef } from 'react';
 import './App.css';
+import { uploadResumable } from './resumableUpload';
+import { FINISHED_STATUSES, pollAnalysis } from './analysisStatus';
 
 function App() {
   const [selectedFiles, setSelectedFiles] = useState([]);
@@ -10,10 +12,16 @@ function App() {
   const [error, setError] = useState(null);
   const [previewUrls, setPreviewUrls] = useState([]);
   const [uploadedGroup, setUploadedGroup] = useState(null);
+  const [uploadProgress, setUploadProgress] = useState(null);
+  // Bumped by every upload and on unmount, which ends the polling of the previous one
+  const pollGeneration = useRef(0);
 
   useEffect(() => {
     // Fetch groups on component mount
     fetchGroups();
+    return () => {
+      pollGeneration.current += 1;
+    };
   }, []);
 
   const fetchGroups = async () => {
@@ -38,6 +46,23 @@ function App() {
     }
   };
 
+  const loadMoreGroupFiles = async () => {
+    try {
+      const response = await fetch(
+        `http://localhost:8000/groups/${selectedGroup.id}?cursor=${encodeURIComponent(selectedGroup.next_cursor)}`
+      );
+      const data = await response.json();
+      setSelectedGroup(prevGroup => ({
+        ...prevGroup,
+        files: [...prevGroup.files, ...data.files],
+        next_cursor: data.next_cursor
+      }));
+    } catch (err) {
+      setError('Failed to fetch group details');
+      console.error('Error fetching group details:', err);
+    }
+  };
+
   const handleDrop = useCallback((e) => {
     e.preventDefault();
     const files = Array.from(e.dataTransfer.files).filter(file => file.type.startsWith('image/'));
@@ -82,19 +107,11 @@ function App() {
       return;
     }
 
-    const formData = new FormData();
-    formData.append('group_title', groupTitle);
-    selectedFiles.forEach(file => {
-      formData.append('files', file);
-    });
-
     try {
-      const response = await fetch('http://localhost:8000/upload', {
-        method: 'POST',
-        body: formData,
+      // Sent in resumable chunks, so a dropped connection does not restart the batch
+      const result = await uploadResumable(groupTitle, selectedFiles, (sent, total) => {
+        setUploadProgress(total > 0 ? Math.round((sent / total) * 100) : 100);
       });
-
-      const result = await response.json();
       console.log('Upload response:', result);
       
       if (result.errors && result.errors.length > 0) {
@@ -107,14 +124,31 @@ function App() {
         const imageUrl = file.url.startsWith('http') ? file.url : `http://localhost:8000${file.url}`;
         return {
           type: 'server',
+          id: file.id,
           url: imageUrl,
-          analysis: file.analysis
+          analysis: file.analysis,
+          analysisStatus: file.analysis_status
         };
       });
 
       console.log('Server URLs:', serverUrls);
       setPreviewUrls(serverUrls);
       setUploadedGroup(result);
+
+      // Content analysis arrives later; show it as each image is done
+      const generation = ++pollGeneration.current;
+      const waiting = serverUrls
+        .filter(preview => !FINISHED_STATUSES.includes(preview.analysisStatus))
+        .map(preview => preview.id);
+      if (waiting.length > 0) {
+        pollAnalysis(result.group_id, waiting, files => {
+          const updates = new Map(files.map(file => [file.id, file]));
+          setPreviewUrls(prev => prev.map(preview => {
+            const file = updates.get(preview.id);
+            return file ? { ...preview, analysis: file.analysis, analysisStatus: file.analysis_status } : preview;
+          }));
+        }, () => generation !== pollGeneration.current);
+      }
       
       // Clear form
       setSelectedFiles([]);
@@ -125,6 +159,7 @@ function App() {
       console.error('Upload error:', err);
     } finally {
       setLoading(false);
+      setUploadProgress(null);
     }
   };
 
@@ -250,7 +285,7 @@ function App() {
             </div>
 
             <button type="submit" disabled={loading || selectedFiles.length === 0}>
-              {loading ? 'Generating...' : 'Generate Blog Post'}
+              {loading ? (uploadProgress !== null && uploadProgress < 100 ? `Uploading... ${uploadProgress}%` : 'Generating...') : 'Generate Blog Post'}
             </button>
           </form>
 
@@ -341,6 +376,15 @@ function App() {
                             )}
                           </div>
                         )}
+                        {!FINISHED_STATUSES.includes(preview.analysisStatus) && (
+                          <div className="analysis-pending">
+                            <p>Analyzing image content...</p>
+                            <div className="metadata-placeholder">
+                              <div className="placeholder-line"></div>
+                              <div className="placeholder-line"></div>
+                            </div>
+                          </div>
+                        )}
                         {preview.analysis.content_analysis?.error && (
                           <div className="error-message">
                             <p>Failed to analyze image content: {preview.analysis.content_analysis.error}</p>
@@ -387,8 +431,9 @@ function App() {
               {selectedGroup.files.map(file => (
                 <div key={file.id} className="image-card">
                   <img 
-                    src={`http://localhost:8000/uploads/${selectedGroup.directory_name}/${file.filename}`}
+                    src={file.thumbnails?.['1024'] ? `http://localhost:8000${file.thumbnails['1024']}` : file.url.startsWith('http') ? file.url : `http://localhost:8000${file.url}`}
                     alt={file.original_filename}
+                    loading="lazy"
                   />
                   <div className="image-info">
                     <h4>{file.original_filename}</h4>
@@ -398,6 +443,9 @@ function App() {
                 </div>
               ))}
             </div>
+            {selectedGroup.next_cursor && (
+              <button onClick={loadMoreGroupFiles}>Load more</button>
+            )}
           </section>
         )}
       </main>
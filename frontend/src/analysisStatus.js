@@ -0,0 +1,70 @@
+// Content analysis runs in the background (see backend/services/job_queue.py):
+// uploads come back with analysis_status "pending" and no content_analysis.
+// The group is fetched again until every uploaded image has been analyzed or
+// has failed, one paged request per round however many images there are.
+
+const API_URL = 'http://localhost:8000';
+const POLL_INTERVAL = 3000;
+const PAGE_SIZE = 200;
+const FIELDS = 'id,analysis_status,metadata,content_analysis';
+
+export const FINISHED_STATUSES = ['completed', 'failed'];
+
+const sleep = (ms) => new Promise(resolve => setTimeout(resolve, ms));
+
+async function fetchGroupAnalyses(groupId) {
+  const analyses = new Map();
+  let cursor = null;
+  do {
+    const params = new URLSearchParams({ fields: FIELDS, limit: String(PAGE_SIZE) });
+    if (cursor) {
+      params.set('cursor', cursor);
+    }
+    const response = await fetch(`${API_URL}/groups/${groupId}?${params}`);
+    if (!response.ok) {
+      throw new Error(`Group request failed with ${response.status}`);
+    }
+    const data = await response.json();
+    data.files.forEach(file => analyses.set(file.id, file));
+    cursor = data.next_cursor;
+  } while (cursor);
+  return analyses;
+}
+
+// Calls onUpdate with the files ({ id, analysis_status, analysis }) whose
+// status changed, until none of imageIds is pending or running. Stops early
+// when isCancelled() returns true, e.g. after the next upload.
+export async function pollAnalysis(groupId, imageIds, onUpdate, isCancelled = () => false) {
+  const statuses = new Map(imageIds.map(id => [id, 'pending']));
+  const unfinished = () => Array.from(statuses.values()).some(status => !FINISHED_STATUSES.includes(status));
+
+  while (unfinished() && !isCancelled()) {
+    await sleep(POLL_INTERVAL);
+    let analyses;
+    try {
+      analyses = await fetchGroupAnalyses(groupId);
+    } catch (err) {
+      // Try again next round
+      console.error('Error polling analysis status:', err);
+      continue;
+    }
+    if (isCancelled()) {
+      return;
+    }
+
+    const changed = [];
+    statuses.forEach((status, id) => {
+      const file = analyses.get(id);
+      if (!file) {
+        // Deleted meanwhile
+        statuses.set(id, 'failed');
+      } else if (file.analysis_status !== status) {
+        statuses.set(id, file.analysis_status);
+        changed.push(file);
+      }
+    });
+    if (changed.length > 0) {
+      onUpdate(changed);
+    }
+  }
+}
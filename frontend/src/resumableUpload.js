@@ -0,0 +1,126 @@
+// Client for the backend's resumable upload sessions (tus protocol, see
+// backend/services/resumable_uploads.py). Files are sent in chunks; after a
+// failed request the offset is asked from the server and the file continues
+// from there, so a dropped connection only costs the chunk in flight.
+
+const API_URL = 'http://localhost:8000';
+const CHUNK_SIZE = 8 * 1024 * 1024;
+const PARALLEL_FILES = 3;
+const RETRY_DELAYS = [1000, 3000, 5000, 10000, 20000];
+
+const sleep = (ms) => new Promise(resolve => setTimeout(resolve, ms));
+
+const encodeMetadata = (value) => btoa(unescape(encodeURIComponent(value)));
+
+const tusHeaders = (headers = {}) => ({ 'Tus-Resumable': '1.0.0', ...headers });
+
+async function currentOffset(url) {
+  const response = await fetch(url, { method: 'HEAD', headers: tusHeaders() });
+  if (!response.ok) {
+    throw new Error(`Upload status request failed with ${response.status}`);
+  }
+  return parseInt(response.headers.get('Upload-Offset'), 10);
+}
+
+async function uploadFile(sessionUrl, file, onProgress) {
+  const created = await fetch(sessionUrl, {
+    method: 'POST',
+    headers: tusHeaders({
+      'Upload-Length': String(file.size),
+      'Upload-Metadata': `filename ${encodeMetadata(file.name)}`,
+    }),
+  });
+  if (!created.ok) {
+    const body = await created.json().catch(() => ({}));
+    throw new Error(body.detail || `Could not start uploading ${file.name}`);
+  }
+  const url = `${API_URL}${created.headers.get('Location')}`;
+
+  let offset = 0;
+  let failures = 0;
+  for (;;) {
+    let response;
+    try {
+      response = await fetch(url, {
+        method: 'PATCH',
+        headers: tusHeaders({
+          'Upload-Offset': String(offset),
+          'Content-Type': 'application/offset+octet-stream',
+        }),
+        body: file.slice(offset, offset + CHUNK_SIZE),
+      });
+    } catch (err) {
+      response = null;
+    }
+
+    if (response && response.status === 200) {
+      // The last chunk: the file is stored
+      onProgress(file.size);
+      return response.json();
+    }
+    if (response && response.status === 204) {
+      offset = parseInt(response.headers.get('Upload-Offset'), 10);
+      failures = 0;
+      onProgress(offset);
+      continue;
+    }
+    if (response && response.status >= 400 && response.status < 500 && ![409, 423].includes(response.status)) {
+      const body = await response.json().catch(() => ({}));
+      throw new Error(body.detail || `Failed to upload ${file.name}`);
+    }
+
+    // Network error, server error or offset mismatch: resume from what the server has
+    if (failures >= RETRY_DELAYS.length) {
+      throw new Error(`Failed to upload ${file.name}: connection lost`);
+    }
+    await sleep(RETRY_DELAYS[failures]);
+    failures += 1;
+    try {
+      offset = await currentOffset(url);
+    } catch (err) {
+      // Try again after the next delay
+    }
+  }
+}
+
+// Uploads files into a new group. onProgress receives the bytes sent so far
+// and the total. Resolves to the same shape as POST /upload.
+export async function uploadResumable(groupTitle, files, onProgress = () => {}) {
+  const form = new FormData();
+  form.append('group_title', groupTitle);
+  const response = await fetch(`${API_URL}/upload-sessions`, { method: 'POST', body: form });
+  if (!response.ok) {
+    throw new Error('Could not start the upload');
+  }
+  const session = await response.json();
+  const sessionUrl = `${API_URL}${session.upload_url}`;
+
+  const total = files.reduce((sum, file) => sum + file.size, 0);
+  const sent = new Map();
+  const reportProgress = (file, bytes) => {
+    sent.set(file, bytes);
+    onProgress(Array.from(sent.values()).reduce((sum, value) => sum + value, 0), total);
+  };
+
+  const errors = [];
+  const queue = [...files];
+  const worker = async () => {
+    while (queue.length > 0) {
+      const file = queue.shift();
+      try {
+        await uploadFile(sessionUrl, file, bytes => reportProgress(file, bytes));
+      } catch (err) {
+        errors.push(err.message);
+      }
+    }
+  };
+  await Promise.all(Array.from({ length: Math.min(PARALLEL_FILES, files.length) }, worker));
+
+  const finalized = await fetch(`${API_URL}/upload-sessions/${session.session_id}/finalize`, { method: 'POST' });
+  if (!finalized.ok) {
+    throw new Error('Could not finish the upload');
+  }
+  const result = await finalized.json();
+  // Files rejected before the server registered them are only known here
+  return { ...result, errors: [...errors.filter(error => !result.errors.includes(error)), ...result.errors] };
+}